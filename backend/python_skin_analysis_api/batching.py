@@ -0,0 +1,154 @@
+"""
+Dynamic micro-batching for the skin analysis model
+Concurrent requests are gathered into a single model call and each caller gets its own row back
+"""
+
+import itertools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Sentinel pushed onto the queue to wake the worker up on shutdown
+_STOP = object()
+
+
+class BatcherStoppedError(RuntimeError):
+    """Raised by submit() once the batcher has been stopped; nothing would ever score the image"""
+
+
+class MicroBatcher:
+    """Groups single-image requests into batches for one model call"""
+
+    def __init__(self, infer_fn, max_batch_size=8, max_wait_ms=5.0, on_batch=None):
+        """
+        infer_fn receives a stacked float32 array of shape (N, 224, 224, 3)
+        and must return an array of class probabilities of shape (N, num_classes),
+        or a tuple of such per-image arrays (e.g. probabilities and embeddings; None entries are allowed),
+        in which case each caller gets a tuple of its rows
+        on_batch, if given, is called as on_batch(batch_size, infer_seconds) after every model call
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.infer_fn = infer_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.on_batch = on_batch
+        # Reused for every model call; safe because infer_fn is synchronous on this one thread
+        self._batch_buffer = None
+        self._queue = queue.Queue()
+        self._thread = None
+        # Guards the stopped flag so no image is queued behind the stop sentinel
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def start(self):
+        """Start the background worker thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Micro-batcher started (max_batch_size={self.max_batch_size}, "
+            f"max_wait_ms={self.max_wait * 1000:.1f})"
+        )
+
+    def stop(self, timeout=None):
+        """Finish the work already queued, then stop the worker thread"""
+        with self._lock:
+            self._stopped = True
+            if self._thread is None:
+                return
+            self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, img_array, on_stacked=None):
+        """
+        Queue one preprocessed (224, 224, 3) image; returns a Future for its probability row
+        Once resolved, future.timings holds the seconds it spent queued and in the model call
+        on_stacked, if given, is called from the batcher thread as soon as img_array has been copied into a
+        batch (or skipped because the future was cancelled), before the model call; the caller may reuse it then
+        Raises BatcherStoppedError after stop()
+        """
+        future = Future()
+        future.submitted_at = time.perf_counter()
+        future.on_stacked = on_stacked
+        with self._lock:
+            if self._stopped:
+                raise BatcherStoppedError("The micro-batcher has been stopped")
+            self._queue.put((img_array, future))
+        return future
+
+    def _collect(self, first):
+        """Gather up to max_batch_size items, waiting at most max_wait after the first one"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Put it back so the run loop exits after this batch
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _stack(self, arrays):
+        """Stack images into the preallocated batch buffer instead of a fresh array per call"""
+        shape = arrays[0].shape
+        if self._batch_buffer is None or self._batch_buffer.shape[1:] != shape:
+            self._batch_buffer = np.empty((self.max_batch_size,) + shape, dtype=np.float32)
+        return np.stack(arrays, out=self._batch_buffer[:len(arrays)])
+
+    @staticmethod
+    def _notify_stacked(items):
+        for _, future in items:
+            if future.on_stacked is not None:
+                future.on_stacked()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+
+            collected = self._collect(first)
+            # Skip requests whose caller already gave up
+            batch = [(img_array, future) for img_array, future in collected if future.set_running_or_notify_cancel()]
+            if not batch:
+                self._notify_stacked(collected)
+                continue
+
+            started = time.perf_counter()
+            try:
+                try:
+                    inputs = self._stack([img_array for img_array, _ in batch])
+                finally:
+                    self._notify_stacked(collected)
+                outputs = self.infer_fn(inputs)
+            except Exception as e:
+                logger.error(f"Batched inference failed for {len(batch)} images: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            infer_seconds = time.perf_counter() - started
+
+            if self.on_batch is not None:
+                self.on_batch(len(batch), infer_seconds)
+            if isinstance(outputs, tuple):
+                rows = zip(*(itertools.repeat(None) if output is None else output for output in outputs))
+            else:
+                rows = outputs
+            for (_, future), row in zip(batch, rows):
+                future.timings = {"queue": started - future.submitted_at, "inference": infer_seconds}
+                future.set_result(row)
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Benchmark and load-test suite for the skin analysis pipeline
+
+    python benchmark.py stages --engine stub --output stages.json
+    python benchmark.py load --engine stub --output load.json
+    python benchmark.py all --engine keras --output results.json
+    python benchmark.py compare baseline.json results.json --threshold 0.10
+    python benchmark.py compiled --engine keras --batch-sizes 1 4 8
+
+`stages` times decode, resize, preprocess, forward pass and response build in-process.
+`compiled` compares the per-call latency of model.predict with the compiled, bucketed Keras function.
+`load` starts main.py under uvicorn and drives it with closed-loop and open-loop HTTP traffic.
+`compare` flags metrics that regressed by more than the threshold and exits non-zero.
+Use --engine stub to run without the model weights (e.g. on CI).
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_IMAGE_SIZES = ["640x480", "1920x1080", "4032x3024"]
+DEFAULT_BATCH_SIZES = [1, 4, 8]
+DEFAULT_CONCURRENCY = [1, 2, 4, 8, 16]
+DEFAULT_RATES = [5, 10, 20, 40, 80]
+
+
+# --- Helpers ---
+
+def make_jpeg(width, height, seed=0):
+    """Synthetic photo-like JPEG: smooth gradients plus noise, so it compresses like a real photo"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width * 200, y / height * 180, (x + y) / (width + height) * 160], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 12, size=base.shape), 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def summarize(samples_ms):
+    """Latency summary in milliseconds"""
+    if not samples_ms:
+        return {"count": 0}
+    values = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "count": int(values.size),
+        "mean": round(float(values.mean()), 3),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+    }
+
+
+def time_calls(fn, repeats, warmup=2):
+    """Run fn warmup + repeats times and return the per-call latencies in ms"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+# --- Per-stage micro-benchmarks ---
+
+def run_stage_benchmarks(args):
+    """Time each stage of the inference path in-process"""
+    os.chdir(SERVICE_DIR)
+    os.environ["SKIN_API_ENGINE"] = args.engine
+    sys.path.insert(0, SERVICE_DIR)
+    import predict_model
+    from preprocessing import IMAGE_SIZE, decode_image, resnet_preprocess
+
+    predict_model.load_model()
+    results = {"decode": {}, "resize": {}, "decode_reduced": {}, "preprocess": {}, "forward": {}, "response": {}}
+
+    for size in args.image_sizes:
+        width, height = parse_size(size)
+        encoded = make_jpeg(width, height)
+
+        def decode():
+            img = Image.open(io.BytesIO(encoded))
+            img.load()
+            return img.convert("RGB") if img.mode != "RGB" else img
+
+        decoded = decode()
+        results["decode"][size] = summarize(time_calls(decode, args.repeats))
+        results["resize"][size] = summarize(
+            time_calls(lambda: decoded.resize(IMAGE_SIZE, Image.NEAREST), args.repeats)
+        )
+        # The serving path: reduced-resolution decode straight to 224x224
+        results["decode_reduced"][size] = summarize(time_calls(lambda: decode_image(encoded), args.repeats))
+        print(f"  {size}: decode p50 {results['decode'][size]['p50']} ms, resize p50 {results['resize'][size]['p50']} ms, "
+              f"reduced decode + resize p50 {results['decode_reduced'][size]['p50']} ms")
+
+    pixels = np.asarray(Image.open(io.BytesIO(make_jpeg(*IMAGE_SIZE))).convert("RGB"), dtype=np.float32)
+    results["preprocess"]["224x224"] = summarize(time_calls(lambda: resnet_preprocess(pixels), args.repeats))
+
+    for batch_size in args.batch_sizes:
+        batch = np.stack([resnet_preprocess(pixels)] * batch_size)
+        samples = time_calls(lambda: predict_model.predict_batch_embeddings(batch), args.repeats)
+        summary = summarize(samples)
+        summary["images_per_second"] = round(batch_size * 1000 / summary["mean"], 2)
+        results["forward"][f"batch_{batch_size}"] = summary
+        print(f"  forward batch {batch_size}: p50 {summary['p50']} ms, {summary['images_per_second']} img/s")
+
+    probabilities = predict_model.predict_batch(np.expand_dims(resnet_preprocess(pixels), 0))[0]
+    results["response"]["build_and_serialize"] = summarize(
+        time_calls(lambda: predict_model.build_response_bytes(probabilities), args.repeats)
+    )
+    return results
+
+
+def run_compiled_benchmark(args):
+    """Per-call latency of model.predict versus the compiled fixed-signature function (keras engine only)"""
+    if args.engine != "keras":
+        print("  skipped: the compiled path comparison needs --engine keras")
+        return {}
+    os.chdir(SERVICE_DIR)
+    sys.path.insert(0, SERVICE_DIR)
+    import config
+    from engines import DEFAULT_PATHS, create_engine
+    from export_model import sample_batch
+
+    engine = create_engine("keras", config.SKIN_API_ENGINE_PATH or DEFAULT_PATHS["keras"]).load()
+    if not engine._buckets:
+        print("  skipped: SKIN_API_KERAS_COMPILED is off")
+        return {}
+    results = {"precision": config.SKIN_API_PRECISION, "xla": config.SKIN_API_XLA, "buckets": engine._buckets}
+    for batch_size in args.batch_sizes:
+        batch = sample_batch(batch_size)
+        # time_calls' own warm-up runs absorb tracing and XLA compilation
+        predict = summarize(time_calls(lambda: engine.model.predict(batch, verbose=0), args.repeats))
+        compiled = summarize(time_calls(lambda: engine.infer(batch), args.repeats))
+        results[f"batch_{batch_size}"] = {
+            "predict": predict,
+            "compiled": compiled,
+            "saved_ms_p50": round(predict["p50"] - compiled["p50"], 3),
+        }
+        print(f"  batch {batch_size}: model.predict p50 {predict['p50']} ms, compiled p50 {compiled['p50']} ms "
+              f"({predict['p50'] - compiled['p50']:+.2f} ms saved per call)")
+    return results
+
+
+# --- HTTP load generator ---
+
+def multipart_body(image_bytes):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="bench.jpg"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + image_bytes + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+class LoadClient:
+    """Sends prediction requests over keep-alive connections, one connection per thread"""
+
+    def __init__(self, host, port, images):
+        self.host = host
+        self.port = port
+        self.requests = [multipart_body(image) for image in images]
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self._local.conn = conn
+        return conn
+
+    def send(self):
+        """Return (latency_ms, ok)"""
+        body, content_type = random.choice(self.requests)
+        start = time.perf_counter()
+        try:
+            conn = self._connection()
+            conn.request("POST", "/predict-skin-lesion", body=body, headers={"Content-Type": content_type})
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            self._local.conn = None
+            ok = False
+        return (time.perf_counter() - start) * 1000, ok
+
+
+def closed_loop(client, concurrency, duration):
+    """`concurrency` clients each send back-to-back requests for `duration` seconds"""
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        nonlocal errors
+        while time.monotonic() < deadline:
+            latency, ok = client.send()
+            with lock:
+                if ok:
+                    latencies.append(latency)
+                else:
+                    errors += 1
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+    return {
+        **summarize(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 2),
+    }
+
+
+def open_loop(client, rate, duration, max_outstanding=512):
+    """Poisson arrivals at `rate` requests/s regardless of how fast the server answers"""
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def fire():
+        nonlocal errors
+        latency, ok = client.send()
+        with lock:
+            if ok:
+                latencies.append(latency)
+            else:
+                errors += 1
+
+    sent = 0
+    start = time.monotonic()
+    next_at = start
+    with ThreadPoolExecutor(max_workers=max_outstanding) as pool:
+        while next_at < start + duration:
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(fire)
+            sent += 1
+            next_at += random.expovariate(rate)
+    elapsed = time.monotonic() - start
+    return {
+        **summarize(latencies),
+        "offered_rate": rate,
+        "sent": sent,
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 2),
+    }
+
+
+def find_saturation(closed, opened, p99_budget_ms):
+    """
+    Closed loop: the concurrency after which extra clients add < 5% throughput
+    Open loop: the first offered rate the server can no longer keep up with or answer within budget
+    """
+    saturation = {"concurrency": None, "rate": None}
+    levels = sorted(closed, key=int)
+    for previous, current in zip(levels, levels[1:]):
+        if closed[current]["throughput"] < closed[previous]["throughput"] * 1.05:
+            saturation["concurrency"] = int(previous)
+            break
+    for rate in sorted(opened, key=float):
+        result = opened[rate]
+        keeping_up = result["throughput"] >= 0.95 * result["offered_rate"] and result["errors"] == 0
+        if not keeping_up or result.get("p99", float("inf")) > p99_budget_ms:
+            saturation["rate"] = float(rate)
+            break
+    return saturation
+
+
+def wait_until_ready(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=2)
+            conn.request("GET", "/readyz")
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.25)
+    return False
+
+
+def run_load_test(args):
+    """Start main.py locally and drive it with closed-loop and open-loop traffic"""
+    env = {
+        **os.environ,
+        "SKIN_API_ENGINE": args.engine,
+        # Every request must reach the model, so identical benchmark images must not be cached
+        "SKIN_API_CACHE_SIZE": "0",
+        "SKIN_API_CACHE_DB": "",
+        # No job queue or similar-case index: they would write into the service directory, and indexing
+        # every benchmark image would add to the latency being measured
+        "SKIN_API_JOBS_DB": "",
+        "SKIN_API_EMBEDDING_INDEX_DIR": "",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", args.host, "--port", str(args.port), "--log-level", "warning"],
+        cwd=SERVICE_DIR,
+        env=env,
+    )
+    try:
+        if not wait_until_ready(args.host, args.port, args.startup_timeout):
+            raise RuntimeError(f"Server did not become ready within {args.startup_timeout}s")
+
+        images = [make_jpeg(*parse_size(size), seed=seed) for seed, size in enumerate(args.image_sizes)]
+        client = LoadClient(args.host, args.port, images)
+
+        closed = {}
+        for concurrency in args.concurrency:
+            closed[str(concurrency)] = closed_loop(client, concurrency, args.duration)
+            print(f"  closed loop c={concurrency}: {closed[str(concurrency)]['throughput']} req/s, "
+                  f"p99 {closed[str(concurrency)].get('p99')} ms")
+
+        opened = {}
+        for rate in args.rates:
+            opened[str(rate)] = open_loop(client, rate, args.duration)
+            print(f"  open loop {rate} req/s: {opened[str(rate)]['throughput']} req/s, "
+                  f"p99 {opened[str(rate)].get('p99')} ms")
+
+        return {
+            "closed_loop": closed,
+            "open_loop": opened,
+            "saturation": find_saturation(closed, opened, args.p99_budget_ms),
+        }
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+# --- Regression comparison ---
+
+# Metrics where a larger value is better; every other numeric metric is a latency (smaller is better)
+HIGHER_IS_BETTER = {"throughput", "images_per_second"}
+COMPARED_METRICS = {"p50", "p95", "p99", "mean", "throughput", "images_per_second"}
+
+
+def flatten(results, prefix=""):
+    for key, value in results.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from flatten(value, path)
+        elif key in COMPARED_METRICS and isinstance(value, (int, float)):
+            yield path, key, value
+
+
+def compare(baseline_path, current_path, threshold):
+    with open(baseline_path) as f:
+        baseline = dict((path, value) for path, _, value in flatten(json.load(f)["results"]))
+    with open(current_path) as f:
+        current = list(flatten(json.load(f)["results"]))
+
+    regressions = 0
+    for path, metric, value in current:
+        old = baseline.get(path)
+        if not old:
+            continue
+        change = (value - old) / old
+        worse = -change if metric in HIGHER_IS_BETTER else change
+        if worse > threshold:
+            regressions += 1
+            print(f"❌ {path}: {old} -> {value} ({change:+.1%})")
+    if regressions:
+        print(f"{regressions} metrics regressed by more than {threshold:.0%}")
+        return 1
+    print(f"✅ No metric regressed by more than {threshold:.0%}")
+    return 0
+
+
+# --- CLI ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the skin analysis pipeline")
+    parser.add_argument("mode", choices=["stages", "load", "all", "compare", "compiled"])
+    parser.add_argument("files", nargs="*", help="compare: baseline.json current.json")
+    parser.add_argument("--engine", default=os.environ.get("SKIN_API_ENGINE", "stub"))
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--image-sizes", nargs="+", default=DEFAULT_IMAGE_SIZES)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=DEFAULT_BATCH_SIZES)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--rates", nargs="+", type=float, default=DEFAULT_RATES)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per load level")
+    parser.add_argument("--p99-budget-ms", type=float, default=1000.0)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--threshold", type=float, default=0.10, help="compare: allowed relative regression")
+    args = parser.parse_args()
+
+    if args.mode == "compare":
+        if len(args.files) != 2:
+            parser.error("compare needs two result files: baseline.json current.json")
+        return compare(args.files[0], args.files[1], args.threshold)
+
+    # The stage benchmarks run from the service directory
+    args.output = os.path.abspath(args.output)
+
+    results = {}
+    if args.mode in ("stages", "all"):
+        print("Running per-stage micro-benchmarks...")
+        results["stages"] = run_stage_benchmarks(args)
+    if args.mode == "compiled" or (args.mode == "all" and args.engine == "keras"):
+        print("Comparing model.predict with the compiled inference function...")
+        results["compiled"] = run_compiled_benchmark(args)
+    if args.mode in ("load", "all"):
+        print("Running HTTP load test...")
+        results["load"] = run_load_test(args)
+
+    report = {
+        "meta": {
+            "engine": args.engine,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Offline bulk scoring of an image archive
+
+    python bulk_score.py /data/archive --output scores.jsonl
+    python bulk_score.py "/data/2024/**/*.jpg" --output scores.csv --batch-size 128
+    python bulk_score.py --manifest files.txt --output scores.parquet --workers 8
+
+Inputs are directories (searched recursively), glob patterns, image files, or a manifest listing one path
+per line (or a CSV with a `path` column). The model is loaded once; images are decoded in a process pool
+while the model scores the previous batch, and each row records every class probability.
+
+Progress is checkpointed next to the output after every chunk of images: re-running the same command
+resumes where an interrupted run stopped. Parquet output is a directory of part files and needs pyarrow.
+"""
+
+import argparse
+import csv
+import glob
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff", ".webp"}
+
+FORMATS = ("jsonl", "csv", "parquet")
+
+
+# --- Inputs ---
+
+def _walk_images(directory):
+    for root, dirs, names in os.walk(directory):
+        dirs.sort()
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                yield os.path.join(root, name)
+
+
+def _read_manifest(path):
+    with open(path, "r", newline="") as f:
+        first = f.readline()
+        f.seek(0)
+        if "," in first and "path" in next(csv.reader([first])):
+            return [row["path"] for row in csv.DictReader(f) if row.get("path")]
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def collect_inputs(inputs, manifest=None):
+    """Expand directories, globs and a manifest into a de-duplicated, deterministic list of absolute paths"""
+    paths = []
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        paths.extend(os.path.join(base, path) for path in _read_manifest(manifest))
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(_walk_images(item))
+        elif glob.has_magic(item):
+            paths.extend(sorted(path for path in glob.glob(item, recursive=True) if os.path.isfile(path)))
+        else:
+            paths.append(item)
+    seen = set()
+    unique = []
+    for path in map(os.path.abspath, paths):
+        if path not in seen:
+            seen.add(path)
+            unique.append(path)
+    return unique
+
+
+def inputs_digest(paths):
+    """Identifies the input list, so a checkpoint is never applied to a different set of images"""
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(path.encode("utf-8", "surrogateescape") + b"\0")
+    return digest.hexdigest()
+
+
+# --- Decode workers ---
+
+def init_decode_worker(service_dir):
+    """Pool initializer: make the service modules importable and load the decoder before the first image"""
+    if service_dir not in sys.path:
+        sys.path.insert(0, service_dir)
+    import preprocessing
+
+
+def decode_path(path):
+    """Runs in a pool process: read and decode one image to (224, 224, 3) uint8, or return the error"""
+    from preprocessing import decode_image
+
+    try:
+        with open(path, "rb") as f:
+            return np.asarray(decode_image(f.read())), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def decoded_stream(pool, paths, window):
+    """Yield (path, pixels, error) in input order, keeping at most `window` decodes in flight"""
+    pending = deque()
+    paths = iter(paths)
+    for path in paths:
+        pending.append((path, pool.submit(decode_path, path)))
+        if len(pending) >= window:
+            break
+    while pending:
+        path, future = pending.popleft()
+        next_path = next(paths, None)
+        if next_path is not None:
+            pending.append((next_path, pool.submit(decode_path, next_path)))
+        pixels, error = future.result()
+        yield path, pixels, error
+
+
+# --- Outputs ---
+
+class ResultWriter:
+    """Appends scored rows in chunks; offset() is what the checkpoint records after each chunk"""
+
+    def __init__(self, path, output_format, labels):
+        self.path = path
+        self.format = output_format
+        self.labels = labels
+        self.columns = ["path", "condition", "confidence", "modelVersion", "error"] + [f"p_{label}" for label in labels]
+        if output_format == "parquet":
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise SystemExit("❌ Parquet output needs pyarrow: pip install pyarrow")
+            self._pa = pyarrow
+            self._pq = pyarrow.parquet
+            os.makedirs(path, exist_ok=True)
+
+    def resume(self, offset):
+        """Drop anything written after the last checkpoint (a chunk interrupted mid-write)"""
+        if self.format == "parquet":
+            for name in os.listdir(self.path):
+                if name.startswith("part-") and int(name[5:].split(".")[0]) >= offset:
+                    os.remove(os.path.join(self.path, name))
+        elif os.path.exists(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(offset)
+        self._offset = offset
+
+    def offset(self):
+        return self._offset
+
+    def write(self, rows):
+        if self.format == "jsonl":
+            data = "".join(json.dumps(self._json_row(row)) + "\n" for row in rows).encode("utf-8")
+        elif self.format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if self._offset == 0:
+                writer.writerow(self.columns)
+            for row in rows:
+                writer.writerow([row[column] if column in row else row["probabilities"].get(column[2:], "")
+                                 for column in self.columns])
+            data = buffer.getvalue().encode("utf-8")
+        else:
+            table = self._pa.table({
+                column: [row[column] if column in row else row["probabilities"].get(column[2:]) for row in rows]
+                for column in self.columns
+            })
+            self._pq.write_table(table, os.path.join(self.path, f"part-{self._offset:05d}.parquet"))
+            self._offset += 1
+            return
+
+        with open(self.path, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._offset += len(data)
+
+    def _json_row(self, row):
+        return {key: value for key, value in row.items() if value is not None}
+
+
+def load_checkpoint(path, digest, model_version, restart):
+    """Return (images done, output offset) to resume from, or (0, 0) for a fresh run"""
+    if restart or not os.path.exists(path):
+        return 0, 0
+    with open(path, "r") as f:
+        checkpoint = json.load(f)
+    if checkpoint["inputsDigest"] != digest:
+        raise SystemExit(f"❌ {path} belongs to a different set of inputs; pass --restart to start over")
+    if checkpoint["modelVersion"] != model_version:
+        raise SystemExit(
+            f"❌ {path} was written by model {checkpoint['modelVersion']}, not {model_version}; "
+            "pass --restart to start over"
+        )
+    return checkpoint["done"], checkpoint["offset"]
+
+
+def save_checkpoint(path, digest, model_version, done, offset):
+    with open(path + ".tmp", "w") as f:
+        json.dump({"inputsDigest": digest, "modelVersion": model_version, "done": done, "offset": offset}, f)
+    os.replace(path + ".tmp", path)
+
+
+# --- Scoring ---
+
+def score(paths, writer, args, done, checkpoint_path, digest):
+    import predict_model
+    from preprocessing import INPUT_SHAPE, resnet_preprocess
+
+    labels = writer.labels
+    total = len(paths)
+    batch = np.empty((args.batch_size,) + INPUT_SHAPE, dtype=np.float32)
+    started = time.perf_counter()
+    last_report = started
+    scored_this_run = 0
+    model_seconds = 0.0
+    rows = []
+
+    def report(final=False):
+        # "model busy" near 100% means decoding keeps up and the model is the bottleneck
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        rate = scored_this_run / elapsed
+        remaining = total - done - len(rows)
+        eta = f"{remaining / rate / 60:.1f} min" if rate else "unknown"
+        print(
+            f"{'✅' if final else '…'} {done + len(rows)}/{total} images, {rate:.1f} img/s, "
+            f"model busy {model_seconds / elapsed:.0%}, ETA {eta}",
+            file=sys.stderr,
+            flush=True,
+        )
+
+    def flush_batch(items):
+        nonlocal model_seconds
+        if not items:
+            return
+        for index, (_, pixels) in enumerate(items):
+            resnet_preprocess(pixels, out=batch[index])
+        model_started = time.perf_counter()
+        probabilities = predict_model.predict_batch(batch[:len(items)])
+        model_seconds += time.perf_counter() - model_started
+        for (path, _), row in zip(items, probabilities):
+            top = int(np.argmax(row))
+            rows.append({
+                "path": path,
+                "condition": labels[top],
+                "confidence": round(float(row[top] * 100), 2),
+                "modelVersion": predict_model.MODEL_VERSION,
+                "error": None,
+                "probabilities": {label: round(float(p), 6) for label, p in zip(labels, row)},
+            })
+
+    # Spawned rather than forked: the model runtime is already loaded here, and forking a process with
+    # TensorFlow's thread pools running can deadlock the child. The workers only decode, so they never load it
+    pool = ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_decode_worker,
+        initargs=(SERVICE_DIR,),
+    )
+    with pool:
+        pending = []
+        for path, pixels, error in decoded_stream(pool, paths[done:], window=args.batch_size * 4):
+            scored_this_run += 1
+            if error is not None:
+                flush_batch(pending)
+                pending = []
+                rows.append({
+                    "path": path, "condition": None, "confidence": None,
+                    "modelVersion": predict_model.MODEL_VERSION, "error": error, "probabilities": {},
+                })
+            else:
+                pending.append((path, pixels))
+                if len(pending) == args.batch_size:
+                    flush_batch(pending)
+                    pending = []
+
+            if len(rows) >= args.checkpoint_every:
+                writer.write(rows)
+                done += len(rows)
+                rows = []
+                save_checkpoint(checkpoint_path, digest, predict_model.MODEL_VERSION, done, writer.offset())
+            if time.perf_counter() - last_report >= args.report_every:
+                last_report = time.perf_counter()
+                report()
+
+        flush_batch(pending)
+        if rows:
+            writer.write(rows)
+            done += len(rows)
+            rows = []
+            save_checkpoint(checkpoint_path, digest, predict_model.MODEL_VERSION, done, writer.offset())
+    report(final=True)
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score an image archive with the skin analysis model")
+    parser.add_argument("inputs", nargs="*", help="Directories, glob patterns or image files")
+    parser.add_argument("--manifest", help="File listing image paths, one per line, or a CSV with a `path` column")
+    parser.add_argument("--output", required=True, help="Results file (.jsonl, .csv) or directory (.parquet)")
+    parser.add_argument("--format", choices=FORMATS, help="Output format (default: from the output extension)")
+    parser.add_argument("--engine", default=os.environ.get("SKIN_API_ENGINE", "keras"))
+    parser.add_argument("--batch-size", type=int, default=64, help="Images per model call")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Decode processes")
+    parser.add_argument("--checkpoint-every", type=int, default=1024, help="Images per output chunk and checkpoint")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start over")
+    args = parser.parse_args()
+
+    if not args.inputs and not args.manifest:
+        parser.error("give at least one input or --manifest")
+    output_format = args.format or os.path.splitext(args.output)[1].lstrip(".").lower()
+    if output_format not in FORMATS:
+        parser.error(f"cannot tell the output format from {args.output}; pass --format")
+
+    paths = collect_inputs(args.inputs, args.manifest)
+    if not paths:
+        print("❌ No images found")
+        return 1
+    output = os.path.abspath(args.output)
+    checkpoint_path = output.rstrip(os.sep) + ".checkpoint.json"
+    digest = inputs_digest(paths)
+
+    # The model and label files are resolved relative to the service directory
+    os.environ["SKIN_API_ENGINE"] = args.engine
+    # Trace the compiled Keras function for the bulk batch size rather than the serving buckets
+    os.environ.setdefault("SKIN_API_BATCH_BUCKETS", str(args.batch_size))
+    os.chdir(SERVICE_DIR)
+    sys.path.insert(0, SERVICE_DIR)
+    import predict_model
+
+    try:
+        predict_model.load_model()
+    except predict_model.ModelLoadError as e:
+        print(f"❌ {e}")
+        return 1
+    labels = [predict_model.class_labels[str(index)] for index in range(len(predict_model.class_labels))]
+
+    done, offset = load_checkpoint(checkpoint_path, digest, predict_model.MODEL_VERSION, args.restart)
+    if done >= len(paths):
+        print(f"✅ All {len(paths)} images already scored in {output}")
+        return 0
+    if done:
+        print(f"Resuming after {done} of {len(paths)} images")
+    writer = ResultWriter(output, output_format, labels)
+    writer.resume(offset)
+
+    score(paths, writer, args, done, checkpoint_path, digest)
+    print(f"✅ Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
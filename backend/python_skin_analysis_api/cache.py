@@ -0,0 +1,155 @@
+"""
+Content-addressed prediction cache
+Results are keyed by a hash of the image bytes and the model version, kept in a bounded in-memory LRU
+with a TTL and optionally persisted to SQLite so they survive restarts
+Values are the serialized JSON response bytes, so a hit is returned without re-encoding
+"""
+
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(image_bytes, model_version):
+    """Hash of the image content plus the model version that scored it"""
+    return f"{model_version}:{hashlib.sha256(image_bytes).hexdigest()}"
+
+
+class PredictionCache:
+    """Two-tier (memory + optional SQLite) cache that also coalesces identical in-flight requests"""
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600, db_path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()  # key -> (expires_at, response bytes)
+        self._in_flight = {}  # key -> asyncio.Future shared by identical concurrent requests
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expired": 0}
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, result BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+            logger.info(f"Prediction cache persisted to {db_path}")
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _get_memory(self, key):
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.time():
+            del self._memory[key]
+            self.stats["expired"] += 1
+            return None
+        self._memory.move_to_end(key)
+        return result
+
+    def _put_memory(self, key, result, expires_at):
+        self._memory[key] = (expires_at, result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _get_disk(self, key):
+        if self._db is None:
+            return None
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT result, expires_at FROM predictions WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        result = row[0]
+        # Rows written before results were stored as bytes hold JSON text
+        if isinstance(result, str):
+            result = result.encode("utf-8")
+        return result, row[1]
+
+    def _put_disk(self, key, result, expires_at):
+        if self._db is None:
+            return
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO predictions (key, result, expires_at) VALUES (?, ?, ?)",
+                (key, sqlite3.Binary(result), expires_at),
+            )
+            self._db.commit()
+
+    def get(self, key):
+        """Return a cached result or None, promoting disk hits into memory"""
+        result = self._get_memory(key)
+        if result is not None:
+            self.stats["hits"] += 1
+            return result
+        disk_entry = self._get_disk(key)
+        if disk_entry is not None:
+            result, expires_at = disk_entry
+            self._put_memory(key, result, expires_at)
+            self.stats["disk_hits"] += 1
+            return result
+        return None
+
+    def put(self, key, result):
+        expires_at = time.time() + self.ttl_seconds
+        self._put_memory(key, result, expires_at)
+        self._put_disk(key, result, expires_at)
+
+    async def get_or_compute(self, key, compute):
+        """
+        Return the cached result for key, or await compute() once and cache it
+        Identical requests that arrive while compute() is running share its result
+        compute() signals failure by raising, so failed predictions are never cached
+        """
+        if not self.enabled:
+            return await compute()
+
+        result = self.get(key)
+        if result is not None:
+            return result
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(in_flight)
+
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await compute()
+            self.put(key, result)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    def snapshot(self):
+        """Counters plus current size, for the stats endpoint"""
+        return {**self.stats, "size": len(self._memory), "max_entries": self.max_entries}
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
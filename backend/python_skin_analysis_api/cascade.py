@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Confidence-gated cascade: a small first-stage model scores every image, and only the images it is unsure
+about (top-1 probability below SKIN_API_CASCADE_CONFIDENCE, or a lead over the runner-up below
+SKIN_API_CASCADE_MARGIN) go on to ResNet-50. Every response records the stage that answered it as
+"cascadeStage": "first" or "second"
+
+    SKIN_API_CASCADE_ENGINE=tflite SKIN_API_CASCADE_PATH=mobilenet.tflite SKIN_API_CASCADE_CONFIDENCE=0.9 python start_api.py
+
+The first stage shares class_indices.json with ResNet-50. Its images carry no ResNet-50 embedding,
+so the similar-case index is off in cascade mode
+
+Choosing the thresholds: score a labelled set with both models and report, for each threshold, how many
+images the first stage answers, how often it agrees with ResNet-50, the accuracy lost and the compute saved
+
+    python cascade.py labelled/ --first-engine tflite --first-model mobilenet.tflite --confidence 0.8 0.9 0.95
+    python cascade.py labelled/ --first-engine stub-small --engine stub    # stand-in models, no weights needed
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+
+import config
+import metrics
+from engines import DEFAULT_PATHS, artifact_path, create_engine
+from predict_model import (
+    KNOWLEDGE_BASE_PATH, LABELS_PATH, MODEL_PATH, ModelLoadError, build_response_table, load_version
+)
+
+FIRST = "first"
+SECOND = "second"
+
+_first_stage = None
+_first_stage_lock = threading.Lock()
+
+
+def escalate(probabilities, confidence, margin=0.0):
+    """Boolean mask of the images the first stage is unsure about, from its (N, num_classes) probabilities"""
+    top2 = np.partition(probabilities, -2, axis=1)[:, -2:]
+    return (top2[:, 1] < confidence) | (top2[:, 1] - top2[:, 0] < margin)
+
+
+def first_stage():
+    """The first-stage model from SKIN_API_CASCADE_ENGINE, loaded once and shared by every ResNet-50 version"""
+    global _first_stage
+    with _first_stage_lock:
+        if _first_stage is None:
+            engine_name = config.SKIN_API_CASCADE_ENGINE
+            path = config.SKIN_API_CASCADE_PATH or artifact_path(engine_name)
+            if not path:
+                raise ModelLoadError(f"Set SKIN_API_CASCADE_PATH for the '{engine_name}' first-stage model")
+            _first_stage, _ = load_version(path, LABELS_PATH, KNOWLEDGE_BASE_PATH, engine_name=engine_name)
+        return _first_stage
+
+
+class CascadeModel:
+    """
+    Serves like a single Model: the micro-batcher calls predict_batch_stages once per batch, which runs
+    the first stage on the whole batch and ResNet-50 on the rows it escalates
+    """
+
+    def __init__(self, first, second, confidence, margin=0.0):
+        if first.class_labels != second.class_labels:
+            raise ModelLoadError(
+                f"The first-stage model {first.version} and model {second.version} have different class labels"
+            )
+        self.first = first
+        self.second = second
+        self.confidence = confidence
+        self.margin = margin
+        # The thresholds are part of the version, so cached results never outlive a change to them
+        self.version = f"{second.version}+{first.version}@{confidence:g}" + (f",{margin:g}" if margin else "")
+        self.class_labels = second.class_labels
+        self.knowledge_base = second.knowledge_base
+        self.tables = {
+            stage: build_response_table(self.class_labels, self.knowledge_base, self.version, stage)
+            for stage in (FIRST, SECOND)
+        }
+        self.response_table = self.tables[SECOND]
+        # Only escalated images get a ResNet-50 embedding, so there is nothing to index
+        self.embedding_dim = None
+
+    @property
+    def engine(self):
+        return self.second.engine
+
+    def predict_batch_stages(self, img_batch):
+        """Class probabilities from whichever stage answered each image, no embeddings, and the stage names"""
+        probabilities = np.array(self.first.predict_batch(img_batch), dtype=np.float32)
+        escalated = escalate(probabilities, self.confidence, self.margin)
+        count = int(escalated.sum())
+        if count:
+            probabilities[escalated] = self.second.predict_batch(img_batch[escalated])
+        metrics.CASCADE_IMAGES.inc(len(img_batch) - count, stage=FIRST)
+        metrics.CASCADE_IMAGES.inc(count, stage=SECOND)
+        return probabilities, None, [SECOND if row else FIRST for row in escalated]
+
+    def predict_batch(self, img_batch):
+        return self.predict_batch_stages(img_batch)[0]
+
+    def predict_batch_embeddings(self, img_batch):
+        return self.predict_batch_stages(img_batch)[0], None
+
+    def warm_up(self, batch_sizes):
+        # ResNet-50 sees every batch size up to the largest, whatever share of a batch is escalated
+        return self.first.warm_up(batch_sizes) + self.second.warm_up(batch_sizes)
+
+    def top_class(self, probabilities, stage=None):
+        class_index = int(np.argmax(probabilities))
+        confidence = round(float(probabilities[class_index] * 100), 2)
+        return self.tables[stage or SECOND][class_index], confidence
+
+    def build_response_bytes(self, probabilities, stage=None):
+        entry, confidence = self.top_class(probabilities, stage)
+        return entry["prefix"] + repr(confidence).encode() + entry["suffix"]
+
+    def build_response(self, probabilities, stage=None):
+        entry, confidence = self.top_class(probabilities, stage)
+        return {
+            "success": True,
+            "modelVersion": self.version,
+            "cascadeStage": stage or SECOND,
+            "analysis": {"condition": entry["condition"], "confidence": confidence, **entry["static"]},
+        }
+
+
+# --- Threshold evaluation ---
+
+def evaluate(first, second, truth, confidence, margin, first_seconds, second_seconds):
+    """
+    What a cascade with these thresholds would have done on a scored set
+    first and second are (N, num_classes) probabilities of the two stages on the same images, truth the
+    class indices (or None), and *_seconds each stage's model time per image
+    """
+    escalated = escalate(first, confidence, margin)
+    answered = ~escalated
+    first_top1 = first.argmax(axis=1)
+    second_top1 = second.argmax(axis=1)
+    cascade_top1 = np.where(escalated, second_top1, first_top1)
+    stage_agrees = first_top1 == second_top1
+    escalation_rate = float(escalated.mean())
+    # Every image pays for the first stage; the escalated ones pay for ResNet-50 as well
+    relative_cost = (first_seconds + escalation_rate * second_seconds) / second_seconds
+    result = {
+        "confidence": confidence,
+        "margin": margin,
+        "firstStageShare": round(1.0 - escalation_rate, 4),
+        "escalatedShare": round(escalation_rate, 4),
+        # How often the first stage's answer matches ResNet-50 on the images it is trusted with
+        "firstStageAgreement": round(float(stage_agrees[answered].mean()), 4) if answered.any() else None,
+        "cascadeAgreement": round(float((cascade_top1 == second_top1).mean()), 4),
+        "relativeCompute": round(relative_cost, 4),
+        "computeSaving": round(1.0 - relative_cost, 4),
+    }
+    if truth is not None:
+        result["accuracy"] = round(float((cascade_top1 == truth).mean()), 4)
+        result["accuracyDrop"] = round(float((second_top1 == truth).mean()) - result["accuracy"], 4)
+    return result
+
+
+def score_timed(engine, images, batch_size):
+    """Probabilities for every image, and the model seconds per image (after one warm-up call)"""
+    engine.infer(images[:batch_size])
+    start = time.perf_counter()
+    probabilities = np.concatenate([engine.infer(images[offset:offset + batch_size])
+                                    for offset in range(0, len(images), batch_size)])
+    return probabilities, (time.perf_counter() - start) / len(images)
+
+
+def main():
+    from bulk_score import collect_inputs
+    from quantize_model import folder_labels, load_images
+
+    parser = argparse.ArgumentParser(description="Measure how a confidence-gated cascade would serve a labelled set")
+    parser.add_argument("inputs", nargs="+", help="Directories (ideally with one folder per class), globs or images")
+    parser.add_argument("--first-engine", default=config.SKIN_API_CASCADE_ENGINE or None, choices=sorted(DEFAULT_PATHS),
+                        help="Engine of the first-stage model")
+    parser.add_argument("--first-model", default=config.SKIN_API_CASCADE_PATH, help="First-stage model artifact")
+    parser.add_argument("--engine", default=config.SKIN_API_ENGINE, choices=sorted(DEFAULT_PATHS),
+                        help="Engine of the second-stage (ResNet-50) model")
+    parser.add_argument("--model", help="Second-stage model artifact (default: the one the API serves)")
+    parser.add_argument("--confidence", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99],
+                        help="First-stage confidence thresholds to evaluate")
+    parser.add_argument("--margin", type=float, default=config.SKIN_API_CASCADE_MARGIN,
+                        help="Top-1 lead over the runner-up the first stage also needs")
+    parser.add_argument("--batch-size", type=int, default=16, help="Images per model call")
+    parser.add_argument("--report", default="cascade_report.json", help="JSON report path")
+    args = parser.parse_args()
+
+    if not args.first_engine:
+        parser.error("--first-engine is required (or set SKIN_API_CASCADE_ENGINE)")
+    with open(LABELS_PATH, "r") as f:
+        labels = json.load(f)["inv_class_indices"]
+    paths = collect_inputs(args.inputs)
+    if not paths:
+        print("❌ No images found")
+        return 1
+    images, paths = load_images(paths)
+    truth = folder_labels(paths, labels)
+
+    first_path = args.first_model or artifact_path(args.first_engine)
+    second_path = args.model or (MODEL_PATH if args.engine == config.SKIN_API_ENGINE else artifact_path(args.engine))
+    try:
+        first_engine = create_engine(args.first_engine, first_path).load()
+        second_engine = create_engine(args.engine, second_path).load()
+    except Exception as e:
+        print(f"❌ Could not load the models: {e}")
+        return 1
+    first, first_seconds = score_timed(first_engine, images, args.batch_size)
+    second, second_seconds = score_timed(second_engine, images, args.batch_size)
+    print(f"Scored {len(images)} images ({'labelled by folder' if truth is not None else 'unlabelled'}): "
+          f"first stage {first_seconds * 1000:.2f} ms/image, second stage {second_seconds * 1000:.2f} ms/image")
+
+    report = {
+        "images": len(images),
+        "labelled": truth is not None,
+        "firstStage": {"engine": args.first_engine, "model": first_path, "msPerImage": round(first_seconds * 1000, 3)},
+        "secondStage": {"engine": args.engine, "model": second_path, "msPerImage": round(second_seconds * 1000, 3)},
+        "stageAgreement": round(float((first.argmax(axis=1) == second.argmax(axis=1)).mean()), 4),
+        "thresholds": [evaluate(first, second, truth, confidence, args.margin, first_seconds, second_seconds)
+                       for confidence in sorted(args.confidence)],
+    }
+    if truth is not None:
+        report["firstStage"]["accuracy"] = round(float((first.argmax(axis=1) == truth).mean()), 4)
+        report["secondStage"]["accuracy"] = round(float((second.argmax(axis=1) == truth).mean()), 4)
+
+    print(f"Stages agree on {report['stageAgreement']:.1%} of images")
+    print(f"{'confidence':>10} {'first stage':>11} {'agreement':>9} {'cascade':>8} {'acc change':>10} {'saving':>7}")
+    for row in report["thresholds"]:
+        agreement = f"{row['firstStageAgreement']:.1%}" if row["firstStageAgreement"] is not None else "-"
+        # Adding 0.0 turns -0.0 (no change) into 0.0, so it prints as +0.0% rather than -0.0%
+        accuracy = f"{-row['accuracyDrop'] + 0.0:+.1%}" if "accuracyDrop" in row else "-"
+        print(f"{row['confidence']:>10g} {row['firstStageShare']:>11.1%} {agreement:>9} "
+              f"{row['cascadeAgreement']:>8.1%} {accuracy:>10} {row['computeSaving']:>7.1%}")
+
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Report written to {args.report}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""
+Runtime configuration for the Skin Vision Analysis API
+Every setting can be overridden with an environment variable of the same name
+"""
+
+import os
+
+
+def _env_int(name, default):
+    """Read an integer setting from the environment"""
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_int_list(name, default):
+    """Read a comma-separated list of integers from the environment"""
+    value = os.environ.get(name)
+    if value in (None, ""):
+        return default
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def _env_float(name, default):
+    """Read a float setting from the environment"""
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else default
+
+
+# --- Model ---
+
+# Inference engine: "keras", "savedmodel", "tflite" or "onnx" (see export_model.py),
+# or "stub" for a tiny stand-in model that needs no weights (CI and benchmarks; "stub-small" is a second one)
+SKIN_API_ENGINE = os.environ.get("SKIN_API_ENGINE", "keras")
+
+# Model artifact for the engine; defaults to the file export_model.py writes for it
+SKIN_API_ENGINE_PATH = os.environ.get("SKIN_API_ENGINE_PATH", "")
+
+# Serve a quantized variant written by quantize_model.py: "dynamic", "int8" or "fp16" (needs the tflite engine);
+# empty serves the float model
+SKIN_API_MODEL_VARIANT = os.environ.get("SKIN_API_MODEL_VARIANT", "")
+
+# Keep model weights in shared memory-mapped pages instead of per-process copies (multi-worker deployments)
+SKIN_API_SHARE_WEIGHTS = os.environ.get("SKIN_API_SHARE_WEIGHTS", "") not in ("", "0", "false")
+
+# Version label reported for the loaded model; defaults to a hash of the weights file
+# (registry versions are labelled with their directory name)
+SKIN_API_MODEL_VERSION = os.environ.get("SKIN_API_MODEL_VERSION", "")
+
+# Directory of model versions, one subdirectory each with the engine's artifact and class_indices.json
+# (see model_registry.py); empty serves the single model next to this file
+SKIN_API_MODEL_REGISTRY = os.environ.get("SKIN_API_MODEL_REGISTRY", "")
+
+# How often the registry's CURRENT file is checked; a new version there is loaded, warmed up and swapped in
+# (0 disables the watch, leaving swaps to the admin endpoint)
+SKIN_API_MODEL_WATCH_SECONDS = _env_float("SKIN_API_MODEL_WATCH_SECONDS", 5.0)
+
+# Registry version scored alongside the active one on a sample of traffic, to compare latency and agreement
+SKIN_API_SHADOW_VERSION = os.environ.get("SKIN_API_SHADOW_VERSION", "")
+
+# Fraction of requests also scored by the shadow model
+SKIN_API_SHADOW_SAMPLE_RATE = _env_float("SKIN_API_SHADOW_SAMPLE_RATE", 0.05)
+
+# Bearer token for the /admin endpoints; empty disables them
+SKIN_API_ADMIN_TOKEN = os.environ.get("SKIN_API_ADMIN_TOKEN", "")
+
+# --- Cascade ---
+
+# Engine of a small first-stage model that scores every image before ResNet-50 (see cascade.py);
+# empty sends every image straight to ResNet-50
+SKIN_API_CASCADE_ENGINE = os.environ.get("SKIN_API_CASCADE_ENGINE", "")
+
+# Artifact of the first-stage model; defaults to the engine's default artifact
+SKIN_API_CASCADE_PATH = os.environ.get("SKIN_API_CASCADE_PATH", "")
+
+# The first stage answers when its top-1 probability is at least this (0-1); otherwise ResNet-50 does
+SKIN_API_CASCADE_CONFIDENCE = _env_float("SKIN_API_CASCADE_CONFIDENCE", 0.9)
+
+# ...and its top-1 leads the runner-up by at least this much probability (0 disables the margin check)
+SKIN_API_CASCADE_MARGIN = _env_float("SKIN_API_CASCADE_MARGIN", 0.0)
+
+# --- Micro-batching ---
+
+# Largest number of images sent to the model in a single call
+SKIN_API_MAX_BATCH_SIZE = _env_int("SKIN_API_MAX_BATCH_SIZE", 8)
+
+# How long the first request in a batch waits for others to join (milliseconds)
+SKIN_API_MAX_BATCH_WAIT_MS = _env_float("SKIN_API_MAX_BATCH_WAIT_MS", 5.0)
+
+# Batch sizes run once on synthetic input at startup so real requests never pay first-call cost;
+# by default powers of two up to the max batch size, plus the max itself
+SKIN_API_WARMUP_BATCH_SIZES = _env_int_list(
+    "SKIN_API_WARMUP_BATCH_SIZES",
+    sorted({1 << i for i in range(SKIN_API_MAX_BATCH_SIZE.bit_length()) if 1 << i <= SKIN_API_MAX_BATCH_SIZE}
+           | {SKIN_API_MAX_BATCH_SIZE}),
+)
+
+# --- Keras inference path ---
+
+# Run the Keras model through tf.function concrete functions, one per batch-size bucket, instead of model.predict
+SKIN_API_KERAS_COMPILED = os.environ.get("SKIN_API_KERAS_COMPILED", "1") not in ("", "0", "false")
+
+# Batch sizes the compiled function is traced for; a batch is zero-padded to the next bucket,
+# so the hot path never retraces (keep these in SKIN_API_WARMUP_BATCH_SIZES so each is compiled at startup)
+SKIN_API_BATCH_BUCKETS = _env_int_list("SKIN_API_BATCH_BUCKETS", SKIN_API_WARMUP_BATCH_SIZES)
+
+# Compile the inference function with XLA (each bucket is compiled once, during warm-up)
+SKIN_API_XLA = os.environ.get("SKIN_API_XLA", "") not in ("", "0", "false")
+
+# "float32", or a Keras mixed-precision policy: "mixed_bfloat16" (CPUs with AVX-512 BF16/AMX) or "mixed_float16" (GPU)
+SKIN_API_PRECISION = os.environ.get("SKIN_API_PRECISION", "float32")
+
+# --- Executor ---
+
+# "thread" runs decoding in a thread pool, "process" in a process pool (sidesteps the GIL),
+# "shm" in a process pool whose workers write model inputs into a shared-memory ring (pixels are never pickled)
+SKIN_API_EXECUTOR = os.environ.get("SKIN_API_EXECUTOR", "thread")
+
+# Number of decode/preprocess workers
+SKIN_API_EXECUTOR_WORKERS = _env_int("SKIN_API_EXECUTOR_WORKERS", min(4, os.cpu_count() or 1))
+
+# Slots in the "shm" executor's ring: decoded images waiting for the model; decodes wait while all are taken
+SKIN_API_RING_SLOTS = _env_int("SKIN_API_RING_SLOTS", 4 * SKIN_API_MAX_BATCH_SIZE)
+
+# Maximum number of requests being decoded or waiting for the model at once; extra requests get a 503
+SKIN_API_MAX_QUEUE_DEPTH = _env_int("SKIN_API_MAX_QUEUE_DEPTH", 64)
+
+# Shed new requests with a 503 once the estimated wait for the model exceeds this budget (milliseconds, 0 disables)
+SKIN_API_LATENCY_BUDGET_MS = _env_float("SKIN_API_LATENCY_BUDGET_MS", 2000.0)
+
+# TensorFlow thread pools; by default TF gets the cores the decode workers leave free (0 lets TF decide)
+SKIN_API_TF_INTRA_OP_THREADS = _env_int(
+    "SKIN_API_TF_INTRA_OP_THREADS", max(1, (os.cpu_count() or 1) - SKIN_API_EXECUTOR_WORKERS)
+)
+SKIN_API_TF_INTER_OP_THREADS = _env_int("SKIN_API_TF_INTER_OP_THREADS", 0)
+
+# --- Uploads ---
+
+# Largest image accepted per file; bigger uploads get a 413
+SKIN_API_MAX_UPLOAD_BYTES = _env_int("SKIN_API_MAX_UPLOAD_BYTES", 10 * 1024 * 1024)
+
+# Largest request body accepted by the prediction endpoints (a batch holds several images)
+SKIN_API_MAX_REQUEST_BYTES = _env_int("SKIN_API_MAX_REQUEST_BYTES", 64 * 1024 * 1024)
+
+# Size of each read from an uploaded file
+SKIN_API_UPLOAD_CHUNK_BYTES = _env_int("SKIN_API_UPLOAD_CHUNK_BYTES", 64 * 1024)
+
+# Most images accepted in one binary frame on /predict-skin-lesion/tensor (each is 147 KiB of pixels)
+SKIN_API_MAX_FRAME_IMAGES = _env_int("SKIN_API_MAX_FRAME_IMAGES", 64)
+
+# --- Quality gate ---
+
+# Reject obviously unusable photos (tiny, badly exposed or blurred) with a 422 before they reach the model
+# Off by default: clients that send small images would otherwise start getting 422s instead of predictions
+SKIN_API_QUALITY_GATE = os.environ.get("SKIN_API_QUALITY_GATE", "") not in ("", "0", "false")
+
+# Shortest side, in pixels, an uploaded image must have before resizing (0 disables the check)
+SKIN_API_QUALITY_MIN_SIDE = _env_int("SKIN_API_QUALITY_MIN_SIDE", 128)
+
+# Largest share of the resized image that may be crushed to black or blown out to white (0 disables the check)
+SKIN_API_QUALITY_MAX_CLIPPED = _env_float("SKIN_API_QUALITY_MAX_CLIPPED", 0.5)
+
+# Smallest variance of the Laplacian of the resized image's luminance (0 disables the check);
+# in-focus photos usually score in the hundreds; a 720-pixel photo blurred by 2 pixels scores about 20, by 4 about 4
+SKIN_API_QUALITY_MIN_SHARPNESS = _env_float("SKIN_API_QUALITY_MIN_SHARPNESS", 10.0)
+
+# --- Job queue ---
+
+# SQLite file backing POST /jobs and GET /jobs/{id}; shared by all worker processes (empty disables the job API);
+# opt-in, so the server never writes a database into the directory it was started from
+SKIN_API_JOBS_DB = os.environ.get("SKIN_API_JOBS_DB", "")
+
+# How long a finished job's result can be fetched (seconds)
+SKIN_API_JOB_RESULT_TTL_SECONDS = _env_float("SKIN_API_JOB_RESULT_TTL_SECONDS", 3600.0)
+
+# Attempts per job before it is marked failed; retries back off exponentially from the base delay (seconds)
+SKIN_API_JOB_MAX_ATTEMPTS = _env_int("SKIN_API_JOB_MAX_ATTEMPTS", 3)
+SKIN_API_JOB_RETRY_BACKOFF_SECONDS = _env_float("SKIN_API_JOB_RETRY_BACKOFF_SECONDS", 1.0)
+
+# A job whose worker hasn't finished it within this many seconds is handed to another worker
+SKIN_API_JOB_LEASE_SECONDS = _env_float("SKIN_API_JOB_LEASE_SECONDS", 60.0)
+
+# Jobs each process scores at once; enough to fill a couple of micro-batches
+SKIN_API_JOB_CONCURRENCY = _env_int("SKIN_API_JOB_CONCURRENCY", 2 * SKIN_API_MAX_BATCH_SIZE)
+
+# Jobs allowed to wait in the queue before POST /jobs answers 503
+SKIN_API_JOB_MAX_PENDING = _env_int("SKIN_API_JOB_MAX_PENDING", 10000)
+
+# How often an idle worker checks the queue for jobs submitted to other processes (milliseconds)
+SKIN_API_JOB_POLL_INTERVAL_MS = _env_float("SKIN_API_JOB_POLL_INTERVAL_MS", 200.0)
+
+# Longest a GET /jobs/{id}?wait=... long-poll is held open (seconds)
+SKIN_API_JOB_MAX_WAIT_SECONDS = _env_float("SKIN_API_JOB_MAX_WAIT_SECONDS", 30.0)
+
+# --- Similar-case index ---
+
+# Directory for the embedding index of analysed cases, one subdirectory per model version (empty disables it);
+# opt-in, since it keeps an embedding of every analysed patient image until the directory is removed
+SKIN_API_EMBEDDING_INDEX_DIR = os.environ.get("SKIN_API_EMBEDDING_INDEX_DIR", "")
+
+# On-disk precision of stored embeddings: "int8" (per-vector scale; half the size and a faster scan) or "float16"
+SKIN_API_EMBEDDING_DTYPE = os.environ.get("SKIN_API_EMBEDDING_DTYPE", "int8")
+
+# Keras layer whose output is the embedding; by default the input of the final classification layer
+SKIN_API_EMBEDDING_LAYER = os.environ.get("SKIN_API_EMBEDDING_LAYER", "")
+
+# Size at which an IVF partitioning is built in the background so queries stop scanning every vector (0 disables);
+# even from memory as float32, a scan of 2048-d vectors passes 10 ms somewhere above 10k rows on one core
+SKIN_API_EMBEDDING_IVF_THRESHOLD = _env_int("SKIN_API_EMBEDDING_IVF_THRESHOLD", 10000)
+
+# Rows scanned in full that are kept decoded to float32 in memory (rows x dim x 4 bytes, ~80 MB for 10k 2048-d rows);
+# the partitioning is rebuilt before its unpartitioned tail outgrows them (0 converts the stored rows on every query)
+SKIN_API_EMBEDDING_RESIDENT_ROWS = _env_int("SKIN_API_EMBEDDING_RESIDENT_ROWS", 10000)
+
+# Product-quantization subspaces for the partitioning (0 rescores every probed vector exactly)
+SKIN_API_EMBEDDING_PQ_SUBSPACES = _env_int("SKIN_API_EMBEDDING_PQ_SUBSPACES", 0)
+
+# Inverted lists searched per query once the partitioning exists
+SKIN_API_EMBEDDING_NPROBE = _env_int("SKIN_API_EMBEDDING_NPROBE", 8)
+
+# Largest k accepted by /similar
+SKIN_API_SIMILAR_MAX_K = _env_int("SKIN_API_SIMILAR_MAX_K", 50)
+
+# --- Profiling ---
+
+# Where POST /admin/profile writes its artifacts, one subdirectory per session
+SKIN_API_PROFILE_DIR = os.environ.get("SKIN_API_PROFILE_DIR", "profiles")
+
+# Interval between Python stack samples while a profile is running (milliseconds)
+SKIN_API_PROFILE_INTERVAL_MS = _env_float("SKIN_API_PROFILE_INTERVAL_MS", 5.0)
+
+# Longest a profiling session may run, whatever the request asks for (seconds)
+SKIN_API_PROFILE_MAX_SECONDS = _env_float("SKIN_API_PROFILE_MAX_SECONDS", 300.0)
+
+# --- Knowledge base ---
+
+# JSON file with the condition name override, recommendations, severity and possible causes for each class
+# in class_indices.json; the API refuses to start if any class is missing
+SKIN_API_KNOWLEDGE_BASE_PATH = os.environ.get("SKIN_API_KNOWLEDGE_BASE_PATH", "knowledge_base.json")
+
+# --- Prediction cache ---
+
+# Number of results kept in memory (0 disables the cache)
+SKIN_API_CACHE_SIZE = _env_int("SKIN_API_CACHE_SIZE", 1024)
+
+# How long a cached result stays valid (seconds)
+SKIN_API_CACHE_TTL_SECONDS = _env_float("SKIN_API_CACHE_TTL_SECONDS", 3600.0)
+
+# Optional SQLite file that keeps cached results across restarts (empty disables it)
+SKIN_API_CACHE_DB = os.environ.get("SKIN_API_CACHE_DB", "")
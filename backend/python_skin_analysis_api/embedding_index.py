@@ -0,0 +1,619 @@
+#!/usr/bin/env python3
+"""
+On-disk embedding index for similar-case retrieval
+Every analysed image's penultimate-layer embedding is L2-normalised and appended to a flat file
+(float16, or int8 with a per-vector scale) that is memory-mapped for search; case metadata lives in a
+small SQLite table keyed by row number. Appends take a file lock, so every worker process of the
+production launcher can share one index.
+
+Search is a NumPy dot product over the rows. The rows a query scans in full are kept decoded to float32
+in memory (up to resident_rows), so a query is one matrix-vector product instead of converting the stored
+int8/float16 block every time; rows beyond that are converted block by block. Once the index passes
+ivf_threshold vectors, an IVF partitioning (optionally with product-quantized codes) is built in the
+background and rebuilt as the unpartitioned tail grows; queries then only scan the closest lists, rescore
+the best candidates exactly and scan the tail. The same can be done offline:
+
+    python embedding_index.py build embedding_index/<model version> --nlist 1024 --pq-subspaces 16
+    python embedding_index.py bench embedding_index/<model version> --queries 200 --k 10
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+DTYPES = {"float16": np.float16, "int8": np.int8}
+
+# Rows converted to float32 at a time during a full scan; bounds the scratch memory per query
+BLOCK_ROWS = 16384
+
+# With product quantization, this many candidates per requested neighbour are rescored exactly
+RERANK_FACTOR = 32
+
+# The partitioning is rebuilt once rows added after the last build exceed this fraction of it
+REBUILD_FRACTION = 0.25
+
+# Sentinel that stops the writer thread
+_STOP = object()
+
+
+@contextmanager
+def _file_lock(path, blocking=True):
+    """Hold an exclusive lock on path across processes; yields False if blocking=False and it is taken"""
+    with open(path, "a") as lock_file:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            # Released when the file is closed
+            yield True
+            return
+        # msvcrt locks a byte range from the current position; LK_LOCK gives up after about 10 seconds
+        lock_file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                break
+            except OSError:
+                if not blocking:
+                    yield False
+                    return
+        try:
+            yield True
+        finally:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def normalize(vectors):
+    """L2-normalise float32 vectors along the last axis, so a dot product is the cosine similarity"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def quantize_int8(vectors):
+    """Symmetric per-vector int8 quantization; returns (codes, scales)"""
+    scales = np.maximum(np.abs(vectors).max(axis=1) / 127.0, 1e-12).astype(np.float32)
+    codes = np.clip(np.round(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+def _kmeans(data, clusters, iterations, rng, spherical):
+    """Plain Lloyd's k-means in NumPy; spherical uses cosine similarity and keeps centroids normalised"""
+    centroids = data[rng.choice(len(data), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _nearest(data, centroids, spherical)
+        counts = np.bincount(assign, minlength=clusters)
+        order = np.argsort(assign, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.add.reduceat(data[order], starts[counts > 0], axis=0)
+        centroids[counts > 0] = sums / counts[counts > 0, None]
+        # Re-seed empty clusters from random points
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = data[rng.choice(len(data), len(empty), replace=False)]
+        if spherical:
+            centroids = normalize(centroids)
+    return centroids
+
+
+def _nearest(data, centroids, spherical):
+    """Index of the closest centroid for each row"""
+    if spherical:
+        return np.argmax(data @ centroids.T, axis=1)
+    # argmin |x - c|^2 == argmax 2 x.c - |c|^2
+    return np.argmax(2 * data @ centroids.T - (centroids ** 2).sum(axis=1), axis=1)
+
+
+class EmbeddingIndex:
+    """Append-only, memory-mapped index of normalised embeddings with cosine top-k search"""
+
+    def __init__(self, path, dim=None, dtype="int8", nprobe=8, ivf_threshold=0, pq_subspaces=0, resident_rows=0):
+        """
+        Open the index at path, creating it with dim and dtype if it doesn't exist yet
+        ivf_threshold > 0 builds the IVF partitioning automatically once the index holds that many vectors
+        resident_rows > 0 keeps up to that many of the exhaustively scanned rows (the whole index before the
+        partitioning exists, its unpartitioned tail after) in memory as float32: resident_rows * dim * 4 bytes
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.nprobe = nprobe
+        self.ivf_threshold = ivf_threshold
+        self.pq_subspaces = pq_subspaces
+        self.resident_rows = resident_rows
+        header_path = os.path.join(path, "header.json")
+        if os.path.exists(header_path):
+            with open(header_path, "r") as f:
+                header = json.load(f)
+            if dim is not None and header["dim"] != dim:
+                raise ValueError(f"Index at {path} holds {header['dim']}-d vectors, the model produces {dim}-d")
+            dim, dtype = header["dim"], header["dtype"]
+        elif dim is None:
+            raise ValueError(f"No embedding index at {path}")
+        else:
+            if dtype not in DTYPES:
+                raise ValueError(f"Unknown embedding dtype '{dtype}', expected one of {sorted(DTYPES)}")
+            with open(header_path + ".tmp", "w") as f:
+                json.dump({"dim": dim, "dtype": dtype}, f)
+            os.replace(header_path + ".tmp", header_path)
+
+        self.dim = dim
+        self.dtype = dtype
+        self._np_dtype = np.dtype(DTYPES[dtype])
+        self._row_bytes = dim * self._np_dtype.itemsize
+        self._vectors_path = os.path.join(path, f"vectors.{dtype}")
+        self._scales_path = os.path.join(path, "scales.float32")
+        self._lock_path = os.path.join(path, "append.lock")
+        self._ivf_info_path = os.path.join(path, "ivf.json")
+
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(path, "cases.db"), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cases "
+            "(row INTEGER PRIMARY KEY, key TEXT UNIQUE NOT NULL, condition TEXT, confidence REAL, created_at REAL)"
+        )
+        self._db.commit()
+
+        self._map_lock = threading.Lock()
+        self._mapped_size = -1
+        self._vectors = np.empty((0, dim), dtype=self._np_dtype)
+        self._scales = np.empty(0, dtype=np.float32)
+        self.count = 0
+        self._ivf = None
+        self._ivf_mtime = None
+        self._refresh()
+
+        # Decoded float32 copy (int8 scales applied) of rows _resident_start.._resident_start+_resident_count-1;
+        # rows past _resident_count are only written before they are exposed, so readers need no lock
+        self._resident_lock = threading.Lock()
+        self._resident = np.empty((0, dim), dtype=np.float32)
+        self._resident_start = 0
+        self._resident_count = 0
+
+        self._queue = queue.Queue()
+        self._writer = None
+        self._builder = None
+        logger.info(f"Embedding index at {path}: {self.count} cases, {dim}-d {dtype}")
+
+    # --- Storage ---
+
+    def _rows_on_disk(self):
+        """Complete rows in the vector (and scale) files; a torn write from a crash is ignored"""
+        if not os.path.exists(self._vectors_path):
+            return 0
+        count = os.path.getsize(self._vectors_path) // self._row_bytes
+        if self.dtype == "int8":
+            scales = os.path.getsize(self._scales_path) // 4 if os.path.exists(self._scales_path) else 0
+            count = min(count, scales)
+        return count
+
+    def _refresh(self):
+        """Map rows appended, and pick up a partitioning built, since the last call by this process or another one"""
+        ivf_mtime = os.path.getmtime(self._ivf_info_path) if os.path.exists(self._ivf_info_path) else None
+        if ivf_mtime != self._ivf_mtime:
+            self._ivf = self._load_ivf()
+            self._ivf_mtime = ivf_mtime
+        size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        if size == self._mapped_size:
+            return
+        with self._map_lock:
+            count = self._rows_on_disk()
+            if count:
+                self._vectors = np.memmap(self._vectors_path, dtype=self._np_dtype, mode="r", shape=(count, self.dim))
+                if self.dtype == "int8":
+                    self._scales = np.memmap(self._scales_path, dtype=np.float32, mode="r", shape=(count,))
+            self.count = count
+            self._mapped_size = size
+
+    def _append(self, items):
+        """Write a batch of (key, embedding, condition, confidence, created_at) under the cross-process lock"""
+        with _file_lock(self._lock_path):
+            with self._db_lock:
+                keys = [item[0] for item in items]
+                known = set()
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    known.update(row[0] for row in self._db.execute(
+                        f"SELECT key FROM cases WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                    ))
+                fresh = {}
+                for item in items:
+                    if item[0] not in known:
+                        fresh.setdefault(item[0], item)
+                if not fresh:
+                    return 0
+                items = list(fresh.values())
+
+                vectors = normalize(np.stack([item[1] for item in items]))
+                # Drop any torn row left by a crashed writer so new rows line up with their metadata
+                start = self._rows_on_disk()
+                with open(self._vectors_path, "ab") as f:
+                    f.truncate(start * self._row_bytes)
+                    if self.dtype == "int8":
+                        codes, scales = quantize_int8(vectors)
+                        with open(self._scales_path, "ab") as scales_file:
+                            scales_file.truncate(start * 4)
+                            scales_file.write(scales.tobytes())
+                        f.write(codes.tobytes())
+                    else:
+                        f.write(vectors.astype(self._np_dtype).tobytes())
+
+                self._db.executemany(
+                    "INSERT INTO cases (row, key, condition, confidence, created_at) VALUES (?, ?, ?, ?, ?)",
+                    [(start + i, key, condition, confidence, created_at)
+                     for i, (key, _, condition, confidence, created_at) in enumerate(items)],
+                )
+                self._db.commit()
+        return len(items)
+
+    def add(self, key, embedding, condition=None, confidence=None):
+        """Queue a case for the background writer; keys already in the index are skipped"""
+        self._queue.put((key, np.asarray(embedding, dtype=np.float32).ravel(), condition, confidence, time.time()))
+
+    def start(self):
+        """Start the writer thread that batches appends"""
+        if self._writer is not None and self._writer.is_alive():
+            return
+        self._writer = threading.Thread(target=self._run_writer, name="embedding-writer", daemon=True)
+        self._writer.start()
+
+    def _run_writer(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            items = [item]
+            stop = False
+            while len(items) < 256:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                items.append(item)
+            try:
+                self._append(items)
+                self._maybe_rebuild()
+            except Exception as e:
+                logger.error(f"Could not append {len(items)} embeddings: {e}")
+            if stop:
+                return
+
+    def _maybe_rebuild(self):
+        """Start a background IVF build when the index crosses the threshold or its tail grows too long"""
+        if not self.ivf_threshold or (self._builder is not None and self._builder.is_alive()):
+            return
+        self._refresh()
+        indexed = self._ivf["count"] if self._ivf is not None else 0
+        # Keep the tail that queries scan in full within the resident rows
+        tail_limit = indexed * REBUILD_FRACTION
+        if self.resident_rows:
+            tail_limit = min(tail_limit, self.resident_rows)
+        if self.count < self.ivf_threshold or self.count - indexed <= tail_limit:
+            return
+        self._builder = threading.Thread(target=self._build_in_background, name="embedding-ivf-build", daemon=True)
+        self._builder.start()
+
+    def _build_in_background(self):
+        # Only one process builds; the others pick the result up through _refresh()
+        with _file_lock(os.path.join(self.path, "build.lock"), blocking=False) as locked:
+            if not locked:
+                return
+            start = time.perf_counter()
+            nlist = max(1, int(4 * np.sqrt(self.count)))
+            try:
+                ivf = self.build_ivf(nlist, self.pq_subspaces)
+            except Exception as e:
+                logger.error(f"Could not build the IVF partitioning: {e}")
+                return
+            logger.info(f"Built {nlist} IVF lists over {ivf['count']} embeddings in {time.perf_counter() - start:.1f}s")
+
+    def close(self):
+        """Flush queued cases and close the index"""
+        if self._writer is not None:
+            self._queue.put(_STOP)
+            self._writer.join()
+            self._writer = None
+        with self._db_lock:
+            self._db.close()
+
+    # --- Search ---
+
+    def _score(self, vectors, scales, query):
+        """Cosine similarity of stored rows against a normalised query"""
+        scores = vectors.astype(np.float32) @ query
+        if scales is not None:
+            scores *= scales
+        return scores
+
+    def _resident_rows(self, vectors, scales, start, count):
+        """
+        Float32 rows from start on, as many of start..count-1 as resident_rows allows, decoding only the rows
+        not held yet; when the partitioning moves start forward, the rows still past it are kept
+        """
+        stop = min(count, start + self.resident_rows)
+        with self._resident_lock:
+            held_start, held = self._resident_start, self._resident_count
+            if start != held_start:
+                # A fresh buffer, never an in-place shift, so rows a concurrent query is reading stay put
+                keep = self._resident[start - held_start:held] if held_start < start < held_start + held else None
+                self._resident = np.empty((max(stop - start, 0), self.dim), dtype=np.float32)
+                held = 0
+                if keep is not None:
+                    held = min(len(keep), len(self._resident))
+                    self._resident[:held] = keep[:held]
+                self._resident_start = start
+            if start + held < stop:
+                if len(self._resident) < stop - start:
+                    grown = np.empty((min(self.resident_rows, max(2 * len(self._resident), stop - start)), self.dim),
+                                     dtype=np.float32)
+                    grown[:held] = self._resident[:held]
+                    self._resident = grown
+                block = self._resident[held:stop - start]
+                np.copyto(block, vectors[start + held:stop], casting="unsafe")
+                if scales is not None:
+                    block *= scales[start + held:stop, None]
+                held = stop - start
+            self._resident_count = held
+            return self._resident[:min(held, count - start)]
+
+    def _scan(self, vectors, scales, start, count, query):
+        """Scores of rows start..count-1: resident rows in one product, the rest converted block by block"""
+        scores = np.empty(count - start, dtype=np.float32)
+        done = start
+        if self.resident_rows:
+            resident = self._resident_rows(vectors, scales, start, count)
+            scores[:len(resident)] = resident @ query
+            done += len(resident)
+        for block in range(done, count, BLOCK_ROWS):
+            stop = min(block + BLOCK_ROWS, count)
+            scores[block - start:stop - start] = self._score(
+                vectors[block:stop], scales[block:stop] if scales is not None else None, query
+            )
+        return scores
+
+    def _score_rows(self, vectors, scales, rows, query):
+        rows = np.sort(rows)
+        return rows, self._score(vectors[rows], scales[rows] if scales is not None else None, query)
+
+    def _ivf_candidates(self, ivf, query, k):
+        """Rows in the nprobe closest lists; with PQ codes, only the best approximate matches among them"""
+        nprobe = min(self.nprobe, len(ivf["centroids"]))
+        lists = np.argpartition(-(ivf["centroids"] @ query), nprobe - 1)[:nprobe]
+        offsets = ivf["offsets"]
+        positions = np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i in lists])
+        if ivf["codes"] is None or len(positions) <= k * RERANK_FACTOR:
+            return ivf["rows"][positions]
+
+        codebooks = ivf["codebooks"]
+        subspaces = len(codebooks)
+        lut = np.einsum("msd,md->ms", codebooks, query.reshape(subspaces, -1))
+        approx = lut[np.arange(subspaces), ivf["codes"][positions]].sum(axis=1)
+        best = np.argpartition(-approx, k * RERANK_FACTOR - 1)[:k * RERANK_FACTOR]
+        return ivf["rows"][positions[best]]
+
+    def search(self, query, k=5, exclude_key=None):
+        """Return the k most similar cases as dicts with row, score and metadata, best first"""
+        self._refresh()
+        with self._map_lock:
+            vectors, scales, count = self._vectors, self._scales, self.count
+        scales = scales if self.dtype == "int8" else None
+        if count == 0 or k <= 0:
+            return []
+        query = normalize(np.asarray(query, dtype=np.float32).ravel())
+        wanted = k + 1 if exclude_key is not None else k
+
+        ivf = self._ivf
+        if ivf is not None and ivf["count"] <= count:
+            rows, scores = self._score_rows(vectors, scales, self._ivf_candidates(ivf, query, wanted), query)
+            # Rows added after the partitioning was built are scanned exhaustively
+            rows = np.concatenate([rows, np.arange(ivf["count"], count)])
+            scores = np.concatenate([scores, self._scan(vectors, scales, ivf["count"], count, query)])
+        else:
+            rows, scores = None, self._scan(vectors, scales, 0, count, query)
+
+        wanted = min(wanted, len(scores))
+        if wanted == 0:
+            return []
+        top = np.argpartition(-scores, wanted - 1)[:wanted]
+        top = top[np.argsort(-scores[top])]
+        top_rows = [int(rows[i]) if rows is not None else int(i) for i in top]
+
+        placeholders = ",".join("?" * len(top_rows))
+        with self._db_lock:
+            metadata = {row[0]: row[1:] for row in self._db.execute(
+                f"SELECT row, key, condition, confidence, created_at FROM cases WHERE row IN ({placeholders})",
+                top_rows,
+            )}
+        results = []
+        for i, row in zip(top, top_rows):
+            key, condition, confidence, created_at = metadata.get(row, (None, None, None, None))
+            if exclude_key is not None and key == exclude_key:
+                continue
+            results.append({
+                "caseId": row,
+                "score": round(float(scores[i]), 4),
+                "condition": condition,
+                "confidence": confidence,
+                "createdAt": created_at,
+            })
+        return results[:k]
+
+    # --- IVF / product quantization ---
+
+    def _ivf_path(self, name):
+        return os.path.join(self.path, f"ivf_{name}.npy")
+
+    def _load_ivf(self):
+        if not os.path.exists(self._ivf_info_path):
+            return None
+        with open(self._ivf_info_path, "r") as f:
+            info = json.load(f)
+        has_pq = info.get("pqSubspaces", 0) > 0
+        return {
+            "count": info["count"],
+            "centroids": np.load(self._ivf_path("centroids")),
+            "offsets": np.load(self._ivf_path("offsets")),
+            "rows": np.load(self._ivf_path("rows"), mmap_mode="r"),
+            "codebooks": np.load(self._ivf_path("codebooks")) if has_pq else None,
+            "codes": np.load(self._ivf_path("codes"), mmap_mode="r") if has_pq else None,
+        }
+
+    def _dense(self, rows):
+        """Stored rows as float32 unit vectors"""
+        vectors = self._vectors[rows].astype(np.float32)
+        if self.dtype == "int8":
+            vectors *= self._scales[rows][:, None]
+        return vectors
+
+    def build_ivf(self, nlist, pq_subspaces=0, iterations=10, sample_size=None, seed=0):
+        """Partition the current rows into nlist lists (and PQ-encode them); new rows stay in the scanned tail"""
+        self._refresh()
+        count = self.count
+        if count < nlist:
+            raise ValueError(f"Need at least {nlist} vectors to build {nlist} lists, the index has {count}")
+        if pq_subspaces and self.dim % pq_subspaces:
+            raise ValueError(f"--pq-subspaces must divide the embedding size ({self.dim})")
+        rng = np.random.default_rng(seed)
+        sample_size = min(count, sample_size or 64 * max(nlist, 256 if pq_subspaces else 0))
+        sample = self._dense(np.sort(rng.choice(count, sample_size, replace=False)))
+
+        centroids = _kmeans(sample, nlist, iterations, rng, spherical=True)
+        assign = np.concatenate([
+            _nearest(self._dense(np.arange(start, min(start + BLOCK_ROWS, count))), centroids, spherical=True)
+            for start in range(0, count, BLOCK_ROWS)
+        ])
+        rows = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype(np.int64)
+        arrays = {"centroids": centroids, "offsets": offsets, "rows": rows}
+
+        if pq_subspaces:
+            sub_dim = self.dim // pq_subspaces
+            codebooks = np.stack([
+                _kmeans(sample[:, m * sub_dim:(m + 1) * sub_dim], 256, iterations, rng, spherical=False)
+                for m in range(pq_subspaces)
+            ])
+            codes = np.empty((count, pq_subspaces), dtype=np.uint8)
+            for start in range(0, count, BLOCK_ROWS):
+                block = self._dense(rows[start:start + BLOCK_ROWS])
+                for m in range(pq_subspaces):
+                    codes[start:start + len(block), m] = _nearest(
+                        block[:, m * sub_dim:(m + 1) * sub_dim], codebooks[m], spherical=False
+                    )
+            arrays.update(codebooks=codebooks.astype(np.float32), codes=codes)
+
+        for name, array in arrays.items():
+            with open(self._ivf_path(name) + ".tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(self._ivf_path(name) + ".tmp", self._ivf_path(name))
+        with open(self._ivf_info_path + ".tmp", "w") as f:
+            json.dump({"count": count, "nlist": nlist, "pqSubspaces": pq_subspaces}, f)
+        os.replace(self._ivf_info_path + ".tmp", self._ivf_info_path)
+        self._refresh()
+        return self._ivf
+
+
+def _bench(index, queries, k):
+    """Time queries drawn from the index itself; with IVF, also report recall against an exhaustive scan"""
+    rng = np.random.default_rng(1)
+    rows = rng.choice(index.count, min(queries, index.count), replace=False)
+    latencies, recalls = [], []
+    for row in rows:
+        query = index._dense(np.array([row]))[0]
+        start = time.perf_counter()
+        found = index.search(query, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if index._ivf is not None:
+            # Exhaustive reference, converted block by block so the resident rows aren't disturbed
+            scales = index._scales if index.dtype == "int8" else None
+            exact_scores = np.concatenate([
+                index._score(index._vectors[start:start + BLOCK_ROWS],
+                             scales[start:start + BLOCK_ROWS] if scales is not None else None, normalize(query))
+                for start in range(0, index.count, BLOCK_ROWS)
+            ])
+            exact = set(np.argpartition(-exact_scores, k - 1)[:k].tolist())
+            recalls.append(len(exact & {case["caseId"] for case in found}) / max(len(exact), 1))
+    latencies.sort()
+    print(f"{index.count} vectors ({index.dim}-d {index.dtype}), "
+          f"{'IVF' + (' + PQ' if index._ivf and index._ivf['codes'] is not None else '') if index._ivf else 'exhaustive'}")
+    print(f"  p50 {latencies[len(latencies) // 2]:.2f} ms, p99 {latencies[int(len(latencies) * 0.99)]:.2f} ms")
+    if recalls:
+        print(f"  recall@{k} vs exhaustive: {np.mean(recalls):.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain and benchmark a similar-case embedding index")
+    parser.add_argument("command", choices=["stats", "build", "bench", "fill"])
+    parser.add_argument("index_dir", help="Index directory, e.g. embedding_index/<model version>")
+    parser.add_argument("--nlist", type=int, default=1024, help="build: number of IVF lists")
+    parser.add_argument("--pq-subspaces", type=int, default=0, help="build: PQ subspaces (0 keeps exact rescoring only)")
+    parser.add_argument("--iterations", type=int, default=10, help="build: k-means iterations")
+    parser.add_argument("--nprobe", type=int, default=8, help="bench: lists searched per query")
+    parser.add_argument("--resident-rows", type=int, default=10000, help="bench: rows kept decoded in memory")
+    parser.add_argument("--queries", type=int, default=200, help="bench: number of queries")
+    parser.add_argument("--k", type=int, default=10, help="bench: neighbours per query")
+    parser.add_argument("--count", type=int, default=100000, help="fill: random vectors to append")
+    parser.add_argument("--dim", type=int, default=2048, help="fill: embedding size for a new index")
+    parser.add_argument("--dtype", choices=sorted(DTYPES), default="int8", help="fill: storage precision for a new index")
+    args = parser.parse_args()
+
+    if args.command == "fill":
+        index = EmbeddingIndex(args.index_dir, dim=args.dim, dtype=args.dtype)
+        rng = np.random.default_rng(0)
+        # Clustered synthetic data, so IVF recall numbers mean something
+        centres = rng.normal(size=(256, index.dim)).astype(np.float32)
+        first = index.count
+        for start in range(0, args.count, 10000):
+            n = min(10000, args.count - start)
+            vectors = centres[rng.integers(0, 256, n)] + 0.5 * rng.normal(size=(n, index.dim)).astype(np.float32)
+            index._append([(f"synthetic:{first + start + i}", vector, None, None, time.time())
+                           for i, vector in enumerate(vectors)])
+        index._refresh()
+        print(f"✅ {index.count} vectors in {args.index_dir}")
+        return 0
+
+    index = EmbeddingIndex(args.index_dir, nprobe=args.nprobe, resident_rows=args.resident_rows)
+    if args.command == "stats":
+        ivf = index._ivf
+        print(json.dumps({
+            "count": index.count,
+            "dim": index.dim,
+            "dtype": index.dtype,
+            "ivfCount": ivf["count"] if ivf else None,
+            "nlist": len(ivf["centroids"]) if ivf else None,
+            "pq": bool(ivf and ivf["codes"] is not None),
+        }, indent=2))
+    elif args.command == "build":
+        start = time.perf_counter()
+        index.build_ivf(args.nlist, args.pq_subspaces, args.iterations)
+        print(f"✅ Built {args.nlist} lists over {index.count} vectors in {time.perf_counter() - start:.1f}s")
+    elif args.command == "bench":
+        _bench(index, args.queries, args.k)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
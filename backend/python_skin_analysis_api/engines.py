@@ -0,0 +1,348 @@
+"""
+Inference engines for the skin analysis model
+Every engine exposes the same interface: load() once, then infer(batch) -> class probabilities
+Engines that can also return the penultimate-layer embedding from the same forward pass implement
+infer_with_embeddings(batch) and set supports_embeddings
+Framework imports happen inside the engine so a worker only pays for the runtime it actually uses
+"""
+
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceEngine:
+    """Base class: subclasses implement load() and infer()"""
+
+    name = "base"
+    supports_embeddings = False
+
+    def __init__(self, path):
+        self.path = path
+
+    def import_runtime(self):
+        """Import the framework this engine needs; split out so startup can time it separately"""
+
+    def load(self):
+        raise NotImplementedError
+
+    def infer(self, batch):
+        """Return class probabilities of shape (N, num_classes) for a (N, 224, 224, 3) float32 batch"""
+        raise NotImplementedError
+
+    def infer_with_embeddings(self, batch):
+        """Return (probabilities, embeddings of shape (N, dim)) from one forward pass; embeddings are None if unsupported"""
+        return self.infer(batch), None
+
+
+def _configure_tensorflow_threads(tf):
+    """TF thread pools must be sized before the runtime starts, i.e. before the model is loaded"""
+    try:
+        if config.SKIN_API_TF_INTRA_OP_THREADS:
+            tf.config.threading.set_intra_op_parallelism_threads(config.SKIN_API_TF_INTRA_OP_THREADS)
+        if config.SKIN_API_TF_INTER_OP_THREADS:
+            tf.config.threading.set_inter_op_parallelism_threads(config.SKIN_API_TF_INTER_OP_THREADS)
+    except RuntimeError as e:
+        # Raised when the runtime was already initialised, e.g. by a second engine in the same process
+        logger.warning(f"Could not set TensorFlow thread pools: {e}")
+
+
+def _apply_precision(tf, model, policy):
+    """
+    Rebuild a loaded model with every layer computing under a Keras mixed-precision policy
+    Saved layer configs pin their dtype, so setting the global policy before loading has no effect;
+    the output layer stays float32 so the softmax is computed at full precision
+    """
+    def rewrite(node, output_layer):
+        if isinstance(node, dict):
+            if "class_name" in node and isinstance(node.get("config"), dict):
+                layer_config = node["config"]
+                if "dtype" in layer_config and node["class_name"] != "InputLayer":
+                    layer_config["dtype"] = "float32" if layer_config.get("name") == output_layer else policy
+            for value in node.values():
+                rewrite(value, output_layer)
+        elif isinstance(node, list):
+            for value in node:
+                rewrite(value, output_layer)
+
+    architecture = json.loads(model.to_json())
+    rewrite(architecture, model.layers[-1].name)
+    mixed = tf.keras.models.model_from_json(json.dumps(architecture))
+    mixed.set_weights(model.get_weights())
+    return mixed
+
+
+class KerasEngine(InferenceEngine):
+    """
+    The original .keras model run through full TensorFlow/Keras
+    By default inference goes through a tf.function traced once per batch-size bucket (optionally XLA
+    compiled) instead of model.predict, which builds a data adapter and a distribution loop on every call;
+    smaller batches are zero-padded up to the next bucket so the hot path never retraces
+    """
+
+    name = "keras"
+    supports_embeddings = True
+
+    def import_runtime(self):
+        import tensorflow
+
+    def load(self):
+        import tensorflow as tf
+
+        _configure_tensorflow_threads(tf)
+        self._tf = tf
+        self.model = tf.keras.models.load_model(self.path)
+        if config.SKIN_API_PRECISION != "float32":
+            self.model = _apply_precision(tf, self.model, config.SKIN_API_PRECISION)
+        # Same weights with a second output: the named layer, or by default whatever feeds the classifier
+        if config.SKIN_API_EMBEDDING_LAYER:
+            embedding = self.model.get_layer(config.SKIN_API_EMBEDDING_LAYER).output
+        else:
+            embedding = self.model.layers[-1].input
+        self.embedding_model = tf.keras.Model(inputs=self.model.inputs, outputs=[self.model.outputs[0], embedding])
+
+        self._buckets = sorted(set(config.SKIN_API_BATCH_BUCKETS)) if config.SKIN_API_KERAS_COMPILED else []
+        if self._buckets:
+            serve = tf.function(
+                lambda batch: self.embedding_model(batch, training=False),
+                jit_compile=config.SKIN_API_XLA,
+            )
+            input_shape = tuple(self.model.inputs[0].shape[1:])
+            self._functions = {
+                size: serve.get_concrete_function(tf.TensorSpec((size,) + input_shape, tf.float32))
+                for size in self._buckets
+            }
+            self._padded = {size: np.zeros((size,) + input_shape, dtype=np.float32) for size in self._buckets}
+            self._lock = threading.Lock()
+        return self
+
+    def _run_compiled(self, batch):
+        """Run one bucket-sized call per chunk of at most the largest bucket"""
+        largest = self._buckets[-1]
+        if len(batch) > largest:
+            chunks = [self._run_compiled(batch[start:start + largest]) for start in range(0, len(batch), largest)]
+            return np.concatenate([c[0] for c in chunks]), np.concatenate([c[1] for c in chunks])
+
+        n = len(batch)
+        size = next(size for size in self._buckets if size >= n)
+        with self._lock:
+            if size != n:
+                padded = self._padded[size]
+                padded[:n] = batch
+                batch = padded
+            probabilities, embeddings = self._functions[size](self._tf.constant(batch))
+            return (
+                probabilities.numpy()[:n].astype(np.float32, copy=False),
+                embeddings.numpy()[:n].reshape(n, -1).astype(np.float32, copy=False),
+            )
+
+    def infer(self, batch):
+        if self._buckets:
+            return self._run_compiled(batch)[0]
+        return self.model.predict(batch, verbose=0)
+
+    def infer_with_embeddings(self, batch):
+        if self._buckets:
+            return self._run_compiled(batch)
+        probabilities, embeddings = self.embedding_model.predict(batch, verbose=0)
+        return probabilities, embeddings.reshape(len(batch), -1)
+
+
+class SavedModelEngine(InferenceEngine):
+    """A TF SavedModel export; skips Keras-level overhead but still needs TensorFlow"""
+
+    name = "savedmodel"
+
+    def import_runtime(self):
+        import tensorflow
+
+    def load(self):
+        import tensorflow as tf
+
+        _configure_tensorflow_threads(tf)
+        self._tf = tf
+        loaded = tf.saved_model.load(self.path)
+        # Keras 3 model.export() adds a `serve` endpoint; older exports only have the signature
+        self._fn = loaded.serve if hasattr(loaded, "serve") else loaded.signatures["serving_default"]
+        self._loaded = loaded
+        return self
+
+    def infer(self, batch):
+        outputs = self._fn(self._tf.constant(batch, dtype=self._tf.float32))
+        if isinstance(outputs, dict):
+            outputs = next(iter(outputs.values()))
+        return outputs.numpy()
+
+
+class TFLiteEngine(InferenceEngine):
+    """A TFLite flatbuffer run by the TFLite interpreter (tflite_runtime if installed, else TensorFlow)"""
+
+    name = "tflite"
+
+    def import_runtime(self):
+        try:
+            from tflite_runtime import interpreter as tflite
+        except ImportError:
+            from tensorflow.lite.python import interpreter as tflite
+        return tflite
+
+    def load(self):
+        tflite = self.import_runtime()
+
+        threads = config.SKIN_API_TF_INTRA_OP_THREADS or None
+        options = {}
+        if config.SKIN_API_SHARE_WEIGHTS:
+            # The interpreter memory-maps model_path; XNNPACK would repack the weights into private memory,
+            # so skip it and let every worker read the same mapped pages
+            options["experimental_op_resolver_type"] = tflite.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        self.interpreter = tflite.Interpreter(model_path=self.path, num_threads=threads, **options)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        # The interpreter holds per-call state, so calls must not overlap
+        self._lock = threading.Lock()
+        return self
+
+    def _quantize_input(self, batch):
+        """Map float input onto the integer input tensor of a fully quantized model"""
+        scale, zero_point = self._input["quantization"]
+        if self._input["dtype"] == np.float32 or not scale:
+            return batch.astype(self._input["dtype"], copy=False)
+        info = np.iinfo(self._input["dtype"])
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(self._input["dtype"])
+
+    def _dequantize_output(self, output):
+        scale, zero_point = self._output["quantization"]
+        if self._output["dtype"] == np.float32 or not scale:
+            return output.astype(np.float32, copy=False)
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def infer(self, batch):
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input["index"], list(batch.shape))
+                self.interpreter.allocate_tensors()
+                self._input = self.interpreter.get_input_details()[0]
+                self._output = self.interpreter.get_output_details()[0]
+                self._batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self._input["index"], self._quantize_input(batch))
+            self.interpreter.invoke()
+            return self._dequantize_output(self.interpreter.get_tensor(self._output["index"])).copy()
+
+
+class OnnxEngine(InferenceEngine):
+    """
+    An ONNX export run by ONNX Runtime on CPU; no TensorFlow import at all
+    Weights exported as external data (export_model.py --onnx-external-data) are memory-mapped by
+    ONNX Runtime, so workers share them
+    """
+
+    name = "onnx"
+
+    def import_runtime(self):
+        import onnxruntime
+
+    def load(self):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if config.SKIN_API_TF_INTRA_OP_THREADS:
+            options.intra_op_num_threads = config.SKIN_API_TF_INTRA_OP_THREADS
+        if config.SKIN_API_TF_INTER_OP_THREADS:
+            options.inter_op_num_threads = config.SKIN_API_TF_INTER_OP_THREADS
+        self.session = ort.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+        self._input_name = self.session.get_inputs()[0].name
+        return self
+
+    def infer(self, batch):
+        return self.session.run(None, {self._input_name: batch.astype(np.float32, copy=False)})[0]
+
+
+class StubEngine(InferenceEngine):
+    """
+    Tiny stand-in model for CI and benchmarks: global average pooling plus a fixed random linear layer
+    Needs no weights file; its path is the labels file, which only sets the number of classes
+    Its embedding is the image average-pooled over a 4x4 grid (48 values)
+    """
+
+    name = "stub"
+    supports_embeddings = True
+    seed = 0
+
+    def load(self):
+        import json
+
+        with open(self.path, "r") as f:
+            num_classes = len(json.load(f)["inv_class_indices"])
+        rng = np.random.default_rng(self.seed)
+        self._weights = rng.normal(0.0, 0.05, size=(3, num_classes)).astype(np.float32)
+        self._bias = rng.normal(0.0, 0.1, size=num_classes).astype(np.float32)
+        return self
+
+    def _classify(self, pooled):
+        logits = pooled @ self._weights + self._bias
+        logits -= logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def infer(self, batch):
+        return self._classify(batch.mean(axis=(1, 2)))
+
+    def infer_with_embeddings(self, batch):
+        n, height, width, channels = batch.shape
+        grid = batch.reshape(n, 4, height // 4, 4, width // 4, channels).mean(axis=(2, 4))
+        return self._classify(grid.mean(axis=(1, 2))), grid.reshape(n, -1)
+
+
+class SmallStubEngine(StubEngine):
+    """A second stand-in with its own random weights, to exercise the cascade's first stage without real models"""
+
+    name = "stub-small"
+    seed = 1
+
+
+ENGINES = {
+    KerasEngine.name: KerasEngine,
+    SavedModelEngine.name: SavedModelEngine,
+    TFLiteEngine.name: TFLiteEngine,
+    OnnxEngine.name: OnnxEngine,
+    StubEngine.name: StubEngine,
+    SmallStubEngine.name: SmallStubEngine,
+}
+
+# Where `python export_model.py` writes each format by default
+DEFAULT_PATHS = {
+    KerasEngine.name: "resnet50_finetune.keras",
+    SavedModelEngine.name: "resnet50_finetune_savedmodel",
+    TFLiteEngine.name: "resnet50_finetune.tflite",
+    OnnxEngine.name: "resnet50_finetune.onnx",
+    StubEngine.name: "class_indices.json",
+    SmallStubEngine.name: "class_indices.json",
+}
+
+
+# Post-training quantized TFLite variants written by quantize_model.py
+QUANTIZED_VARIANTS = ("dynamic", "int8", "fp16")
+
+
+def artifact_path(name, variant=""):
+    """Default artifact of an engine, or of a quantized variant (e.g. resnet50_finetune.int8.tflite)"""
+    if not variant:
+        return DEFAULT_PATHS.get(name, "")
+    root, extension = os.path.splitext(DEFAULT_PATHS[TFLiteEngine.name])
+    return f"{root}.{variant}{extension}"
+
+
+def create_engine(name, path=None):
+    """Build (but don't load) the engine registered under name"""
+    if name not in ENGINES:
+        raise ValueError(f"Unknown inference engine '{name}', expected one of {sorted(ENGINES)}")
+    return ENGINES[name](path or DEFAULT_PATHS[name])
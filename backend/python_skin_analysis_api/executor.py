@@ -0,0 +1,250 @@
+"""
+Bounded executor that keeps CPU-bound image work off the asyncio event loop
+"""
+
+import asyncio
+import functools
+import logging
+import math
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+
+import shm_ring
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a request is shed: max_queue_depth requests are already in flight,
+    or the estimated wait for the model exceeds the latency budget
+    retry_after is a hint, in whole seconds, for the Retry-After header
+    """
+
+    def __init__(self, message, retry_after=1, reason="queue_depth"):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def _keep_slot():
+    """release() of a decode whose model input is an ordinary array"""
+
+
+class InferenceExecutor:
+    """
+    Runs decode/preprocess work in a dedicated pool and caps how many requests are in flight
+    With kind="shm", worker processes write model inputs into a shared-memory ring of ring_slots slots
+    (see shm_ring.py); a decode waits for a free slot, which is the backpressure when inference falls behind
+    """
+
+    # Weight of the newest batch in the moving average of model time per image
+    SMOOTHING = 0.2
+
+    def __init__(self, kind="thread", max_workers=4, max_queue_depth=64, latency_budget_ms=0.0, ring_slots=32):
+        if kind not in ("thread", "process", "shm"):
+            raise ValueError(f"Unknown executor kind '{kind}', expected 'thread', 'process' or 'shm'")
+        if kind == "shm" and ring_slots < 1:
+            raise ValueError("The shared-memory ring needs at least one slot")
+        self.kind = kind
+        self.max_workers = max_workers
+        self._ring = None
+        self._free = None
+        if kind == "shm":
+            self._ring = shm_ring.SharedRing(ring_slots)
+            self._free = asyncio.Queue()
+            for slot in range(ring_slots):
+                self._free.put_nowait(slot)
+        self._pool = self._new_pool()
+        # Background slot releases for decodes whose caller gave up
+        self._releasing = set()
+        # Shutdowns of pools broken by a worker crash, by pool
+        self._retiring = {}
+        self.max_queue_depth = max_queue_depth
+        # 0 disables shedding on estimated wait; max_queue_depth still applies
+        self.latency_budget = latency_budget_ms / 1000.0
+        # Only touched from the event loop thread, so no lock is needed
+        self.in_flight = 0
+        # Moving average of model seconds per image, fed by observe_batch() from the micro-batcher thread;
+        # a single float assignment, so readers on the event loop never see a torn value
+        self.seconds_per_image = 0.0
+        logger.info(
+            f"Inference executor started ({kind}, workers={max_workers}, queue_depth={max_queue_depth}, "
+            f"latency_budget_ms={latency_budget_ms:g}" + (f", ring_slots={ring_slots})" if kind == "shm" else ")")
+        )
+
+    def _new_pool(self):
+        if self.kind == "thread":
+            return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="inference")
+        # Spawned rather than forked, so workers don't inherit the model runtime's memory and threads
+        # (forking a process with TensorFlow's thread pools running can deadlock the child)
+        if self.kind == "process":
+            return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=shm_ring.attach_worker,
+            initargs=(self._ring.name, self._ring.slots),
+        )
+
+    async def _replace_pool(self, broken):
+        """
+        Start a fresh pool after a worker process died, and return once the broken pool's processes are gone,
+        so a slot one of them was still writing into is never handed out again too early
+        """
+        if self._pool is broken:
+            logger.error(f"A {self.kind} executor worker died; starting a new pool")
+            self._pool = self._new_pool()
+            # Shut down once, however many requests the crash failed; they all wait for the same shutdown
+            retiring = asyncio.ensure_future(asyncio.to_thread(broken.shutdown, True))
+            self._retiring[broken] = retiring
+            retiring.add_done_callback(lambda _: self._retiring.pop(broken, None))
+        retiring = self._retiring.get(broken)
+        if retiring is not None:
+            await asyncio.shield(retiring)
+
+    @property
+    def free_slots(self):
+        """Ring slots not holding a model input (None unless kind="shm")"""
+        return self._free.qsize() if self._free is not None else None
+
+    def observe_batch(self, batch_size, infer_seconds):
+        """Update the per-image model time estimate after a model call"""
+        sample = infer_seconds / batch_size
+        if self.seconds_per_image == 0.0:
+            self.seconds_per_image = sample
+        else:
+            self.seconds_per_image += self.SMOOTHING * (sample - self.seconds_per_image)
+
+    def estimated_wait(self):
+        """Seconds a newly admitted request would wait for the requests ahead of it and its own model time"""
+        return (self.in_flight + 1) * self.seconds_per_image
+
+    def check_admission(self):
+        """Raise QueueFullError if a new request should be shed; cheap enough to call before reading the upload"""
+        if self.in_flight >= self.max_queue_depth:
+            raise QueueFullError(
+                f"{self.in_flight} requests already in flight",
+                retry_after=max(1, math.ceil(self.estimated_wait())),
+            )
+        if self.latency_budget > 0:
+            wait = self.estimated_wait()
+            if wait > self.latency_budget:
+                raise QueueFullError(
+                    f"Estimated wait {wait * 1000:.0f} ms exceeds the {self.latency_budget * 1000:.0f} ms budget",
+                    retry_after=max(1, math.ceil(wait)),
+                    reason="latency_budget",
+                )
+
+    @asynccontextmanager
+    async def admit(self):
+        """Reserve a slot for one request for the whole decode + inference path"""
+        self.check_admission()
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in the pool without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args)
+        pool = self._pool
+        try:
+            future = loop.run_in_executor(pool, call)
+        except BrokenProcessPool:
+            # A worker died while idle; nothing of this call ran yet, so retry once on a fresh pool
+            await self._replace_pool(pool)
+            pool = self._pool
+            future = loop.run_in_executor(pool, call)
+        try:
+            return await future
+        except BrokenProcessPool:
+            await self._replace_pool(pool)
+            raise
+
+    async def decode(self, prepare, payload):
+        """
+        Run prepare(payload) -> (model input, stage timings) in the pool; returns (model input, timings, release)
+        With kind="shm" the model input is a view of a ring slot that stays reserved until release() is called,
+        which may happen from any thread and more than once; with the other kinds release() does nothing
+        """
+        if self.kind != "shm":
+            img_array, timings = await self.run(prepare, payload)
+            return img_array, timings, _keep_slot
+
+        waiting = time.perf_counter()
+        slot = await self._free.get()
+        waited = time.perf_counter() - waiting
+        release = self._releaser(slot)
+        pool = self._pool
+        try:
+            try:
+                future = pool.submit(shm_ring.decode_into_slot, prepare, slot, payload)
+            except BrokenProcessPool:
+                # A worker died while idle; nothing of this request ran yet, so retry once on a fresh pool
+                await self._replace_pool(pool)
+                pool = self._pool
+                future = pool.submit(shm_ring.decode_into_slot, prepare, slot, payload)
+        except BaseException:
+            release()
+            raise
+        task = asyncio.wrap_future(future)
+        try:
+            # Shielded: a worker that already started keeps writing into the slot even if the caller gives up
+            timings = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # Only stops a decode no worker has picked up yet; a running one finishes before the slot is freed
+            future.cancel()
+            self._background(self._release_when_done(task, pool, release))
+            raise
+        except BaseException:
+            await self._release_when_done(task, pool, release)
+            raise
+        return self._ring.slot(slot), {"slot": waited, **timings}, release
+
+    def _releaser(self, slot):
+        """Thread-safe, idempotent release of one slot back to the free queue"""
+        loop = asyncio.get_running_loop()
+        lock = threading.Lock()
+        released = False
+
+        def release():
+            nonlocal released
+            with lock:
+                if released:
+                    return
+                released = True
+            try:
+                loop.call_soon_threadsafe(self._free.put_nowait, slot)
+            except RuntimeError:
+                # The event loop is closed; nothing will ask for a slot again
+                pass
+
+        return release
+
+    async def _release_when_done(self, task, pool, release):
+        """Free a slot once no worker can still write into it"""
+        try:
+            await task
+        except BrokenProcessPool:
+            await self._replace_pool(pool)
+        except BaseException:
+            pass
+        finally:
+            release()
+
+    def _background(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._releasing.add(task)
+        task.add_done_callback(self._releasing.discard)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+        if self._ring is not None:
+            self._ring.close(unlink=True)
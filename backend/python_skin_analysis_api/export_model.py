@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Export resnet50_finetune.keras to the other inference engine formats
+Each export is reloaded through engines.py and its outputs are checked against the Keras model
+
+Usage: python export_model.py [--formats savedmodel tflite onnx] [--tolerance 1e-3]
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from engines import DEFAULT_PATHS, create_engine
+
+INPUT_SHAPE = (224, 224, 3)
+
+
+def export_savedmodel(model, output_path):
+    import tensorflow as tf
+
+    if hasattr(model, "export"):
+        # Keras 3: writes a SavedModel with a `serve` endpoint
+        model.export(output_path)
+    else:
+        tf.saved_model.save(model, output_path)
+
+
+def export_tflite(model, output_path):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+
+
+def export_onnx(model, output_path, external_data=False):
+    import onnx
+    import tensorflow as tf
+    import tf2onnx
+
+    signature = [tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32, name="input")]
+    onnx_model, _ = tf2onnx.convert.from_keras(model, input_signature=signature, opset=17)
+
+    if external_data:
+        # Weights go to <model>.data, which ONNX Runtime memory-maps so workers can share them
+        onnx.save_model(
+            onnx_model,
+            output_path,
+            save_as_external_data=True,
+            all_tensors_to_one_file=True,
+            location=os.path.basename(output_path) + ".data",
+        )
+    else:
+        onnx.save_model(onnx_model, output_path)
+
+
+EXPORTERS = {
+    "savedmodel": export_savedmodel,
+    "tflite": export_tflite,
+    "onnx": export_onnx,
+}
+
+
+def sample_batch(batch_size, seed=0):
+    """Random inputs in the range produced by ResNet preprocessing (pixels minus ImageNet means)"""
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-125.0, 155.0, size=(batch_size,) + INPUT_SHAPE).astype(np.float32)
+
+
+def verify(engine_name, output_path, batch, expected, tolerance):
+    """Reload an export through its engine and compare its outputs with the Keras model"""
+    engine = create_engine(engine_name, output_path).load()
+    actual = engine.infer(batch)
+    max_diff = float(np.max(np.abs(actual - expected)))
+    same_top1 = bool(np.all(np.argmax(actual, axis=1) == np.argmax(expected, axis=1)))
+    ok = max_diff <= tolerance and same_top1
+    status = "✅" if ok else "❌"
+    print(f"{status} {engine_name}: max abs diff {max_diff:.2e}, top-1 {'matches' if same_top1 else 'differs'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the skin analysis model to other inference engines")
+    parser.add_argument("--model", default=DEFAULT_PATHS["keras"], help="Source .keras model")
+    parser.add_argument("--formats", nargs="+", choices=sorted(EXPORTERS), default=sorted(EXPORTERS))
+    parser.add_argument("--output-dir", default=".", help="Directory for the exported artifacts")
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="Max allowed abs difference in probabilities")
+    parser.add_argument("--samples", type=int, default=4, help="Batch size used for the output check")
+    parser.add_argument(
+        "--onnx-external-data",
+        action="store_true",
+        help="Store ONNX weights in a separate memory-mappable file (shared between workers)",
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"❌ Model file not found: {args.model}")
+        return 1
+
+    keras_engine = create_engine("keras", args.model).load()
+    batch = sample_batch(args.samples)
+    expected = keras_engine.infer(batch)
+
+    all_ok = True
+    for name in args.formats:
+        output_path = os.path.join(args.output_dir, os.path.basename(DEFAULT_PATHS[name]))
+        print(f"Exporting {name} -> {output_path}")
+        try:
+            if name == "onnx":
+                export_onnx(keras_engine.model, output_path, external_data=args.onnx_external_data)
+            else:
+                EXPORTERS[name](keras_engine.model, output_path)
+            all_ok = verify(name, output_path, batch, expected, args.tolerance) and all_ok
+        except ImportError as e:
+            print(f"❌ {name}: missing dependency ({e})")
+            all_ok = False
+        except Exception as e:
+            print(f"❌ {name}: export failed ({e})")
+            all_ok = False
+
+    return 0 if all_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
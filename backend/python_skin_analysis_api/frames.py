@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Binary frames of pre-resized pixels for /predict-skin-lesion/tensor
+Clients that can resize on-device send raw uint8 RGB pixels instead of an encoded image, so the server
+skips decoding and resizing: the body is viewed as an array with np.frombuffer, without a copy
+
+A frame is a 16-byte little-endian header followed by count * height * width * channels bytes of
+row-major (N, H, W, C) RGB pixels:
+
+    offset  size  field
+    0       4     magic b"SKNF"
+    4       1     format version (1)
+    5       1     dtype (1 = uint8)
+    6       2     count: images in the frame
+    8       2     height (224)
+    10      2     width (224)
+    12      2     channels (3)
+    14      2     reserved, zero
+
+    python frames.py photo.jpg other.jpg > frame.bin    # build a frame for testing
+"""
+
+import struct
+import sys
+
+import numpy as np
+
+from preprocessing import INPUT_SHAPE, decode_image
+from uploads import UploadError
+
+MAGIC = b"SKNF"
+VERSION = 1
+DTYPES = {1: np.uint8}
+HEADER = struct.Struct("<4sBBHHHHxx")
+
+CONTENT_TYPE = "application/octet-stream"
+
+
+class FrameError(UploadError):
+    """The body is not a well-formed frame of model-sized images"""
+
+
+def parse_frame(body, max_images):
+    """
+    Validate a frame and return its pixels as a read-only (N, 224, 224, 3) uint8 view of body
+    Raises FrameError for anything malformed, or sized differently from the model input
+    """
+    if len(body) < HEADER.size:
+        raise FrameError(f"Frame is shorter than its {HEADER.size}-byte header")
+    magic, version, dtype, count, height, width, channels = HEADER.unpack_from(body)
+    if magic != MAGIC:
+        raise FrameError(f"Frame must start with {MAGIC!r}")
+    if version != VERSION:
+        raise FrameError(f"Unsupported frame version {version}, expected {VERSION}")
+    if dtype not in DTYPES:
+        raise FrameError(f"Unsupported frame dtype {dtype}, expected 1 (uint8)")
+    if (height, width, channels) != INPUT_SHAPE:
+        raise FrameError(f"Frame images are {height}x{width}x{channels}, expected {'x'.join(map(str, INPUT_SHAPE))}")
+    if not 1 <= count <= max_images:
+        raise FrameError(f"Frame must hold 1 to {max_images} images, not {count}")
+    expected = HEADER.size + count * height * width * channels
+    if len(body) != expected:
+        raise FrameError(f"Frame of {count} images must be {expected} bytes, got {len(body)}")
+    return np.frombuffer(body, dtype=DTYPES[dtype], offset=HEADER.size).reshape((count,) + INPUT_SHAPE)
+
+
+def encode_frame(images):
+    """Build a frame from a (N, 224, 224, 3) or (224, 224, 3) uint8 array"""
+    images = np.ascontiguousarray(images, dtype=np.uint8)
+    if images.ndim == 3:
+        images = images[np.newaxis]
+    count, height, width, channels = images.shape
+    return HEADER.pack(MAGIC, VERSION, 1, count, height, width, channels) + images.tobytes()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python frames.py <image_path> [<image_path> ...] > frame.bin")
+        sys.exit(1)
+    pixels = []
+    for path in sys.argv[1:]:
+        with open(path, "rb") as f:
+            pixels.append(np.asarray(decode_image(f.read())))
+    sys.stdout.buffer.write(encode_frame(np.stack(pixels)))
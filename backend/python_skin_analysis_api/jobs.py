@@ -0,0 +1,157 @@
+"""
+Durable job queue for asynchronous predictions
+Jobs live in a SQLite file, so queued work survives restarts and every worker process of the
+production launcher can drain the same queue. Claiming is atomic and takes a lease: a job whose
+worker died is claimed again once its lease runs out. Failed jobs are retried with backoff, and
+finished results are kept for a TTL
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+
+class JobQueue:
+    """SQLite-backed queue of prediction jobs; every method is blocking, call them from a thread"""
+
+    def __init__(self, db_path, result_ttl_seconds=3600, max_attempts=3, retry_backoff_seconds=1.0,
+                 lease_seconds=60.0):
+        self.result_ttl_seconds = result_ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self._lock = threading.Lock()
+        # Autocommit mode; claim() opens its own write transaction
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, image BLOB, result BLOB, error TEXT, "
+            "attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, available_at REAL NOT NULL, "
+            "finished_at REAL, expires_at REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, available_at)")
+        logger.info(f"Job queue stored in {db_path}")
+
+    def enqueue(self, image_bytes):
+        """Store a new job and return its id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, status, image, created_at, available_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, sqlite3.Binary(image_bytes), now, now),
+            )
+        return job_id
+
+    def claim(self, limit):
+        """
+        Atomically lease up to limit jobs that are due, or whose previous lease expired;
+        returns [(id, image bytes, attempt number)]
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT id, image, attempts FROM jobs WHERE status IN (?, ?) AND available_at <= ? "
+                    "ORDER BY available_at LIMIT ?",
+                    (QUEUED, RUNNING, now, limit),
+                ).fetchall()
+                # A job that keeps outliving its lease (e.g. it crashes the worker) stops being retried
+                lost = [row for row in rows if row[2] >= self.max_attempts]
+                rows = [row for row in rows if row[2] < self.max_attempts]
+                self._db.executemany(
+                    "UPDATE jobs SET status = ?, error = ?, image = NULL, finished_at = ?, expires_at = ? WHERE id = ?",
+                    [(FAILED, "Worker lost while scoring this job", now, now + self.result_ttl_seconds, row[0])
+                     for row in lost],
+                )
+                self._db.executemany(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, available_at = ? WHERE id = ?",
+                    [(RUNNING, now + self.lease_seconds, row[0]) for row in rows],
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return [(job_id, bytes(image), attempts + 1) for job_id, image, attempts in rows]
+
+    def complete(self, job_id, result):
+        """Store a job's serialized response and drop its image"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, image = NULL, finished_at = ?, expires_at = ? WHERE id = ?",
+                (DONE, sqlite3.Binary(result), now, now + self.result_ttl_seconds, job_id),
+            )
+
+    def fail(self, job_id, attempts, error):
+        """Requeue a failed job with backoff, or mark it failed once it has used all its attempts"""
+        now = time.time()
+        with self._lock:
+            if attempts < self.max_attempts:
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, error = ?, available_at = ? WHERE id = ?",
+                    (QUEUED, error, now + self.retry_backoff_seconds * 2 ** (attempts - 1), job_id),
+                )
+                return QUEUED
+            self._db.execute(
+                "UPDATE jobs SET status = ?, error = ?, image = NULL, finished_at = ?, expires_at = ? WHERE id = ?",
+                (FAILED, error, now, now + self.result_ttl_seconds, job_id),
+            )
+            return FAILED
+
+    def get(self, job_id):
+        """Return a job's public fields as a dict, or None if it doesn't exist or has expired"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, result, error, attempts, created_at, finished_at, expires_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None or (row[6] is not None and row[6] < time.time()):
+            return None
+        status, result, error, attempts, created_at, finished_at, _ = row
+        return {
+            "id": job_id,
+            "status": status,
+            "result": bytes(result) if result is not None else None,
+            "error": error,
+            "attempts": attempts,
+            "createdAt": created_at,
+            "finishedAt": finished_at,
+        }
+
+    def pending(self):
+        """Number of jobs queued or running"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchone()[0]
+
+    def purge_expired(self):
+        """Delete finished jobs whose results have outlived the TTL"""
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),)
+            )
+        return cursor.rowcount
+
+    def counts(self):
+        """Number of jobs in each status"""
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)} | dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,84 +1,1014 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, Header, Request, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from contextlib import asynccontextmanager
+from typing import List
+import asyncio
+import hmac
 import logging
 import os
+import random
 import sys
-import json
+import time
+
+import config
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Skin Vision Analysis API")
-
-# Add CORS middleware to allow requests from Next.js frontend
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000"],  # Next.js default port
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Reference point for the startup timing breakdown reported by /readyz
+startup_began_at = time.perf_counter()
 
-# Try to import the prediction function from your model
+# Try to import the prediction helpers; the model itself is loaded in the lifespan hook
 try:
     # The model files are in the same directory as this script
     current_dir = os.path.dirname(os.path.abspath(__file__))
     sys.path.append(current_dir)
     
-    from predict_model import predict_image
+    import fastjson
+    import metrics
+    import predict_model
+    from preprocessing import preprocess_bytes_timed, preprocess_pixels_timed
+    import frames
+    from batching import MicroBatcher
+    from executor import InferenceExecutor, QueueFullError
+    from cache import PredictionCache, cache_key
+    from uploads import RequestSizeLimitMiddleware, UploadError, read_upload
+    import jobs
+    from model_registry import Deployment, ModelRegistry
+    from profiling import ProfileSession
+    from quality import QualityError, preprocess_bytes_checked, preprocess_pixels_checked
+    # The quality gate runs in the same executor step as decoding, before the model is called
+    prepare_bytes = preprocess_bytes_checked if config.SKIN_API_QUALITY_GATE else preprocess_bytes_timed
+    prepare_pixels = preprocess_pixels_checked if config.SKIN_API_QUALITY_GATE else preprocess_pixels_timed
     MODEL_AVAILABLE = True
-    logger.info("ML Model loaded successfully")
 except ImportError as e:
     logging.error(f"Could not import predict_model: {e}")
     MODEL_AVAILABLE = False
 
+# Decoding runs in the executor and concurrent requests share model calls through the micro-batcher,
+# so the event loop itself never does CPU-bound work
+executor = None
+prediction_cache = None
+
+# Durable queue behind the asynchronous job API, drained by a background task in every worker process
+job_queue = None
+job_worker = None
+# Set when a job is submitted or finishes in this process, so the drain loop and long-polls wake up early
+jobs_changed = None
+job_waiters = {}  # job id -> asyncio.Event set when that job finishes in this process
+
+# The model version serving new requests, with its own micro-batcher and similar-case index (for /similar)
+# A swap replaces this reference in one assignment; requests in flight keep the Deployment they started with
+deployment = None
+# Version scored alongside the active one on a sample of requests, and its comparison counters
+shadow = None
+shadow_stats = None
+registry = None
+# Serializes swaps, so two versions are never loaded at once
+swap_lock = None
+registry_watcher = None
+# Shadow comparisons and retiring deployments, referenced until they finish
+background_tasks = set()
+
+# Profiling session started through /admin/profile; None (the normal case) costs one check per request
+profiler = None
+last_profile = None
+
+# Readiness of the model, reported by /readyz
+model_state = {"ready": False, "error": None, "startup": {}, "memory": None}
+
+async def load_and_warm_up():
+    """Load the model and warm it up in the background so /healthz answers during startup"""
+    global job_worker, deployment, registry_watcher
+    try:
+        startup = await asyncio.to_thread(predict_model.load_model)
+        startup["warmup"] = await asyncio.to_thread(predict_model.warm_up, config.SKIN_API_WARMUP_BATCH_SIZES)
+        deployment = await start_deployment(predict_model.current)
+        startup["total"] = time.perf_counter() - startup_began_at
+        model_state["startup"] = {phase: round(seconds, 3) for phase, seconds in startup.items()}
+        # Measured once warm, so the weights and warm-up buffers are counted
+        model_state["memory"] = metrics.process_memory()
+        model_state["ready"] = True
+        if job_queue is not None:
+            job_worker = asyncio.create_task(drain_jobs())
+        metrics.MODEL_INFO.set(1, engine=predict_model.ENGINE_NAME, version=deployment.version)
+        logger.info(
+            f"Model ready in {startup['total']:.2f}s "
+            f"(import {startup['import']:.2f}s, load {startup['load']:.2f}s, warm-up {startup['warmup']:.2f}s)"
+        )
+        memory = model_state["memory"]
+        if memory is not None:
+            logger.info(
+                f"Process memory (pid {os.getpid()}): RSS {memory['rss']} MB, of which {memory['shared']} MB shared "
+                f"with other processes and {memory['private']} MB private; PSS {memory['pss']} MB"
+            )
+    except Exception as e:
+        model_state["error"] = str(e)
+        logger.error(f"Model failed to load: {e}")
+        return
+
+    if registry is not None and config.SKIN_API_MODEL_WATCH_SECONDS > 0:
+        registry_watcher = asyncio.create_task(watch_registry())
+    if registry is not None and config.SKIN_API_SHADOW_VERSION:
+        try:
+            await set_shadow(config.SKIN_API_SHADOW_VERSION)
+        except Exception as e:
+            logger.error(f"Shadow model {config.SKIN_API_SHADOW_VERSION} unavailable: {e}")
+
+async def open_similar_index(model):
+    """Open (or create) the embedding index for a model version; the API works without it"""
+    if not config.SKIN_API_EMBEDDING_INDEX_DIR or model.embedding_dim is None:
+        return None
+    try:
+        # Imported only when the index is on
+        from embedding_index import EmbeddingIndex
+
+        index = await asyncio.to_thread(
+            EmbeddingIndex,
+            os.path.join(config.SKIN_API_EMBEDDING_INDEX_DIR, model.version),
+            dim=model.embedding_dim,
+            dtype=config.SKIN_API_EMBEDDING_DTYPE,
+            nprobe=config.SKIN_API_EMBEDDING_NPROBE,
+            ivf_threshold=config.SKIN_API_EMBEDDING_IVF_THRESHOLD,
+            pq_subspaces=config.SKIN_API_EMBEDDING_PQ_SUBSPACES,
+            resident_rows=config.SKIN_API_EMBEDDING_RESIDENT_ROWS,
+        )
+        index.start()
+        return index
+    except Exception as e:
+        logger.error(f"Similar-case index unavailable: {e}")
+        return None
+
+async def start_deployment(model, is_shadow=False):
+    """Give a warmed-up model its own micro-batcher and, unless it only shadows traffic, its similar-case index"""
+    batcher = MicroBatcher(
+        model.predict_batch_stages,
+        max_batch_size=config.SKIN_API_MAX_BATCH_SIZE,
+        max_wait_ms=config.SKIN_API_MAX_BATCH_WAIT_MS,
+        # Shadow calls stay out of the admission control estimate
+        on_batch=None if is_shadow else record_batch,
+    )
+    batcher.start()
+    similar = None if is_shadow else await open_similar_index(model)
+    return Deployment(model, batcher, similar)
+
+def in_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def load_version(version, cascade=True):
+    """
+    Load and warm up a registry version off the event loop, beside the model that is serving
+    With cascade, it is put behind the first-stage model when one is configured (shadows never are)
+    """
+    model, timings = await asyncio.to_thread(registry.load, version)
+    if cascade:
+        model = await asyncio.to_thread(predict_model.with_cascade, model)
+    timings["warmup"] = await asyncio.to_thread(model.warm_up, config.SKIN_API_WARMUP_BATCH_SIZES)
+    return model, {phase: round(seconds, 3) for phase, seconds in timings.items()}
+
+async def swap_model(version):
+    """
+    Switch new requests to a registry version once it is loaded and warmed up
+    Requests already in flight finish on the previous version, which is retired after them
+    """
+    global deployment
+    async with swap_lock:
+        model, timings = await load_version(version)
+        new_deployment = await start_deployment(model)
+        previous, deployment = deployment, new_deployment
+        predict_model.activate(model)
+    metrics.MODEL_INFO.set(0, engine=predict_model.ENGINE_NAME, version=previous.version)
+    metrics.MODEL_INFO.set(1, engine=predict_model.ENGINE_NAME, version=model.version)
+    logger.info(f"Switched from model {previous.version} to {model.version} ({timings})")
+    in_background(previous.retire())
+    return previous.version, timings
+
+async def set_shadow(version):
+    """Start scoring a sample of traffic on a registry version as well, or stop with version=None"""
+    global shadow, shadow_stats
+    async with swap_lock:
+        new_shadow = None
+        if version:
+            model, _ = await load_version(version, cascade=False)
+            new_shadow = await start_deployment(model, is_shadow=True)
+        previous, shadow = shadow, new_shadow
+        shadow_stats = {"compared": 0, "agreed": 0, "activeSeconds": 0.0, "shadowSeconds": 0.0}
+    if previous is not None:
+        in_background(previous.retire())
+
+async def watch_registry():
+    """Swap to the version named in the registry's CURRENT file whenever it changes"""
+    failed = None
+    while True:
+        await asyncio.sleep(config.SKIN_API_MODEL_WATCH_SECONDS)
+        version = None
+        try:
+            version = await asyncio.to_thread(registry.current_version)
+            if version == deployment.version:
+                failed = None
+            elif version and version != failed and not swap_lock.locked():
+                await swap_model(version)
+        except Exception as e:
+            # Don't reload a broken version every interval; a new CURRENT or the admin endpoint retries
+            failed = version
+            logger.error(f"Could not switch to model {version}: {e}")
+
+@asynccontextmanager
+async def lifespan(app):
+    global executor, prediction_cache, job_queue, jobs_changed, registry, swap_lock
+    loader = None
+    if MODEL_AVAILABLE:
+        swap_lock = asyncio.Lock()
+        if config.SKIN_API_MODEL_REGISTRY:
+            registry = ModelRegistry(config.SKIN_API_MODEL_REGISTRY)
+        if config.SKIN_API_JOBS_DB:
+            job_queue = jobs.JobQueue(
+                config.SKIN_API_JOBS_DB,
+                result_ttl_seconds=config.SKIN_API_JOB_RESULT_TTL_SECONDS,
+                max_attempts=config.SKIN_API_JOB_MAX_ATTEMPTS,
+                retry_backoff_seconds=config.SKIN_API_JOB_RETRY_BACKOFF_SECONDS,
+                lease_seconds=config.SKIN_API_JOB_LEASE_SECONDS,
+            )
+            jobs_changed = asyncio.Event()
+        prediction_cache = PredictionCache(
+            max_entries=config.SKIN_API_CACHE_SIZE,
+            ttl_seconds=config.SKIN_API_CACHE_TTL_SECONDS,
+            db_path=config.SKIN_API_CACHE_DB or None,
+        )
+        executor = InferenceExecutor(
+            kind=config.SKIN_API_EXECUTOR,
+            max_workers=config.SKIN_API_EXECUTOR_WORKERS,
+            max_queue_depth=config.SKIN_API_MAX_QUEUE_DEPTH,
+            latency_budget_ms=config.SKIN_API_LATENCY_BUDGET_MS,
+            ring_slots=config.SKIN_API_RING_SLOTS,
+        )
+        metrics.register_collector(collect_runtime_metrics)
+        loader = asyncio.create_task(load_and_warm_up())
+
+    yield
+
+    if loader is not None and not loader.done():
+        loader.cancel()
+    if profiler is not None:
+        profiler.stop("shutdown")
+    if registry_watcher is not None:
+        registry_watcher.cancel()
+    if job_worker is not None:
+        # Jobs still running keep their lease and are picked up again after a restart
+        job_worker.cancel()
+    for serving in (deployment, shadow):
+        if serving is not None:
+            serving.close()
+    if executor is not None:
+        executor.shutdown()
+    if prediction_cache is not None:
+        prediction_cache.close()
+    if job_queue is not None:
+        job_queue.close()
+
+app = FastAPI(title="Skin Vision Analysis API", lifespan=lifespan)
+
+# Add CORS middleware to allow requests from Next.js frontend
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:3000"],  # Next.js default port
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Refuse oversized prediction requests before the multipart parser spools them
+if MODEL_AVAILABLE:
+    app.add_middleware(
+        RequestSizeLimitMiddleware,
+        max_body_bytes=config.SKIN_API_MAX_REQUEST_BYTES,
+        paths=["/predict-skin-lesion", "/jobs", "/similar"],
+    )
+
+def require_model():
+    """Reject prediction requests until the model is loaded and warmed up"""
+    if not MODEL_AVAILABLE or model_state["error"]:
+        raise HTTPException(status_code=500, detail="ML Model not available")
+    if not model_state["ready"]:
+        raise HTTPException(status_code=503, detail="ML Model is still loading", headers={"Retry-After": "5"})
+
+def overloaded(error):
+    """503 for a shed request, telling the client when the backlog should have drained"""
+    metrics.SHED.inc(reason=error.reason)
+    return HTTPException(
+        status_code=503,
+        detail="Server is busy, please try again shortly",
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+def quality_rejection(error, timings):
+    """422 for an image the quality gate rejected, naming the failed check; it never took model time"""
+    response = Response(content=error.to_json(), status_code=error.status_code, media_type="application/json")
+    response.headers["Server-Timing"] = metrics.server_timing(timings)
+    return response
+
+def record_batch(batch_size, infer_seconds):
+    """Called by the micro-batcher after every model call"""
+    metrics.BATCH_SIZE.observe(batch_size)
+    executor.observe_batch(batch_size, infer_seconds)
+
+def collect_runtime_metrics():
+    """Scrape-time gauges and counters that live on the executor and cache"""
+    lines = [
+        "# HELP skin_api_in_flight_requests Requests being decoded or waiting for the model",
+        "# TYPE skin_api_in_flight_requests gauge",
+        f"skin_api_in_flight_requests {executor.in_flight}",
+        "# HELP skin_api_estimated_wait_seconds Estimated wait for the model that admission control compares to the budget",
+        "# TYPE skin_api_estimated_wait_seconds gauge",
+        f"skin_api_estimated_wait_seconds {executor.estimated_wait():.6f}",
+        "# HELP skin_api_cache_events_total Prediction cache events",
+        "# TYPE skin_api_cache_events_total counter",
+    ]
+    if executor.free_slots is not None:
+        lines += [
+            "# HELP skin_api_ring_free_slots Shared-memory ring slots free for newly decoded images",
+            "# TYPE skin_api_ring_free_slots gauge",
+            f"skin_api_ring_free_slots {executor.free_slots}",
+        ]
+    snapshot = prediction_cache.snapshot()
+    for event in ("hits", "disk_hits", "misses", "coalesced", "evictions", "expired"):
+        lines.append(f'skin_api_cache_events_total{{event="{event}"}} {snapshot[event]}')
+    if deployment is not None and deployment.similar_index is not None:
+        lines += [
+            "# HELP skin_api_similar_cases Cases in the similar-case embedding index",
+            "# TYPE skin_api_similar_cases gauge",
+            f"skin_api_similar_cases {deployment.similar_index.count}",
+        ]
+    if job_queue is not None:
+        lines += ["# HELP skin_api_jobs Jobs in the queue by status", "# TYPE skin_api_jobs gauge"]
+        for status, count in job_queue.counts().items():
+            lines.append(f'skin_api_jobs{{status="{status}"}} {count}')
+    return lines
+
+async def run_inference(serving, image_bytes, timings, prepare=None):
+    """
+    Decode in the executor, then wait for this image's row of the next batched call of the serving model
+    prepare turns the payload into the model input (prepare_bytes by default, prepare_pixels for pre-resized
+    pixels); it raises QualityError for images the quality gate rejects, which never reach the model
+    Returns (probabilities, embedding, cascade stage); the embedding is None if the engine doesn't produce one,
+    and the stage is None unless a cascade is serving
+    """
+    # Resolved here: prepare_bytes only exists when the prediction modules imported
+    if prepare is None:
+        prepare = prepare_bytes
+    async with executor.admit():
+        try:
+            img_array, stage_timings, release = await executor.decode(prepare, image_bytes)
+        except QualityError as e:
+            metrics.QUALITY_CHECKS.inc(outcome=e.check)
+            raise
+        if "quality" in stage_timings:
+            metrics.QUALITY_CHECKS.inc(outcome="pass")
+        timings.update(stage_timings)
+        try:
+            # A ring slot is free again once the batcher has copied the image into a batch (or skipped it),
+            # before the model call
+            future = serving.batcher.submit(img_array, on_stacked=release)
+        except BaseException:
+            release()
+            raise
+        start_shadow(img_array, future)
+        probabilities, embedding, stage = await asyncio.wrap_future(future)
+        timings.update(future.timings)
+        return probabilities, embedding, stage
+
+def start_shadow(img_array, future):
+    """Also score a sample of images on the shadow model, unless the active model is already over budget"""
+    candidate, stats = shadow, shadow_stats
+    if candidate is None or random.random() >= config.SKIN_API_SHADOW_SAMPLE_RATE:
+        return
+    if 0 < executor.latency_budget < executor.estimated_wait():
+        return
+    if executor.kind == "shm":
+        # The ring slot is reused as soon as the active model has the image; the shadow batcher may be later
+        img_array = img_array.copy()
+    in_background(compare_shadow(candidate, stats, img_array, future))
+
+async def compare_shadow(candidate, stats, img_array, active_future):
+    """Compare the shadow model's answer with the active model's; never affects the response"""
+    if candidate.retired:
+        return
+    with candidate.use():
+        shadow_future = candidate.batcher.submit(img_array)
+        try:
+            (probabilities, _, _), (active_probabilities, _, _) = await asyncio.gather(
+                asyncio.wrap_future(shadow_future), asyncio.wrap_future(active_future)
+            )
+        except Exception as e:
+            metrics.SHADOW_PREDICTIONS.inc(outcome="error")
+            logger.warning(f"Shadow model {candidate.version} failed: {e}")
+            return
+    agreed = int(probabilities.argmax()) == int(active_probabilities.argmax())
+    stats["compared"] += 1
+    stats["agreed"] += agreed
+    stats["activeSeconds"] += active_future.timings["inference"]
+    stats["shadowSeconds"] += shadow_future.timings["inference"]
+    metrics.SHADOW_PREDICTIONS.inc(outcome="agree" if agreed else "disagree")
+    metrics.SHADOW_INFERENCE_SECONDS.observe(active_future.timings["inference"], model="active")
+    metrics.SHADOW_INFERENCE_SECONDS.observe(shadow_future.timings["inference"], model="shadow")
+
+async def predict_upload(image_bytes, timings, prepare=None):
+    """
+    Score uploaded bytes (or a pixel array, with prepare=prepare_pixels) on the active model
+    and return the serialized JSON response, reusing the cached or in-flight result for identical images
+    """
+    serving = deployment
+    model = serving.model
+
+    async def compute():
+        probabilities, embedding, stage = await run_inference(serving, image_bytes, timings, prepare)
+        start = time.perf_counter()
+        result = model.build_response_bytes(probabilities, stage)
+        timings["response"] = time.perf_counter() - start
+        if serving.similar_index is not None and embedding is not None:
+            # Appended by the index's writer thread, off the request path
+            entry, confidence = model.top_class(probabilities)
+            serving.similar_index.add(key, embedding, entry["condition"], confidence)
+        return result
+
+    with serving.use():
+        # Hashing large uploads releases the GIL, so keep it off the event loop
+        start = time.perf_counter()
+        key = await asyncio.to_thread(cache_key, image_bytes, model.version)
+        timings["hash"] = time.perf_counter() - start
+        return await prediction_cache.get_or_compute(key, compute)
+
+def notify_jobs(job_id=None):
+    """Wake the drain loop, and any long-poll waiting on job_id"""
+    jobs_changed.set()
+    waiter = job_waiters.get(job_id)
+    if waiter is not None:
+        waiter.set()
+
+async def run_job(job_id, image_bytes, attempt):
+    """Score one claimed job and store its result, or requeue it for another attempt"""
+    started = time.perf_counter()
+    timings = {}
+    status, error = 500, None
+    try:
+        body = await predict_upload(image_bytes, timings)
+        await asyncio.to_thread(job_queue.complete, job_id, body)
+        status = 200
+    except QualityError as e:
+        # Retrying won't make the photo usable: the rejection is the job's result
+        await asyncio.to_thread(job_queue.complete, job_id, e.to_json())
+        status = e.status_code
+    except Exception as e:
+        error = type(e).__name__
+        outcome = await asyncio.to_thread(job_queue.fail, job_id, attempt, f"Error processing image: {str(e)}")
+        logger.warning(f"Job {job_id} attempt {attempt} failed ({outcome}): {str(e)}")
+    finally:
+        record_request("jobs", status, started, timings, error)
+        notify_jobs(job_id)
+
+async def drain_jobs():
+    """
+    Claim queued jobs and score them, keeping up to SKIN_API_JOB_CONCURRENCY in flight
+    so the micro-batcher sees full batches; backs off while synchronous traffic is over budget
+    """
+    running = set()
+    poll_interval = config.SKIN_API_JOB_POLL_INTERVAL_MS / 1000.0
+    last_purge = 0.0
+    while True:
+        jobs_changed.clear()
+        room = min(
+            config.SKIN_API_JOB_CONCURRENCY - len(running),
+            executor.max_queue_depth - executor.in_flight,
+        )
+        over_budget = 0 < executor.latency_budget < executor.estimated_wait()
+        claimed = []
+        if room > 0 and not over_budget:
+            try:
+                claimed = await asyncio.to_thread(job_queue.claim, room)
+            except Exception as e:
+                logger.error(f"Could not claim jobs: {e}")
+        for job in claimed:
+            task = asyncio.create_task(run_job(*job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+
+        if time.monotonic() - last_purge > 60:
+            last_purge = time.monotonic()
+            await asyncio.to_thread(job_queue.purge_expired)
+
+        if not claimed:
+            # Nothing to do here: wait for a local submit/finish, or poll for jobs submitted to other processes
+            try:
+                await asyncio.wait_for(jobs_changed.wait(), poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+def job_response(job):
+    """Serialize a job, splicing its stored prediction bytes in as the result"""
+    fields = {key: value for key, value in job.items() if key != "result" and value is not None}
+    body = fastjson.dumps(fields)
+    if job["result"] is None:
+        return body
+    return body[:-1] + b',"result":' + job["result"] + b"}"
+
+def require_job_queue():
+    if not MODEL_AVAILABLE or model_state["error"]:
+        raise HTTPException(status_code=500, detail="ML Model not available")
+    if job_queue is None:
+        raise HTTPException(status_code=404, detail="The job API is disabled (SKIN_API_JOBS_DB is empty)")
+
+def record_request(endpoint, status, started, timings, error=None):
+    """Record one finished request: status counter, end-to-end latency, stage histograms, errors"""
+    seconds = time.perf_counter() - started
+    metrics.REQUESTS.inc(endpoint=endpoint, status=status)
+    metrics.REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+    metrics.observe_stages(timings)
+    if error is not None:
+        metrics.ERRORS.inc(type=error)
+    if profiler is not None and profiler.record(endpoint, status, seconds, timings):
+        in_background(stop_profiling(profiler, "requests"))
+
+async def stop_profiling(session, reason):
+    """End a profiling session (request limit, time limit or admin request) and write its artifacts"""
+    global profiler, last_profile
+    if profiler is session:
+        profiler = None
+        last_profile = session
+    return await asyncio.to_thread(session.stop, reason)
+
+async def stop_profiling_after(session, seconds):
+    await asyncio.sleep(seconds)
+    await stop_profiling(session, "time")
+
 @app.get("/")
 async def root():
     return {"message": "Skin Vision Analysis API"}
 
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and the event loop is responsive"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: the model is loaded and warmed up, with the startup timing breakdown"""
+    body = {
+        "ready": model_state["ready"],
+        "engine": predict_model.ENGINE_NAME if MODEL_AVAILABLE else None,
+        "modelVersion": predict_model.MODEL_VERSION if MODEL_AVAILABLE else None,
+        "startup": model_state["startup"],
+        "memoryMb": model_state["memory"],
+    }
+    if model_state["error"]:
+        body["error"] = model_state["error"]
+    return JSONResponse(content=body, status_code=200 if model_state["ready"] else 503)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint: stage latencies, batch sizes, errors, cache and model info"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss/eviction counters for the prediction cache"""
+    if prediction_cache is None:
+        raise HTTPException(status_code=500, detail="ML Model not available")
+    return {"modelVersion": predict_model.MODEL_VERSION, **prediction_cache.snapshot()}
+
 @app.post("/predict-skin-lesion")
 async def predict_skin_lesion(file: UploadFile = File(...)):
     """
     Predict skin lesion from uploaded image file
     """
-    if not MODEL_AVAILABLE:
-        raise HTTPException(status_code=500, detail="ML Model not available")
-    
-    # Create a temporary file to save the uploaded image
-    temp_file_path = f"temp_{file.filename}"
+    require_model()
+    started = time.perf_counter()
+    timings = {}
+    status, error = 500, None
     
     try:
-        # Validate file type
-        if not file.content_type.startswith("image/"):
-            raise HTTPException(status_code=400, detail="File must be an image")
-        
-        # Read image file
-        image_bytes = await file.read()
-        
-        # Save image to temporary file
-        with open(temp_file_path, "wb") as f:
-            f.write(image_bytes)
+        # Shed the request before reading its upload if the backlog is already over budget
+        executor.check_admission()
+
+        # Read the image in chunks, checking its magic bytes and size as it arrives
+        try:
+            image_bytes = await read_upload(
+                file, config.SKIN_API_MAX_UPLOAD_BYTES, config.SKIN_API_UPLOAD_CHUNK_BYTES
+            )
+        except UploadError as e:
+            error = type(e).__name__
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        timings["read"] = time.perf_counter() - started
         
-        # Use your prediction function
-        result = predict_image(temp_file_path)
+        # Decode in memory and score the image off the event loop
+        body = await predict_upload(image_bytes, timings)
         
-        # Return the result
-        if "success" in result and result["success"]:
-            return JSONResponse(content=result)
-        else:
-            raise HTTPException(status_code=500, detail=result.get("error", "Unknown error occurred"))
+        # The response is already serialized from the precompiled table
+        serialize_started = time.perf_counter()
+        response = Response(content=body, media_type="application/json")
+        timings["serialize"] = time.perf_counter() - serialize_started
+        timings["total"] = time.perf_counter() - started
+        response.headers["Server-Timing"] = metrics.server_timing(timings)
+        status = 200
+        return response
         
-    except HTTPException:
+    except HTTPException as e:
+        status = e.status_code
         raise
+    except QualityError as e:
+        status = e.status_code
+        return quality_rejection(e, timings)
+    except QueueFullError as e:
+        status, error = 503, "QueueFullError"
+        raise overloaded(e)
     except Exception as e:
+        error = type(e).__name__
         logger.error(f"Error in predict_skin_lesion: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
     finally:
-        # Clean up temporary file if it exists
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        timings.pop("total", None)
+        record_request("predict", status, started, timings, error)
+
+@app.post("/predict-skin-lesion/batch")
+async def predict_skin_lesion_batch(files: List[UploadFile] = File(...)):
+    """
+    Predict skin lesions for many uploaded images in one request
+    Results are streamed back as newline-delimited JSON in completion order, one line per file
+    """
+    require_model()
+    try:
+        executor.check_admission()
+    except QueueFullError as e:
+        raise overloaded(e)
+
+    # Read every upload before streaming starts; the files are closed once this handler returns
+    uploads = []
+    for index, file in enumerate(files):
+        try:
+            image_bytes = await read_upload(
+                file, config.SKIN_API_MAX_UPLOAD_BYTES, config.SKIN_API_UPLOAD_CHUNK_BYTES
+            )
+        except UploadError as e:
+            image_bytes = e
+        uploads.append((index, file.filename, image_bytes))
+
+    async def score(index, filename, image_bytes):
+        item = {"index": index, "filename": filename}
+        if isinstance(image_bytes, UploadError):
+            return fastjson.dumps({**item, "success": False, "error": str(image_bytes)})
+        started = time.perf_counter()
+        timings = {}
+        status, error = 500, None
+        try:
+            # All items are in flight at once, so the micro-batcher groups them into real batches
+            body = await predict_upload(image_bytes, timings)
+            status = 200
+            # Splice the item fields into the front of the precompiled response object
+            return fastjson.dumps(item)[:-1] + b"," + body[1:]
+        except QualityError as e:
+            status = e.status_code
+            return e.to_json(**item)
+        except QueueFullError as e:
+            status, error = 503, "QueueFullError"
+            metrics.SHED.inc(reason=e.reason)
+            return fastjson.dumps({**item, "success": False, "error": "Server is busy, please try again shortly"})
+        except Exception as e:
+            error = type(e).__name__
+            logger.error(f"Error in predict_skin_lesion_batch for {filename}: {str(e)}")
+            return fastjson.dumps({**item, "success": False, "error": f"Error processing image: {str(e)}"})
+        finally:
+            record_request("batch", status, started, timings, error)
+
+    async def stream_results():
+        tasks = [asyncio.ensure_future(score(*upload)) for upload in uploads]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield await next_result + b"\n"
+        finally:
+            # Client disconnected mid-stream: don't keep scoring images nobody will read
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.post("/predict-skin-lesion/tensor")
+async def predict_skin_lesion_tensor(request: Request):
+    """
+    Predict from a binary frame of pre-resized uint8 pixels (see frames.py) instead of an encoded image
+    The body is viewed in place with np.frombuffer and goes straight to preprocessing, with no decode or resize
+    A single-image frame gets the same response as /predict-skin-lesion; larger frames stream NDJSON lines
+    with each image's index, in completion order
+    """
+    require_model()
+    started = time.perf_counter()
+    try:
+        executor.check_admission()
+    except QueueFullError as e:
+        raise overloaded(e)
+    content_type = request.headers.get("content-type", "")
+    if content_type.split(";")[0].strip() != frames.CONTENT_TYPE:
+        raise HTTPException(status_code=415, detail=f"Send the frame as {frames.CONTENT_TYPE}")
+    body = await request.body()
+    try:
+        images = frames.parse_frame(body, config.SKIN_API_MAX_FRAME_IMAGES)
+    except frames.FrameError as e:
+        record_request("tensor", e.status_code, started, {}, type(e).__name__)
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    read_seconds = time.perf_counter() - started
+
+    async def score(index, pixels, started, timings):
+        status, error = 500, None
+        try:
+            body = await predict_upload(pixels, timings, prepare=prepare_pixels)
+            status = 200
+            return body, timings
+        except QualityError as e:
+            status = e.status_code
+            raise
+        except QueueFullError as e:
+            status, error = 503, "QueueFullError"
+            raise
+        except Exception as e:
+            error = type(e).__name__
+            logger.error(f"Error in predict_skin_lesion_tensor for image {index}: {str(e)}")
+            raise
+        finally:
+            record_request("tensor", status, started, timings, error)
+
+    if len(images) == 1:
+        timings = {"read": read_seconds}
+        try:
+            body, timings = await score(0, images[0], started, timings)
+        except QualityError as e:
+            return quality_rejection(e, timings)
+        except QueueFullError as e:
+            raise overloaded(e)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+        response = Response(content=body, media_type="application/json")
+        response.headers["Server-Timing"] = metrics.server_timing(timings)
+        return response
+
+    async def score_line(index, pixels):
+        item = {"index": index}
+        try:
+            body, _ = await score(index, pixels, time.perf_counter(), {"read": read_seconds})
+            return fastjson.dumps(item)[:-1] + b"," + body[1:]
+        except QualityError as e:
+            return e.to_json(**item)
+        except QueueFullError as e:
+            metrics.SHED.inc(reason=e.reason)
+            return fastjson.dumps({**item, "success": False, "error": "Server is busy, please try again shortly"})
+        except Exception as e:
+            return fastjson.dumps({**item, "success": False, "error": f"Error processing image: {str(e)}"})
+
+    async def stream_results():
+        tasks = [asyncio.ensure_future(score_line(index, pixels)) for index, pixels in enumerate(images)]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield await next_result + b"\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.post("/similar")
+async def similar_cases(file: UploadFile = File(...), k: int = 5):
+    """
+    Return the k previously analysed cases whose embeddings are closest to the uploaded image,
+    along with the image's own predicted condition
+    """
+    require_model()
+    if deployment.similar_index is None:
+        raise HTTPException(status_code=404, detail="Similar-case search is off (SKIN_API_EMBEDDING_INDEX_DIR) or not available for this model")
+    k = max(1, min(k, config.SKIN_API_SIMILAR_MAX_K))
+    started = time.perf_counter()
+    timings = {}
+    status, error = 500, None
+    try:
+        executor.check_admission()
+        try:
+            image_bytes = await read_upload(file, config.SKIN_API_MAX_UPLOAD_BYTES, config.SKIN_API_UPLOAD_CHUNK_BYTES)
+        except UploadError as e:
+            error = type(e).__name__
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        timings["read"] = time.perf_counter() - started
+
+        # Taken only now: a swap while the upload was being read retires the version that was active before it
+        serving = deployment
+        if serving.similar_index is None:
+            raise HTTPException(status_code=404, detail="Similar-case search is not available for this model")
+        with serving.use():
+            key = await asyncio.to_thread(cache_key, image_bytes, serving.version)
+            probabilities, embedding, _ = await run_inference(serving, image_bytes, timings)
+            search_started = time.perf_counter()
+            # The query image itself is left out if it was analysed before
+            neighbors = await asyncio.to_thread(serving.similar_index.search, embedding, k, key)
+            timings["search"] = time.perf_counter() - search_started
+        entry, confidence = serving.model.top_class(probabilities)
+        status = 200
+        response = JSONResponse(content={
+            "success": True,
+            "modelVersion": serving.version,
+            "condition": entry["condition"],
+            "confidence": confidence,
+            "neighbors": neighbors,
+        })
+        response.headers["Server-Timing"] = metrics.server_timing(timings)
+        return response
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    except QualityError as e:
+        status = e.status_code
+        return quality_rejection(e, timings)
+    except QueueFullError as e:
+        status, error = 503, "QueueFullError"
+        raise overloaded(e)
+    except Exception as e:
+        error = type(e).__name__
+        logger.error(f"Error in similar_cases: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+    finally:
+        record_request("similar", status, started, timings, error)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(file: UploadFile = File(...)):
+    """
+    Queue an image for asynchronous prediction and return its job id right away
+    Accepted even while the model is loading; the queue absorbs spikes instead of open connections
+    """
+    require_job_queue()
+    try:
+        image_bytes = await read_upload(file, config.SKIN_API_MAX_UPLOAD_BYTES, config.SKIN_API_UPLOAD_CHUNK_BYTES)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    pending = await asyncio.to_thread(job_queue.pending)
+    if pending >= config.SKIN_API_JOB_MAX_PENDING:
+        metrics.SHED.inc(reason="job_queue")
+        raise HTTPException(
+            status_code=503, detail="Job queue is full, please try again shortly", headers={"Retry-After": "30"}
+        )
+
+    job_id = await asyncio.to_thread(job_queue.enqueue, image_bytes)
+    notify_jobs()
+    return JSONResponse(
+        content={"id": job_id, "status": jobs.QUEUED},
+        status_code=202,
+        headers={"Location": f"/jobs/{job_id}"},
+    )
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """
+    Return a job's status, and its prediction once done
+    With ?wait=N the request is held for up to N seconds (capped) until the job finishes
+    """
+    require_job_queue()
+    deadline = time.monotonic() + min(max(wait, 0.0), config.SKIN_API_JOB_MAX_WAIT_SECONDS)
+    waiter = job_waiters.setdefault(job_id, asyncio.Event())
+    try:
+        while True:
+            waiter.clear()
+            job = await asyncio.to_thread(job_queue.get, job_id)
+            if job is None:
+                raise HTTPException(status_code=404, detail="Job not found or expired")
+            remaining = deadline - time.monotonic()
+            if job["status"] in jobs.FINISHED or remaining <= 0:
+                return Response(content=job_response(job), media_type="application/json")
+            # Woken when the job finishes in this process; the timeout covers jobs scored by other processes
+            try:
+                await asyncio.wait_for(waiter.wait(), min(remaining, config.SKIN_API_JOB_POLL_INTERVAL_MS / 1000.0))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        if job_waiters.get(job_id) is waiter:
+            del job_waiters[job_id]
+
+def require_admin(authorization):
+    """Admin endpoints need SKIN_API_ADMIN_TOKEN as a bearer token, and are hidden while it is unset"""
+    if not config.SKIN_API_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    expected = f"Bearer {config.SKIN_API_ADMIN_TOKEN}".encode()
+    if not hmac.compare_digest((authorization or "").encode(), expected):
+        raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
+
+def require_registry():
+    require_model()
+    if registry is None:
+        raise HTTPException(status_code=404, detail="No model registry configured (SKIN_API_MODEL_REGISTRY is empty)")
+    if swap_lock.locked():
+        raise HTTPException(status_code=409, detail="A model is already being loaded")
+
+async def load_registry_version(action, version):
+    """Run a swap or shadow change, mapping a missing or broken version to a client error"""
+    if version not in await asyncio.to_thread(registry.versions):
+        raise HTTPException(status_code=404, detail=f"Model version {version} is not in the registry")
+    try:
+        return await action(version)
+    except predict_model.ModelLoadError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.get("/admin/models")
+async def admin_models(authorization: str = Header(None)):
+    """The active and shadow model versions, the versions in the registry, and shadow comparison results"""
+    require_admin(authorization)
+    body = {
+        "engine": predict_model.ENGINE_NAME if MODEL_AVAILABLE else None,
+        "active": deployment.version if deployment is not None else None,
+        "available": await asyncio.to_thread(registry.versions) if registry is not None else [],
+        "current": await asyncio.to_thread(registry.current_version) if registry is not None else None,
+        "loading": swap_lock is not None and swap_lock.locked(),
+        "shadow": None,
+    }
+    if shadow is not None:
+        compared = shadow_stats["compared"]
+        body["shadow"] = {
+            "version": shadow.version,
+            "sampleRate": config.SKIN_API_SHADOW_SAMPLE_RATE,
+            "compared": compared,
+            "agreement": round(shadow_stats["agreed"] / compared, 4) if compared else None,
+            "activeInferenceMs": round(shadow_stats["activeSeconds"] / compared * 1000, 3) if compared else None,
+            "shadowInferenceMs": round(shadow_stats["shadowSeconds"] / compared * 1000, 3) if compared else None,
+        }
+    return body
+
+@app.post("/admin/models/activate")
+async def admin_activate_model(version: str, authorization: str = Header(None)):
+    """
+    Load and warm up a registry version, then switch this process to it and point CURRENT at it,
+    so other workers (and restarts) follow through the registry watch
+    """
+    require_admin(authorization)
+    require_registry()
+    previous, timings = await load_registry_version(swap_model, version)
+    await asyncio.to_thread(registry.set_current, version)
+    return {"modelVersion": version, "previousVersion": previous, "timings": timings}
+
+@app.post("/admin/models/shadow")
+async def admin_set_shadow(version: str, authorization: str = Header(None)):
+    """Score a sample of traffic on a registry version as well, replacing any current shadow"""
+    require_admin(authorization)
+    require_registry()
+    await load_registry_version(set_shadow, version)
+    return {"shadow": version, "sampleRate": config.SKIN_API_SHADOW_SAMPLE_RATE}
+
+@app.delete("/admin/models/shadow")
+async def admin_stop_shadow(authorization: str = Header(None)):
+    require_admin(authorization)
+    await set_shadow(None)
+    return {"shadow": None}
+
+@app.post("/admin/profile", status_code=201)
+async def admin_start_profile(requests: int = 100, seconds: float = 60, authorization: str = Header(None)):
+    """
+    Profile this worker for the next `requests` requests or `seconds` seconds, whichever comes first:
+    Python stack samples of every thread plus a TensorFlow trace, written under SKIN_API_PROFILE_DIR
+    """
+    global profiler
+    require_admin(authorization)
+    if profiler is not None:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    if requests < 1 or seconds <= 0:
+        raise HTTPException(status_code=400, detail="requests and seconds must be positive")
+    seconds = min(seconds, config.SKIN_API_PROFILE_MAX_SECONDS)
+    session = ProfileSession(
+        os.path.join(config.SKIN_API_PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() // 1000000 % 1000:03d}-{os.getpid()}"),
+        max_requests=requests,
+        max_seconds=seconds,
+        interval_seconds=config.SKIN_API_PROFILE_INTERVAL_MS / 1000.0,
+    )
+    profiler = session
+    try:
+        await asyncio.to_thread(session.start)
+    except Exception as e:
+        profiler = None
+        raise HTTPException(status_code=500, detail=f"Could not start profiling: {str(e)}")
+    in_background(stop_profiling_after(session, seconds))
+    return JSONResponse(content=session.summary(), status_code=201)
+
+@app.get("/admin/profile")
+async def admin_profile_status(authorization: str = Header(None)):
+    """The running profiling session, or the summary of the last one"""
+    require_admin(authorization)
+    session = profiler or last_profile
+    if session is None:
+        raise HTTPException(status_code=404, detail="No profile has been taken yet")
+    return session.summary()
+
+@app.delete("/admin/profile")
+async def admin_stop_profile(authorization: str = Header(None)):
+    """Stop the running profiling session early and write its artifacts"""
+    require_admin(authorization)
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="No profile is running")
+    return await stop_profiling(profiler, "stopped")
 
 if __name__ == "__main__":
     import uvicorn
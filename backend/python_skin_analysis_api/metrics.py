@@ -0,0 +1,168 @@
+"""
+Lightweight Prometheus metrics for the inference path
+Counters and histograms are plain dicts behind a lock, so recording costs about a microsecond
+and the service needs no extra dependency; render() produces the Prometheus text format
+"""
+
+import bisect
+import threading
+
+# Seconds; covers everything from a cache hit to a slow forward pass on a busy CPU
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+_registry = []
+_collectors = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, ("le", bound))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {series[-1]}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def register_collector(collect):
+    """collect() is called at scrape time and returns extra exposition lines (e.g. cache counters)"""
+    _collectors.append(collect)
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        lines.extend(collect())
+    return "\n".join(lines) + "\n"
+
+
+# --- Metrics for the skin analysis API ---
+
+REQUESTS = Counter("skin_api_requests_total", "Prediction requests by endpoint and HTTP status", ["endpoint", "status"])
+STAGE_SECONDS = Histogram(
+    "skin_api_stage_seconds",
+    "Time spent in each stage of the inference path (read, decode, preprocess, queue, inference, response)",
+    labelnames=["stage"],
+)
+REQUEST_SECONDS = Histogram("skin_api_request_seconds", "End-to-end prediction latency", labelnames=["endpoint"])
+BATCH_SIZE = Histogram("skin_api_batch_size", "Images per model call", buckets=BATCH_SIZE_BUCKETS)
+ERRORS = Counter("skin_api_errors_total", "Errors on the inference path by type", ["type"])
+SHED = Counter("skin_api_shed_total", "Requests rejected by admission control by reason", ["reason"])
+MODEL_INFO = Gauge("skin_api_model_info", "Currently loaded model", ["engine", "version"])
+SHADOW_PREDICTIONS = Counter(
+    "skin_api_shadow_predictions_total", "Sampled requests also scored by the shadow model, by outcome", ["outcome"]
+)
+SHADOW_INFERENCE_SECONDS = Histogram(
+    "skin_api_shadow_inference_seconds", "Model call time of requests compared in shadow mode", labelnames=["model"]
+)
+QUALITY_CHECKS = Counter(
+    "skin_api_quality_checks_total", "Images checked by the quality gate, by outcome (pass or the failed check)", ["outcome"]
+)
+CASCADE_IMAGES = Counter(
+    "skin_api_cascade_images_total", "Images scored in cascade mode, by the stage that answered", ["stage"]
+)
+
+
+def observe_stages(timings):
+    """Record a request's stage timings (seconds) into the stage histogram"""
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def process_memory():
+    """
+    This process's resident memory in MB from /proc/self/smaps_rollup (None off Linux)
+    shared counts pages also mapped by another process (e.g. model weights memory-mapped by every worker);
+    pss splits those between the processes mapping them, so summing it over workers gives their real total
+    """
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            fields = {line.split(":")[0]: int(line.split()[1]) for line in f if line.split()[-1:] == ["kB"]}
+    except OSError:
+        return None
+    return {
+        "rss": round(fields["Rss"] / 1024, 1),
+        "pss": round(fields["Pss"] / 1024, 1),
+        "shared": round((fields["Shared_Clean"] + fields["Shared_Dirty"]) / 1024, 1),
+        "private": round((fields["Private_Clean"] + fields["Private_Dirty"]) / 1024, 1),
+    }
+
+
+def server_timing(timings):
+    """Format stage timings (seconds) as a Server-Timing header value (milliseconds)"""
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items())
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Versioned model directory and the serving state of each loaded version
+
+    models/
+      CURRENT                  name of the version to serve (defaults to the last version by name)
+      2024-06-01/
+        resnet50_finetune.keras   the engine's artifact, named as in engines.DEFAULT_PATHS (or the quantized variant)
+        class_indices.json
+        knowledge_base.json       optional; the service-wide knowledge base otherwise
+
+A new version is loaded and warmed up next to the active one, then swapped in with a single reference
+assignment: requests already in flight finish on the Deployment they started with, which is shut down
+once the last of them is done
+
+    python model_registry.py list
+    python model_registry.py add 2024-06-01 --model new.keras --labels class_indices.json
+    python model_registry.py activate 2024-06-01
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import sys
+from contextlib import contextmanager
+
+import config
+from engines import DEFAULT_PATHS, artifact_path
+from predict_model import ModelLoadError, load_version
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = "CURRENT"
+LABELS_FILE = "class_indices.json"
+KNOWLEDGE_BASE_FILE = "knowledge_base.json"
+
+
+def _check_version_name(version):
+    if not version or version.startswith(".") or os.sep in version or version == CURRENT_FILE:
+        raise ModelLoadError(f"Invalid model version name: {version!r}")
+
+
+class ModelRegistry:
+    """A directory of model versions for one engine"""
+
+    def __init__(self, root, engine_name=None):
+        self.root = root
+        self.engine_name = engine_name or config.SKIN_API_ENGINE
+        self.artifact = os.path.basename(artifact_path(self.engine_name, config.SKIN_API_MODEL_VARIANT))
+
+    def versions(self):
+        """Names of the complete versions (artifact and labels present), sorted"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if not name.startswith(".")
+            and os.path.exists(os.path.join(self.root, name, self.artifact))
+            and os.path.exists(os.path.join(self.root, name, LABELS_FILE))
+        )
+
+    def current_version(self):
+        """The version named in CURRENT, or the last version by name; None for an empty registry"""
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE), "r") as f:
+                version = f.read().strip()
+            if version:
+                return version
+        except FileNotFoundError:
+            pass
+        versions = self.versions()
+        return versions[-1] if versions else None
+
+    def set_current(self, version):
+        """Point CURRENT at a version; every process watching the registry switches to it"""
+        if version not in self.versions():
+            raise ModelLoadError(f"Model version {version} is not in {self.root}")
+        path = os.path.join(self.root, CURRENT_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(version + "\n")
+        os.replace(path + ".tmp", path)
+
+    def paths(self, version):
+        """(model, labels, knowledge base) paths of a version"""
+        _check_version_name(version)
+        directory = os.path.join(self.root, version)
+        knowledge_base = os.path.join(directory, KNOWLEDGE_BASE_FILE)
+        if not os.path.exists(knowledge_base):
+            knowledge_base = config.SKIN_API_KNOWLEDGE_BASE_PATH
+        return os.path.join(directory, self.artifact), os.path.join(directory, LABELS_FILE), knowledge_base
+
+    def load(self, version=None):
+        """Load a version (by default the current one) without activating it; returns (Model, timings)"""
+        version = version or self.current_version()
+        if version is None:
+            raise ModelLoadError(f"No model versions found in {self.root}")
+        model_path, labels_path, knowledge_base_path = self.paths(version)
+        return load_version(model_path, labels_path, knowledge_base_path, version=version,
+                            engine_name=self.engine_name)
+
+    def add(self, version, model_path, labels_path, knowledge_base_path=None):
+        """
+        Copy a model artifact and its labels in as a new version
+        Files are staged in a hidden directory and renamed into place, so a watcher never sees half a version
+        """
+        _check_version_name(version)
+        target = os.path.join(self.root, version)
+        if os.path.exists(target):
+            raise ModelLoadError(f"Model version {version} already exists")
+        staging = os.path.join(self.root, f".{version}.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        if os.path.isdir(model_path):
+            shutil.copytree(model_path, os.path.join(staging, self.artifact))
+        else:
+            shutil.copyfile(model_path, os.path.join(staging, self.artifact))
+        shutil.copyfile(labels_path, os.path.join(staging, LABELS_FILE))
+        if knowledge_base_path:
+            shutil.copyfile(knowledge_base_path, os.path.join(staging, KNOWLEDGE_BASE_FILE))
+        os.rename(staging, target)
+        return target
+
+
+class Deployment:
+    """
+    A loaded Model being served, with its own micro-batcher and similar-case index
+    Requests hold it through use(); retire() waits for them before shutting it down
+    Only touched from the event loop, so the in-flight count needs no lock
+    """
+
+    def __init__(self, model, batcher, similar_index=None):
+        self.model = model
+        self.batcher = batcher
+        self.similar_index = similar_index
+        self.in_flight = 0
+        self.retired = False
+        self._idle = asyncio.Event()
+
+    @property
+    def version(self):
+        return self.model.version
+
+    @contextmanager
+    def use(self):
+        self.in_flight += 1
+        try:
+            yield self
+        finally:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._idle.set()
+
+    async def retire(self):
+        """Wait for the requests still using this version, then stop its batcher and close its index"""
+        self.retired = True
+        while self.in_flight:
+            self._idle.clear()
+            await self._idle.wait()
+        await asyncio.to_thread(self.close)
+        logger.info(f"Model {self.version} retired")
+
+    def close(self):
+        self.batcher.stop()
+        if self.similar_index is not None:
+            self.similar_index.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the versioned model directory")
+    parser.add_argument("command", choices=["list", "add", "activate"])
+    parser.add_argument("version", nargs="?", help="add/activate: version name")
+    parser.add_argument("--registry", default=config.SKIN_API_MODEL_REGISTRY or "models", help="Registry directory")
+    parser.add_argument("--engine", default=config.SKIN_API_ENGINE, choices=sorted(DEFAULT_PATHS))
+    parser.add_argument("--model", help="add: model artifact to copy in")
+    parser.add_argument("--labels", default=LABELS_FILE, help="add: class_indices.json for the model")
+    parser.add_argument("--knowledge-base", help="add: knowledge base for this version only")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.registry, args.engine)
+    try:
+        if args.command == "list":
+            current = registry.current_version()
+            for version in registry.versions():
+                print(f"{'*' if version == current else ' '} {version}")
+        elif args.command == "add":
+            if not args.version or not args.model:
+                parser.error("add needs a version and --model")
+            os.makedirs(args.registry, exist_ok=True)
+            print(f"✅ Added {registry.add(args.version, args.model, args.labels, args.knowledge_base)}")
+        else:
+            if not args.version:
+                parser.error("activate needs a version")
+            registry.set_current(args.version)
+            print(f"✅ {args.version} is now current; watching servers switch within SKIN_API_MODEL_WATCH_SECONDS")
+    except ModelLoadError as e:
+        print(f"❌ {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,385 +1,383 @@
-import tensorflow as tf
-from tensorflow.keras.preprocessing import image
-from tensorflow.keras.applications.resnet import preprocess_input
 import numpy as np
+import hashlib
 import json
 import os
 import sys
+import threading
+import time
+
+import config
+import fastjson
+from engines import QUANTIZED_VARIANTS, artifact_path, create_engine
+from preprocessing import IMAGE_SIZE, preprocess_array, preprocess_bytes
 
 # Model files are now in the same directory as this script
-MODEL_PATH = 'resnet50_finetune.keras'
+# The engine (keras, savedmodel, tflite or onnx) and its model path come from config
+ENGINE_NAME = config.SKIN_API_ENGINE
+MODEL_PATH = config.SKIN_API_ENGINE_PATH or artifact_path(ENGINE_NAME, config.SKIN_API_MODEL_VARIANT)
 LABELS_PATH = 'class_indices.json'
+KNOWLEDGE_BASE_PATH = config.SKIN_API_KNOWLEDGE_BASE_PATH
 
 # --- 1. Load Model and Labels ---
 
-# Check if files exist
-if not os.path.exists(MODEL_PATH):
-    print(f"Error: Model file not found at {MODEL_PATH}")
-    exit()
-if not os.path.exists(LABELS_PATH):
-    print(f"Error: Labels file not found at {LABELS_PATH}")
-    exit()
-
-# Load the model
-try:
-    model = tf.keras.models.load_model(MODEL_PATH)
-    print("✅ ResNet-50 Model loaded successfully.")
-except Exception as e:
-    print(f"Error loading model: {e}")
-    exit()
-
-# Load the class labels (using the inverted map from the notebook)
-try:
-    with open(LABELS_PATH, 'r') as f:
-        class_labels = json.load(f)['inv_class_indices'] # e.g., {"0": "acne", "1": "rosacea", ...}
+# Nothing heavy happens at import time: the API calls load_model() from its lifespan hook,
+# and the prediction functions call it on first use when running from the command line
+# The active Model; a new version replaces it as a whole (see activate())
+current = None
+# Module-level mirrors of the active model for scripts; the API reads one Model per request instead
+engine = None
+class_labels = None
+MODEL_VERSION = None
+# Size of the penultimate-layer embedding, known after warm_up() when the engine supports embeddings
+EMBEDDING_DIM = None
+_load_lock = threading.Lock()
+
+
+class ModelLoadError(Exception):
+    """Raised when the model or labels cannot be loaded"""
+
+
+class Model:
+    """
+    One loaded model version: its engine, labels and precompiled responses
+    A request takes everything from the same Model, so swapping versions never mixes them
+    """
+
+    def __init__(self, engine, version, class_labels, knowledge_base, response_table):
+        self.engine = engine
+        self.version = version
+        self.class_labels = class_labels
+        self.knowledge_base = knowledge_base
+        self.response_table = response_table
+        self.embedding_dim = None
+
+    def predict_batch(self, img_batch):
+        """Run the model on a stacked (N, 224, 224, 3) batch and return class probabilities"""
+        return self.engine.infer(img_batch)
+
+    def predict_batch_embeddings(self, img_batch):
+        """Like predict_batch, but also returns the penultimate-layer embeddings from the same forward pass (or None)"""
+        if not self.engine.supports_embeddings:
+            return self.engine.infer(img_batch), None
+        return self.engine.infer_with_embeddings(img_batch)
+
+    def predict_batch_stages(self, img_batch):
+        """
+        What the micro-batcher runs: (probabilities, embeddings, stages), where stages names the cascade
+        stage that answered each image (see cascade.py); a single model has no stages, so it is None
+        """
+        probabilities, embeddings = self.predict_batch_embeddings(img_batch)
+        return probabilities, embeddings, None
+
+    def warm_up(self, batch_sizes):
+        """Run a synthetic batch of each size so real requests don't pay first-call tracing cost"""
+        start = time.perf_counter()
+        for batch_size in batch_sizes:
+            probabilities, embeddings = self.predict_batch_embeddings(
+                np.zeros((batch_size,) + IMAGE_SIZE + (3,), dtype=np.float32)
+            )
+            if embeddings is not None:
+                self.embedding_dim = embeddings.shape[-1]
+            if probabilities.shape[-1] != len(self.response_table):
+                raise ModelLoadError(
+                    f"Model {self.version} outputs {probabilities.shape[-1]} classes "
+                    f"but its labels have {len(self.response_table)}"
+                )
+        return time.perf_counter() - start
+
+    def top_class(self, probabilities):
+        """The response table entry of the most likely class and its confidence in percent"""
+        class_index = int(np.argmax(probabilities))
+        confidence = round(float(probabilities[class_index] * 100), 2)
+        return self.response_table[class_index], confidence
+
+    def build_response_bytes(self, probabilities, stage=None):
+        """Turn one row of class probabilities into the serialized JSON response"""
+        entry, confidence = self.top_class(probabilities)
+        return entry["prefix"] + repr(confidence).encode() + entry["suffix"]
+
+    def build_response(self, probabilities, stage=None):
+        """Turn one row of class probabilities into the JSON response"""
+        entry, confidence = self.top_class(probabilities)
+        response = {"success": True, "modelVersion": self.version}
+        if stage is not None:
+            response["cascadeStage"] = stage
+        return {
+            **response,
+            "analysis": {"condition": entry["condition"], "confidence": confidence, **entry["static"]},
+        }
+
+
+def _file_digest(path):
+    """Short content hash of a model file (or SavedModel directory), used to version cached predictions"""
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    else:
+        paths = [path]
+    for file_path in paths:
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def load_version(model_path, labels_path, knowledge_base_path, version=None, engine_name=ENGINE_NAME):
+    """
+    Load one model version without activating it; returns (Model, timing breakdown in seconds)
+    version defaults to a hash of the weights
+    """
+    # Check if files exist
+    if not os.path.exists(model_path):
+        raise ModelLoadError(f"Model file not found at {model_path}")
+    if not os.path.exists(labels_path):
+        raise ModelLoadError(f"Labels file not found at {labels_path}")
+
+    # Fail fast on label/knowledge base mismatches before paying for the model load
+    with open(labels_path, 'r') as f:
+        labels = json.load(f).get('inv_class_indices', {})
+    knowledge_base = load_knowledge_base(knowledge_base_path)
+    # Identifies the weights that produced a prediction (e.g. for cache keys)
+    version = version or _file_digest(model_path)
+    table = build_response_table(labels, knowledge_base, version)
+
+    timings = {}
+    start = time.perf_counter()
+    new_engine = create_engine(engine_name, model_path)
+    new_engine.import_runtime()
+    timings["import"] = time.perf_counter() - start
+
+    # Load the model
+    start = time.perf_counter()
+    try:
+        new_engine.load()
+    except Exception as e:
+        raise ModelLoadError(f"Error loading model: {e}") from e
+    timings["load"] = time.perf_counter() - start
+    print(f"✅ ResNet-50 Model {version} loaded successfully ({engine_name} engine).")
     print("✅ Class labels loaded.")
-except Exception as e:
-    print(f"Error loading {LABELS_PATH}. Make sure it contains 'inv_class_indices'. Error: {e}")
-    exit()
-
-# --- 2. Hardcoded Knowledge Base ---
-
-KNOWLEDGE_BASE = {
-    "Acne": {
-        "recommendations": [
-            "Wash the affected area twice daily with a gentle cleanser; avoid abrasive scrubs.",
-            "Use topical treatments (benzoyl peroxide, topical retinoids) as recommended; consult a pharmacist or clinician for prescription options."
-        ],
-        "severity": "Medium",
-        "possibleCauses": [
-            "Blocked hair follicles and sebaceous glands",
-            "Increased sebum production (hormonal influence)",
-            "Bacterial overgrowth (Cutibacterium acnes) and inflammation"
-        ],
-        "source": "NHS (Acne)"
-    },
-
-    "Rosacea": {
-        "recommendations": [
-            "Identify and avoid personal triggers (heat, spicy foods, alcohol, sun exposure).",
-            "Use gentle skincare and broad-spectrum sunscreen daily; topical or oral meds from a GP/dermatologist can control flare-ups."
-        ],
-        "severity": "Medium",
-        "possibleCauses": [
-            "Chronic inflammatory condition (exact cause unknown)",
-            "Abnormal blood vessel reactivity and possible Demodex involvement",
-            "Genetic and environmental triggers"
-        ],
-        "source": "NHS (Rosacea)"
-    },
-
-    "Psoriasis": {
-        "recommendations": [
-            "Keep skin moisturized; use topical corticosteroids or vitamin-D analogues for flares as advised by a clinician.",
-            "Phototherapy or systemic/biologic treatments may be needed for moderate–severe disease under specialist care."
-        ],
-        "severity": "High (can be high for widespread or systemic disease)",
-        "possibleCauses": [
-            "Immune-mediated (T-cell driven) acceleration of skin cell turnover",
-            "Genetic predisposition and environmental triggers (infections, stress, meds)"
-        ],
-        "source": "Mayo Clinic (Psoriasis)"
-    },
-
-    "Warts": {
-        "recommendations": [
-            "Most warts resolve spontaneously; topical treatments (salicylic acid), cryotherapy or clinic removal are options.",
-            "Avoid direct contact with others' warts and do not pick at warts to reduce spread and scarring."
-        ],
-        "severity": "Low",
-        "possibleCauses": [
-            "Human papillomavirus (HPV) infection (many strains; different strains cause different wart types)"
-        ],
-        "source": "NHS / Cleveland Clinic (Warts)"
-    },
-
-    "Vitiligo": {
-        "recommendations": [
-            "See a dermatologist for options — topical corticosteroids, topical JAK inhibitors (where approved), or light therapy may help repigment some areas.",
-            "Use sunscreen and cosmetics (camouflage) to protect depigmented areas and reduce contrast."
-        ],
-        "severity": "Medium (primarily cosmetic but psychosocial impact can be high)",
-        "possibleCauses": [
-            "Autoimmune destruction or dysfunction of melanocytes",
-            "Genetic susceptibility and possible triggering events (stress, trauma, sunburn)"
-        ],
-        "source": "Mayo Clinic (Vitiligo)"
-    },
-
-    "Vasculitis": {
-        "recommendations": [
-            "Seek medical evaluation (some forms are serious and require systemic treatment).",
-            "Treatment depends on type — may include corticosteroids and immunosuppression under specialist supervision."
-        ],
-        "severity": "High (many forms can damage organs if untreated)",
-        "possibleCauses": [
-            "Immune-mediated inflammation of blood vessels (various triggers)",
-            "Associations with infections, medications, or autoimmune disease"
-        ],
-        "source": "Mayo Clinic (Vasculitis)"
-    },
-
-    "Vascular_Tumors": {
-        "recommendations": [
-            "Consult a clinician — many (e.g., infantile hemangiomas) are observed; treat if fast-growing, ulcerating, or function-threatening (beta blockers, laser).",
-            "Large or midline lesions require specialist assessment."
-        ],
-        "severity": "Medium (variable; some benign/self-resolving, some need treatment)",
-        "possibleCauses": [
-            "Abnormal localized growth of blood vessels (often developmental)",
-            "Genetic and developmental factors"
-        ],
-        "source": "Mayo Clinic (Hemangioma)"
-    },
-
-    "Tinea": {
-        "recommendations": [
-            "Keep the area clean and dry; topical antifungal creams (e.g., terbinafine, clotrimazole) are first-line for skin ringworm.",
-            "For toenail or extensive infections, oral antifungals prescribed by a clinician may be necessary."
-        ],
-        "severity": "Low (common and usually treatable), higher risk if diabetic or immunosuppressed",
-        "possibleCauses": [
-            "Dermatophyte fungi (Trichophyton, Microsporum, Epidermophyton)",
-            "Spread by skin-to-skin contact, animals, shared objects or surfaces"
-        ],
-        "source": "CDC (Tinea / Ringworm)"
-    },
-
-    "Sun_Sunlight_Damage": {
-        "recommendations": [
-            "Wear broad-spectrum sunscreen daily (SPF 30+), cover up, and avoid peak sun hours.",
-            "Have suspicious or changing spots checked by a clinician; regular self-skin exams help early detection."
-        ],
-        "severity": "Medium (chronic sun damage increases risk of skin cancers; severity depends on extent and lesion type)",
-        "possibleCauses": [
-            "Cumulative UV radiation exposure causing DNA damage in skin cells"
-        ],
-        "source": "Cancer Society / NHS (Sun damage & prevention)"
-    },
-
-    "SkinCancer": {
-        "recommendations": [
-            "See a clinician promptly for any new, changing, bleeding, or non-healing lesion — early detection improves outcomes.",
-            "Practice sun-protection and regular skin checks; suspicious moles may require biopsy/excision."
-        ],
-        "severity": "High (can be life-threatening for melanoma; early treatment is critical)",
-        "possibleCauses": [
-            "UV radiation (sun/tanning beds), genetic predisposition, immunosuppression"
-        ],
-        "source": "American Cancer Society / Cancer Research UK (Skin cancer signs)"
-    },
-
-    "Seaborrh_Keratoses": {
-        "recommendations": [
-            "Seborrhoeic keratoses are benign; removal is not required but can be done for cosmetic reasons (cryotherapy, curettage, laser).",
-            "See a clinician if a lesion changes appearance — any changing pigmented lesion should be checked."
-        ],
-        "severity": "Low (benign)",
-        "possibleCauses": [
-            "Age-related proliferation of epidermal cells; often familial"
-        ],
-        "source": "British Association of Dermatologists / NHS (Seborrhoeic keratosis)"
-    },
-
-    "Moles": {
-        "recommendations": [
-            "Monitor moles for ABCDE changes (Asymmetry, Border irregularity, Color variation, Diameter, Evolution) and get new/changing moles checked.",
-            "Photograph lesions you're tracking and report changes promptly to a clinician."
-        ],
-        "severity": "Low for common moles; high concern if suspicious for melanoma",
-        "possibleCauses": [
-            "Local clusters of melanocytes; influenced by genetics and UV exposure"
-        ],
-        "source": "National Cancer Institute / Cancer Research UK (Moles & melanoma)"
-    },
-
-    "Lupus": {
-        "recommendations": [
-            "Any persistent or photosensitive rash or systemic symptoms merits specialist assessment (rheumatology/dermatology).",
-            "Sun protection and specialist-directed systemic or topical therapies are common parts of management."
-        ],
-        "severity": "High (systemic lupus can affect organs; cutaneous lupus may signal systemic disease)",
-        "possibleCauses": [
-            "Autoimmune processes, genetic predisposition, environmental triggers (sun exposure, meds)"
-        ],
-        "source": "Mayo Clinic (Lupus)"
-    },
-
-    "Lichen": {
-        "recommendations": [
-            "Topical steroids and symptomatic measures (emollients, antihistamines for itch) are commonly used; most cases improve over months.",
-            "Refer to dermatology if widespread, mucosal, or persistent."
-        ],
-        "severity": "Medium (usually self-limited but can be uncomfortable)",
-        "possibleCauses": [
-            "Immune-mediated reaction; exact triggers often unknown"
-        ],
-        "source": "NHS (Lichen planus)"
-    },
-
-    "Infestions_Bites": {
-        "recommendations": [
-            "Clean the area; for itching use topical anti-itch creams or oral antihistamines; seek care if signs of infection or severe reaction.",
-            "For suspected scabies or lice, follow recommended treatment regimens and treat close contacts if indicated."
-        ],
-        "severity": "Low for simple bites; high if allergic reaction or secondary infection occurs",
-        "possibleCauses": [
-            "Insect bites (mosquito, flea), mites (scabies), lice; local reactions and secondary infection"
-        ],
-        "source": "NHS / CDC (Insect bites & stings guidance)"
-    },
-
-    "Eczema": {
-        "recommendations": [
-            "Daily emollient use (moisturizers) is the cornerstone; topical corticosteroids treat flares and identify and avoid triggers.",
-            "Severe or refractory cases may need specialist input, phototherapy, or systemic agents."
-        ],
-        "severity": "Medium (can be severe for widespread or infected eczema)",
-        "possibleCauses": [
-            "Atopic tendency (genetic), skin barrier dysfunction, environmental triggers/allergens"
-        ],
-        "source": "NHS (Atopic eczema)"
-    },
-
-    "DrugEruption": {
-        "recommendations": [
-            "If a new rash appears after starting a medication, contact a clinician — stop suspected drugs only after medical advice.",
-            "Severe drug eruptions require urgent medical care (some can be life-threatening)."
-        ],
-        "severity": "Medium (most are self-limited) to High (rare severe reactions like SJS/TEN)",
-        "possibleCauses": [
-            "Immune reaction to a medication or its metabolites"
-        ],
-        "source": "Review: Cutaneous adverse drug reactions (NCBI/PubMed)"
-    },
-
-    "Candidiasis": {
-        "recommendations": [
-            "Keep affected areas clean and dry; topical antifungal creams (e.g., nystatin, clotrimazole) commonly treat skin yeast infections.",
-            "Oral/systemic antifungals are used for extensive or recurrent infections and in immunocompromised patients."
-        ],
-        "severity": "Low for uncomplicated skin candidiasis; can be serious if invasive in immunocompromised",
-        "possibleCauses": [
-            "Overgrowth of Candida species (yeast) in warm, moist areas; risk factors include diabetes and immunosuppression"
-        ],
-        "source": "CDC (Candidiasis)"
-    },
-
-    "Bullous": {
-        "recommendations": [
-            "Seek dermatologist evaluation for blistering diseases; corticosteroids and immunosuppression are common treatments for autoimmune blistering disorders.",
-            "Protect blisters, avoid infection, and follow specialist treatment plans."
-        ],
-        "severity": "High (bullous autoimmune diseases can be extensive and need specialist care)",
-        "possibleCauses": [
-            "Autoimmune attack on skin adhesion molecules (e.g., bullous pemphigoid, pemphigus vulgaris)",
-        ],
-        "source": "Mayo Clinic (Bullous pemphigoid)"
-    },
-
-    "Benign_tumors": {
-        "recommendations": [
-            "Most benign skin tumors are harmless; see a clinician if they change or cause symptoms.",
-            "Removal options are available for cosmetic or symptomatic lesions."
-        ],
-        "severity": "Low",
-        "possibleCauses": [
-            "Varied: cysts, lipomas, benign adnexal tumors — often related to local cell proliferation or genetics"
-        ],
-        "source": "General dermatology references (NHS / Mayo Clinic)"
-    },
-
-    "Actintic_Keratosis": {
-        "recommendations": [
-            "Actinic (solar) keratoses can be precancerous — have suspicious or persistent rough, scaly patches checked and treated (cryotherapy, topical treatments).",
-            "Reduce sun exposure and use sunscreen to help prevent new lesions."
-        ],
-        "severity": "Medium (precancerous — risk of progression to squamous cell carcinoma if untreated)",
-        "possibleCauses": [
-            "Chronic UV radiation damage leading to abnormal skin cell growth"
-        ],
-        "source": "NHS / Cancer Research UK (Actinic keratosis)"
-    }
-}
-
-
-# --- 3. Define Prediction Function ---
+    return Model(new_engine, version, labels, knowledge_base, table), timings
+
+
+def check_model_variant(engine_name, variant):
+    """Quantized variants are TFLite models, so they can only be served by the tflite engine"""
+    if not variant:
+        return
+    if variant not in QUANTIZED_VARIANTS:
+        raise ModelLoadError(f"Unknown model variant '{variant}', expected one of {', '.join(QUANTIZED_VARIANTS)}")
+    if engine_name != "tflite":
+        raise ModelLoadError(f"Model variant '{variant}' is a TFLite model; set SKIN_API_ENGINE=tflite")
+
+
+def with_cascade(model):
+    """Put the configured first-stage model in front of model (SKIN_API_CASCADE_ENGINE); model itself otherwise"""
+    if not config.SKIN_API_CASCADE_ENGINE:
+        return model
+    import cascade
+
+    return cascade.CascadeModel(
+        cascade.first_stage(), model, config.SKIN_API_CASCADE_CONFIDENCE, config.SKIN_API_CASCADE_MARGIN
+    )
+
+
+def activate(model):
+    """Make model the active version; the switch is a single reference assignment"""
+    global current, engine, class_labels, MODEL_VERSION, EMBEDDING_DIM, KNOWLEDGE_BASE, response_table
+    engine = model.engine
+    class_labels = model.class_labels
+    MODEL_VERSION = model.version
+    EMBEDDING_DIM = model.embedding_dim
+    KNOWLEDGE_BASE = model.knowledge_base
+    response_table = model.response_table
+    current = model
+
+
+def load_model():
+    """
+    Load the configured model version once and make it the active one; returns a timing breakdown in seconds
+    With SKIN_API_MODEL_REGISTRY set, that is the registry's current version, and with SKIN_API_CASCADE_ENGINE
+    set it is served behind the first-stage model
+    """
+    with _load_lock:
+        if current is not None:
+            return {}
+        check_model_variant(ENGINE_NAME, config.SKIN_API_MODEL_VARIANT)
+        if config.SKIN_API_MODEL_REGISTRY:
+            from model_registry import ModelRegistry
+
+            model, timings = ModelRegistry(config.SKIN_API_MODEL_REGISTRY).load()
+        else:
+            model, timings = load_version(
+                MODEL_PATH, LABELS_PATH, KNOWLEDGE_BASE_PATH, version=config.SKIN_API_MODEL_VERSION or None
+            )
+        if config.SKIN_API_CASCADE_ENGINE:
+            start = time.perf_counter()
+            model = with_cascade(model)
+            timings["cascade"] = time.perf_counter() - start
+        activate(model)
+        return timings
 
-def predict_image(image_path):
-    """Predict skin condition from image and return JSON response"""
-    if not os.path.exists(image_path):
+
+def _active():
+    if current is None:
+        load_model()
+    return current
+
+
+def warm_up(batch_sizes):
+    """Warm up the active model (see Model.warm_up)"""
+    global EMBEDDING_DIM
+    seconds = _active().warm_up(batch_sizes)
+    EMBEDDING_DIM = current.embedding_dim
+    return seconds
+
+
+# --- 2. Knowledge Base and Response Table ---
+
+# Recommendations, severity and causes per class, kept in a data file so they can be updated without code changes.
+# An entry may set "condition" to report a different name (e.g. Unknown_Normal is reported as "Unknown").
+KNOWLEDGE_BASE = {}
+
+# Built at load time: one entry per model output index with the static parts of its response pre-serialized,
+# so a request only needs argmax, the confidence and a bytes join
+response_table = []
+
+
+def load_knowledge_base(path):
+    """Load the knowledge base data file"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        raise ModelLoadError(f"Error loading knowledge base {path}: {e}") from e
+
+
+def build_response_table(labels, knowledge_base, version, stage=None):
+    """
+    Validate labels against the knowledge base and precompile every class's response for a model version
+    stage, for a cascade, is recorded in every response as "cascadeStage"
+    """
+    missing = [name for name in labels.values() if name not in knowledge_base]
+    if missing:
+        raise ModelLoadError(f"Classes missing from the knowledge base: {', '.join(sorted(missing))}")
+    if sorted(int(index) for index in labels) != list(range(len(labels))):
+        raise ModelLoadError(f"Class indices must be 0..{len(labels) - 1}")
+
+    table = []
+    for index in range(len(labels)):
+        class_name = labels[str(index)]
+        data = knowledge_base[class_name]
+        condition = data.get("condition", class_name)
+        static = {
+            "recommendations": data["recommendations"],
+            "severity": data["severity"],
+            "possibleCauses": data["possibleCauses"],
+        }
+        # {"success":true,"modelVersion":...,["cascadeStage":...,]"analysis":{"condition":...,
+        #  "confidence":<inserted per request>,<static fields>}}
+        prefix = (
+            b'{"success":true,"modelVersion":' + fastjson.dumps(version)
+            + (b',"cascadeStage":' + fastjson.dumps(stage) if stage is not None else b'')
+            + b',"analysis":{"condition":' + fastjson.dumps(condition) + b',"confidence":'
+        )
+        suffix = b',' + fastjson.dumps(static)[1:] + b'}'
+        table.append({"condition": condition, "static": static, "prefix": prefix, "suffix": suffix})
+    return table
+
+
+# --- 3. Define Prediction Functions ---
+
+def predict_batch(img_batch):
+    """Run the active model on a stacked (N, 224, 224, 3) batch and return class probabilities"""
+    return _active().predict_batch(img_batch)
+
+
+def predict_batch_embeddings(img_batch):
+    """Like predict_batch, but also returns the penultimate-layer embeddings from the same forward pass (or None)"""
+    return _active().predict_batch_embeddings(img_batch)
+
+
+def predict_batch_stages(img_batch):
+    """Like predict_batch_embeddings, plus the cascade stage that answered each image (or None)"""
+    return _active().predict_batch_stages(img_batch)
+
+
+def top_class(probabilities):
+    """The active model's response table entry of the most likely class and its confidence in percent"""
+    return _active().top_class(probabilities)
+
+
+def build_response_bytes(probabilities, stage=None):
+    """Turn one row of class probabilities into the serialized JSON response"""
+    return _active().build_response_bytes(probabilities, stage)
+
+
+def build_response(probabilities, stage=None):
+    """Turn one row of class probabilities into the JSON response"""
+    return _active().build_response(probabilities, stage)
+
+
+def _predict_preprocessed(img_ready):
+    """Score a single preprocessed image and build its response"""
+    try:
+        prediction, _, stages = predict_batch_stages(np.expand_dims(img_ready, axis=0))
+        return build_response(prediction[0], stages[0] if stages is not None else None)
+    except Exception as e:
+        # Handle errors
         return {
             "success": False,
-            "error": f"Test image not found at {image_path}"
+            "error": f"An error occurred during prediction: {str(e)}"
         }
 
+
+def predict_array(img_array):
+    """Predict skin condition from an RGB array and return JSON response"""
     try:
-        # Load and preprocess the image
-        img = image.load_img(image_path, target_size=(224, 224))
-        img_array = image.img_to_array(img)
-        img_array_expanded = np.expand_dims(img_array, axis=0)
-        img_ready = preprocess_input(img_array_expanded)
-        
-        # Make prediction
-        prediction = model.predict(img_ready, verbose=0)
-        
-        # Process output
-        class_index = np.argmax(prediction[0])
-        class_name = class_labels.get(str(class_index), "Unknown") 
-        confidence = float(prediction[0][class_index] * 100)
-
-        # Build the JSON output
-        if class_name in KNOWLEDGE_BASE:
-            # It's a known skin condition
-            data = KNOWLEDGE_BASE[class_name]
-            return {
-                "success": True,
-                "analysis": {
-                    "condition": class_name,
-                    "confidence": round(confidence, 2),
-                    "recommendations": data["recommendations"],
-                    "severity": data["severity"],
-                    "possibleCauses": data["possibleCauses"]
-                }
-            }
-        
-        elif class_name == "Unknown_Normal" or class_name == "Unknown":
-            # It's the "Unknown" class
-            return {
-                "success": True,
-                "analysis": {
-                    "condition": "Unknown",
-                    "confidence": round(confidence, 2),
-                    "recommendations": [
-                        "This image does not appear to be one of the known skin conditions.",
-                        "Please try again with a clear photo of the affected area."
-                    ],
-                    "severity": "None",
-                    "possibleCauses": ["Image is not a skin condition", "Blurry or unclear photo"]
-                }
-            }
-        
-        else:
-            # It's a class we forgot to add to the KNOWLEDGE_BASE
-            return {
-                "success": False,
-                "error": f"Data for class '{class_name}' not found in KNOWLEDGE_BASE. Please update the script."
-            }
+        img_ready = preprocess_array(img_array)
+    except Exception as e:
+        return {
+            "success": False,
+            "error": f"An error occurred during prediction: {str(e)}"
+        }
+    return _predict_preprocessed(img_ready)
+
 
+def predict_bytes(buffer):
+    """Predict skin condition from encoded image bytes and return JSON response"""
+    try:
+        img_ready = preprocess_bytes(buffer)
     except Exception as e:
-        # Handle errors
         return {
             "success": False,
             "error": f"An error occurred during prediction: {str(e)}"
         }
+    return _predict_preprocessed(img_ready)
+
+
+def predict_image(image_path):
+    """Predict skin condition from image and return JSON response"""
+    if not os.path.exists(image_path):
+        return {
+            "success": False,
+            "error": f"Test image not found at {image_path}"
+        }
+
+    with open(image_path, "rb") as f:
+        return predict_bytes(f.read())
 
 
 # If this script is run directly, process the image file passed as argument
 if __name__ == "__main__":
     if len(sys.argv) != 2:
         print("Usage: python predict_model.py <image_path>")
+        print("To score many images at once, use bulk_score.py")
         sys.exit(1)
     
     image_path = sys.argv[1]
+    try:
+        load_model()
+    except ModelLoadError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
     result = predict_image(image_path)
     print(json.dumps(result, indent=2))
\ No newline at end of file
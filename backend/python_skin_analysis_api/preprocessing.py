@@ -0,0 +1,163 @@
+"""
+Image decoding and ResNet-50 preprocessing for the skin analysis model
+Only depends on NumPy and Pillow so it can run in worker processes without importing TensorFlow
+
+JPEGs are decoded at reduced resolution (DCT scaling via Image.draft), so a 48 MP phone photo is never
+materialised at full size. The resize result is turned into the model input in a single fused
+NumPy operation (uint8 -> float32, RGB -> BGR, ImageNet mean subtraction) that can write straight
+into a preallocated batch buffer.
+
+Run `python preprocessing.py IMAGE...` to compare this pipeline against the original
+keras load_img + preprocess_input path.
+"""
+
+import io
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+IMAGE_SIZE = (224, 224)
+INPUT_SHAPE = IMAGE_SIZE + (3,)
+
+# ImageNet channel means in BGR order, as subtracted by keras.applications.resnet.preprocess_input
+IMAGENET_MEAN_BGR = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+# EXIF orientation tag value -> transpose that makes the image upright
+_EXIF_ORIENTATION = 0x0112
+_EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def resnet_preprocess(img_array, out=None):
+    """
+    Same as keras.applications.resnet.preprocess_input: RGB -> BGR, then subtract the ImageNet means
+    Accepts uint8 or float input; the cast, channel flip and subtraction happen in one pass
+    """
+    if out is None:
+        out = np.empty(np.shape(img_array), dtype=np.float32)
+    np.subtract(img_array[..., ::-1], IMAGENET_MEAN_BGR, out=out, dtype=np.float32)
+    return out
+
+
+def decode_image(buffer, size=IMAGE_SIZE):
+    """Decode encoded image bytes into an upright RGB PIL image of the given size"""
+    return decode_image_sized(buffer, size)[0]
+
+
+def decode_image_sized(buffer, size=IMAGE_SIZE):
+    """decode_image that also returns the (width, height) the image was encoded at"""
+    img = Image.open(io.BytesIO(buffer))
+    original_size = img.size
+    orientation = img.getexif().get(_EXIF_ORIENTATION, 1)
+
+    # Let libjpeg decode at 1/2, 1/4 or 1/8 scale as long as the result stays at least `size`
+    if img.format == "JPEG":
+        img.draft("RGB", size)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    # Same resize as keras.preprocessing.image.load_img(target_size=...)
+    if img.size != size:
+        img = img.resize(size, Image.NEAREST)
+
+    # The target is square, so rotating after the resize gives the same image for far less work
+    transpose = _EXIF_TRANSPOSE.get(orientation)
+    if transpose is not None:
+        img = img.transpose(transpose)
+    return img, original_size
+
+
+def load_image_bytes(buffer):
+    """Decode encoded image bytes in memory into a (224, 224, 3) RGB array"""
+    return np.asarray(decode_image(buffer), dtype=np.float32)
+
+
+def preprocess_array(img_array, out=None):
+    """Return a preprocessed (224, 224, 3) float32 array from an RGB array of any size"""
+    img_array = np.asarray(img_array)
+    if img_array.shape[:2] != IMAGE_SIZE:
+        img = Image.fromarray(img_array.astype(np.uint8))
+        img_array = np.asarray(img.resize(IMAGE_SIZE, Image.NEAREST))
+    return resnet_preprocess(img_array, out=out)
+
+
+def preprocess_bytes(buffer, out=None):
+    """Decode and preprocess encoded image bytes without touching the filesystem"""
+    return resnet_preprocess(np.asarray(decode_image(buffer)), out=out)
+
+
+def preprocess_bytes_timed(buffer, out=None):
+    """preprocess_bytes that also returns how long decode and preprocess took (seconds)"""
+    start = time.perf_counter()
+    pixels = np.asarray(decode_image(buffer))
+    decoded = time.perf_counter()
+    img_ready = resnet_preprocess(pixels, out=out)
+    return img_ready, {"decode": decoded - start, "preprocess": time.perf_counter() - decoded}
+
+
+def preprocess_pixels_timed(pixels, out=None):
+    """Preprocess an already-sized (224, 224, 3) uint8 array; returns it with the preprocess time (seconds)"""
+    start = time.perf_counter()
+    img_ready = resnet_preprocess(pixels, out=out)
+    return img_ready, {"preprocess": time.perf_counter() - start}
+
+
+def preprocess_batch(buffers, out=None):
+    """Decode and preprocess many images into one (N, 224, 224, 3) float32 batch, reusing out if given"""
+    if out is None or out.shape[0] < len(buffers):
+        out = np.empty((len(buffers),) + INPUT_SHAPE, dtype=np.float32)
+    for index, buffer in enumerate(buffers):
+        preprocess_bytes(buffer, out=out[index])
+    return out[:len(buffers)]
+
+
+def preprocess_image(image_path):
+    """Load an image from disk and return a preprocessed (224, 224, 3) float32 array"""
+    with open(image_path, "rb") as f:
+        return preprocess_bytes(f.read())
+
+
+def legacy_preprocess_bytes(buffer):
+    """The original path: full-resolution decode, nearest resize, keras preprocess_input"""
+    img = Image.open(io.BytesIO(buffer))
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    img = img.resize(IMAGE_SIZE, Image.NEAREST)
+    img_array = np.asarray(img, dtype=np.float32).copy()
+    try:
+        from tensorflow.keras.applications.resnet import preprocess_input
+    except ImportError:
+        return resnet_preprocess(img_array)
+    return preprocess_input(img_array)
+
+
+def compare_with_legacy(paths, tolerance):
+    """Print how far the fast pipeline is from the original one; returns True if all images are within tolerance"""
+    all_ok = True
+    for path in paths:
+        with open(path, "rb") as f:
+            buffer = f.read()
+        fast = preprocess_bytes(buffer)
+        legacy = legacy_preprocess_bytes(buffer)
+        mean_diff = float(np.mean(np.abs(fast - legacy)))
+        max_diff = float(np.max(np.abs(fast - legacy)))
+        ok = mean_diff <= tolerance
+        all_ok = all_ok and ok
+        print(f"{'✅' if ok else '❌'} {path}: mean abs diff {mean_diff:.3f}, max abs diff {max_diff:.1f}")
+    return all_ok
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python preprocessing.py <image_path> [<image_path> ...]")
+        sys.exit(1)
+    # Mean absolute difference allowed, in pixel levels (0-255)
+    sys.exit(0 if compare_with_legacy(sys.argv[1:], tolerance=4.0) else 1)
@@ -0,0 +1,181 @@
+"""
+On-demand profiling of a running worker
+A ProfileSession samples the Python stacks of every thread at a fixed interval and, when TensorFlow is
+already loaded, records a TensorFlow op-level trace next to them. It covers the next N requests or
+T seconds, whichever comes first, then writes its artifacts and stops. Nothing runs while no session is
+active: the request path only checks whether one exists
+
+Artifacts, in one directory per session:
+    stacks.folded     collapsed stacks ("thread;file:function;... count"), for flamegraph.pl or speedscope
+    requests.jsonl    each profiled request's endpoint, status, latency and stage timings
+    summary.json      duration, request and sample counts, and the functions busy threads were most often in
+    tensorflow/       TensorFlow profiler trace (open with TensorBoard's profile plugin)
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Functions reported in summary.json
+TOP_FUNCTIONS = 25
+
+# Stack tops that mean a thread is parked (idle pool workers, queue waits, the event loop's select);
+# left out of topFunctions so it shows where busy threads spend their time
+IDLE_FUNCTIONS = frozenset({
+    "threading.py:wait",
+    "thread.py:_worker",
+    "selectors.py:select",
+    "base_events.py:_run_once",
+})
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class ProfileSession:
+    """One bounded profiling run; start() and stop() block, call them from a thread"""
+
+    def __init__(self, directory, max_requests, max_seconds, interval_seconds=0.005):
+        self.directory = directory
+        self.max_requests = max_requests
+        self.max_seconds = max_seconds
+        self.interval = interval_seconds
+        self.requests = 0
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+        self.stop_reason = None
+        self.tensorflow_trace = None  # True once a trace is recording, or the reason there is none
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = None
+        self._requests_file = None
+
+    @property
+    def active(self):
+        return self.started_at is not None and self.stopped_at is None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._requests_file = open(os.path.join(self.directory, "requests.jsonl"), "w")
+        self._start_tensorflow_trace()
+        self.started_at = time.time()
+        self._sampler = threading.Thread(target=self._sample, name="profile-sampler", daemon=True)
+        self._sampler.start()
+        logger.info(
+            f"Profiling the next {self.max_requests} requests or {self.max_seconds:g}s into {self.directory}"
+        )
+
+    def _start_tensorflow_trace(self):
+        # Only when an engine already imported TensorFlow: profiling must not pull it into an onnx/tflite worker
+        tf = sys.modules.get("tensorflow")
+        if tf is None:
+            self.tensorflow_trace = "TensorFlow is not loaded by this engine"
+            return
+        try:
+            tf.profiler.experimental.start(os.path.join(self.directory, "tensorflow"))
+            self.tensorflow_trace = True
+        except Exception as e:
+            self.tensorflow_trace = f"Could not start the TensorFlow profiler: {e}"
+            logger.warning(self.tensorflow_trace)
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks.append(";".join(reversed(stack)))
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    def record(self, endpoint, status, seconds, timings):
+        """
+        Log one finished request; returns True for the request that reaches max_requests,
+        so exactly one caller stops the session
+        """
+        with self._lock:
+            if not self.active or self.requests >= self.max_requests:
+                return False
+            self.requests += 1
+            self._requests_file.write(json.dumps({
+                "endpoint": endpoint,
+                "status": status,
+                "ms": round(seconds * 1000, 3),
+                "stagesMs": {stage: round(value * 1000, 3) for stage, value in timings.items()},
+            }) + "\n")
+            return self.requests == self.max_requests
+
+    def stop(self, reason):
+        """Stop sampling and tracing and write the artifacts; later calls return the same summary"""
+        with self._lock:
+            if not self.active:
+                return self.summary()
+            self.stopped_at = time.time()
+            self.stop_reason = reason
+        self._stopped.set()
+        self._sampler.join()
+        if self.tensorflow_trace is True:
+            try:
+                sys.modules["tensorflow"].profiler.experimental.stop()
+            except Exception as e:
+                self.tensorflow_trace = f"Could not write the TensorFlow trace: {e}"
+                logger.warning(self.tensorflow_trace)
+        self._requests_file.close()
+
+        with open(os.path.join(self.directory, "stacks.folded"), "w") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        summary = self.summary()
+        with open(os.path.join(self.directory, "summary.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        logger.info(
+            f"Profile written to {self.directory} ({self.requests} requests, {self.samples} samples, {reason})"
+        )
+        return summary
+
+    def summary(self):
+        """Status while running; once stopped, also the functions busy threads were most often in"""
+        end = self.stopped_at or time.time()
+        body = {
+            "directory": self.directory,
+            "active": self.active,
+            "requests": self.requests,
+            "maxRequests": self.max_requests,
+            "maxSeconds": self.max_seconds,
+            "seconds": round(end - self.started_at, 3) if self.started_at else 0.0,
+            "samples": self.samples,
+            "intervalMs": self.interval * 1000,
+            "tensorflowTrace": self.tensorflow_trace,
+            "stopReason": self.stop_reason,
+        }
+        if self.stopped_at is not None:
+            leaves = Counter()
+            with self._lock:
+                for stack, count in self._stacks.items():
+                    leaves[stack.rsplit(";", 1)[-1]] += count
+            idle = sum(leaves.pop(name, 0) for name in IDLE_FUNCTIONS)
+            busy = sum(leaves.values())
+            body["idleShare"] = round(idle / (busy + idle), 4) if busy + idle else None
+            body["topFunctions"] = [
+                {"function": name, "samples": count, "share": round(count / busy, 4)}
+                for name, count in leaves.most_common(TOP_FUNCTIONS)
+            ]
+        return body
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Image-quality gate, run on the decoded 224x224 image before the model is called
+Photos that are obviously unusable get a specific 422 answer instead of a ResNet-50 pass that would
+only end in the "Unknown" advice. Every check is a few vectorized NumPy operations on the image the
+model would have seen:
+
+    resolution     shorter side of the uploaded image, before resizing (SKIN_API_QUALITY_MIN_SIDE)
+    underexposed   share of pixels crushed to black (SKIN_API_QUALITY_MAX_CLIPPED)
+    overexposed    share of pixels blown out to white (SKIN_API_QUALITY_MAX_CLIPPED)
+    blur           variance of the Laplacian of the luminance (SKIN_API_QUALITY_MIN_SHARPNESS)
+
+Like decoding, it runs in the executor's workers, so it never blocks the event loop. To pick thresholds,
+print the measurements of some accepted and rejected photos:
+
+    python quality.py photo.jpg blurry.jpg dark.jpg
+"""
+
+import sys
+import time
+
+import numpy as np
+
+import config
+import fastjson
+from preprocessing import decode_image_sized, resnet_preprocess
+from uploads import UploadError
+
+# ITU-R BT.601 luma weights for RGB
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+# Luma at or below / at or above which a pixel counts as clipped
+DARK_LEVEL = 8
+BRIGHT_LEVEL = 247
+
+MESSAGES = {
+    "resolution": "Image is too small to analyse; upload a photo at least {threshold:g} pixels on its shorter side",
+    "underexposed": "Image is too dark to analyse; retake the photo in better light",
+    "overexposed": "Image is too bright to analyse; retake the photo without direct flash or sunlight",
+    "blur": "Image is too blurry to analyse; hold the camera steady and retake the photo in focus",
+}
+
+
+class QualityError(UploadError):
+    """The image failed a quality check; check names it, value is the measurement, threshold the limit"""
+    status_code = 422
+
+    def __init__(self, check, value, threshold):
+        # Passed on as args so the error survives the trip back from a process-pool worker
+        super().__init__(check, value, threshold)
+        self.check = check
+        self.value = value
+        self.threshold = threshold
+
+    def __str__(self):
+        return MESSAGES[self.check].format(threshold=self.threshold)
+
+    def to_json(self, **fields):
+        """The serialized rejection, with any extra fields (e.g. a batch item's index) in front"""
+        return fastjson.dumps({
+            **fields,
+            "success": False,
+            "error": str(self),
+            "quality": {"check": self.check, "value": round(float(self.value), 4), "threshold": self.threshold},
+        })
+
+
+def measure(pixels, original_size=None):
+    """Quality measurements of a (224, 224, 3) uint8 RGB image; original_size is its (width, height) as uploaded"""
+    luma = pixels @ LUMA_WEIGHTS
+    laplacian = luma[:-2, 1:-1] + luma[2:, 1:-1] + luma[1:-1, :-2] + luma[1:-1, 2:] - 4 * luma[1:-1, 1:-1]
+    measurements = {
+        "sharpness": float(laplacian.var()),
+        "underexposed": np.count_nonzero(luma <= DARK_LEVEL) / luma.size,
+        "overexposed": np.count_nonzero(luma >= BRIGHT_LEVEL) / luma.size,
+    }
+    if original_size is not None:
+        measurements["resolution"] = min(original_size)
+    return measurements
+
+
+def check_quality(pixels, original_size=None):
+    """
+    Raise QualityError for the first check the image fails, using the configured thresholds (0 disables a check)
+    Exposure is checked before blur: a clipped image is flat, and "too dark" is the more useful answer
+    """
+    measurements = measure(pixels, original_size)
+    if config.SKIN_API_QUALITY_MIN_SIDE and measurements.get("resolution", np.inf) < config.SKIN_API_QUALITY_MIN_SIDE:
+        raise QualityError("resolution", measurements["resolution"], config.SKIN_API_QUALITY_MIN_SIDE)
+    if config.SKIN_API_QUALITY_MAX_CLIPPED:
+        for check in ("underexposed", "overexposed"):
+            if measurements[check] > config.SKIN_API_QUALITY_MAX_CLIPPED:
+                raise QualityError(check, measurements[check], config.SKIN_API_QUALITY_MAX_CLIPPED)
+    if config.SKIN_API_QUALITY_MIN_SHARPNESS and measurements["sharpness"] < config.SKIN_API_QUALITY_MIN_SHARPNESS:
+        raise QualityError("blur", measurements["sharpness"], config.SKIN_API_QUALITY_MIN_SHARPNESS)
+    return measurements
+
+
+def preprocess_bytes_checked(buffer, out=None):
+    """preprocess_bytes_timed with the quality gate between decoding and preprocessing"""
+    start = time.perf_counter()
+    img, original_size = decode_image_sized(buffer)
+    pixels = np.asarray(img)
+    decoded = time.perf_counter()
+    check_quality(pixels, original_size)
+    checked = time.perf_counter()
+    img_ready = resnet_preprocess(pixels, out=out)
+    return img_ready, {
+        "decode": decoded - start, "quality": checked - decoded, "preprocess": time.perf_counter() - checked,
+    }
+
+
+def preprocess_pixels_checked(pixels, out=None):
+    """preprocess_pixels_timed with the quality gate; frames are model-sized, so resolution isn't checked"""
+    start = time.perf_counter()
+    check_quality(pixels)
+    checked = time.perf_counter()
+    img_ready = resnet_preprocess(pixels, out=out)
+    return img_ready, {"quality": checked - start, "preprocess": time.perf_counter() - checked}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python quality.py <image_path> [<image_path> ...]")
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        with open(path, "rb") as f:
+            img, original_size = decode_image_sized(f.read())
+        pixels = np.asarray(img)
+        values = measure(pixels, original_size)
+        try:
+            check_quality(pixels, original_size)
+            verdict = "✅ passes"
+        except QualityError as e:
+            verdict = f"❌ {e.check}"
+        print(f"{verdict:<16} {path}: shorter side {values['resolution']} px, sharpness {values['sharpness']:.1f}, "
+              f"dark {values['underexposed']:.1%}, bright {values['overexposed']:.1%}")
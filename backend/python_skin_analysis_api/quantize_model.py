@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Post-training quantization of resnet50_finetune.keras into TFLite variants
+    dynamic   int8 weights, float activations (no calibration needed)
+    int8      int8 weights and activations, calibrated on real images (int8 input, float output)
+    fp16      float16 weights
+
+Each variant is scored on the evaluation images against the float Keras model: top-1 agreement overall and
+per class in class_indices.json, plus latency and peak RSS measured in a fresh process. A variant whose
+accuracy drop exceeds --max-accuracy-drop is refused and not written. When the images are sorted into
+folders named after the classes, the drop is measured against those labels; otherwise it is the share
+of images where the variant's top-1 differs from the float model's.
+
+Usage: python quantize_model.py --calibration-dir calib/ [--eval-dir holdout/] [--variants dynamic int8 fp16]
+Serve an accepted variant with SKIN_API_ENGINE=tflite SKIN_API_MODEL_VARIANT=int8
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from bulk_score import collect_inputs
+from engines import QUANTIZED_VARIANTS, artifact_path, create_engine
+from preprocessing import preprocess_bytes
+
+LABELS_PATH = "class_indices.json"
+
+
+# --- Conversion ---
+
+def convert(model, variant, calibration):
+    """Convert the Keras model to a TFLite flatbuffer for one variant"""
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if variant == "fp16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif variant == "int8":
+        def representative_dataset():
+            for image in calibration:
+                yield [image[np.newaxis]]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        # Integer input (the engine quantizes preprocessed pixels); float output keeps confidences exact
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.float32
+    return converter.convert()
+
+
+# --- Evaluation ---
+
+def load_images(paths):
+    """Preprocess every image; returns the (N, 224, 224, 3) batch and the paths that decoded"""
+    images, kept = [], []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                images.append(preprocess_bytes(f.read()))
+            kept.append(path)
+        except Exception as e:
+            print(f"⚠️  Skipping {path}: {e}")
+    return np.stack(images), kept
+
+
+def folder_labels(paths, labels):
+    """Class index of each image from its parent folder name, or None unless every image has one"""
+    index_of = {name: int(index) for index, name in labels.items()}
+    classes = [index_of.get(os.path.basename(os.path.dirname(path))) for path in paths]
+    return None if None in classes else np.array(classes)
+
+
+def predict(engine, images, batch_size=16):
+    return np.concatenate([engine.infer(images[start:start + batch_size])
+                           for start in range(0, len(images), batch_size)])
+
+
+def agreement_report(reference, predicted, truth, labels):
+    """Overall and per-class top-1 agreement with the float model, and the accuracy drop"""
+    reference_top1 = reference.argmax(axis=1)
+    predicted_top1 = predicted.argmax(axis=1)
+    agrees = reference_top1 == predicted_top1
+    # Per class of the true label when known, otherwise of the float model's prediction
+    groups = truth if truth is not None else reference_top1
+    per_class = {}
+    for index in range(len(labels)):
+        members = groups == index
+        per_class[labels[str(index)]] = {
+            "images": int(members.sum()),
+            "agreement": round(float(agrees[members].mean()), 4) if members.any() else None,
+        }
+    report = {"agreement": round(float(agrees.mean()), 4), "perClass": per_class}
+    if truth is not None:
+        report["floatAccuracy"] = round(float((reference_top1 == truth).mean()), 4)
+        report["accuracy"] = round(float((predicted_top1 == truth).mean()), 4)
+        report["accuracyDrop"] = round(report["floatAccuracy"] - report["accuracy"], 4)
+    else:
+        report["accuracyDrop"] = round(1.0 - report["agreement"], 4)
+    return report
+
+
+def measure(engine_name, path, repeats, batch_sizes):
+    """Latency and peak RSS of one artifact, measured in a fresh process so variants don't share memory"""
+    # The subprocess runs in the service directory, but --model and --output-dir are relative to ours
+    command = [sys.executable, os.path.abspath(__file__), "--measure", engine_name, os.path.abspath(path),
+               "--repeats", str(repeats), "--batch-sizes", *map(str, batch_sizes)]
+    result = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "measurement failed")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure_in_process(engine_name, path, repeats, batch_sizes):
+    """Body of the --measure subprocess: load, warm up, time each batch size, report peak RSS"""
+    from export_model import sample_batch
+
+    engine = create_engine(engine_name, path).load()
+    latency = {}
+    for batch_size in batch_sizes:
+        batch = sample_batch(batch_size)
+        for _ in range(2):
+            engine.infer(batch)
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            engine.infer(batch)
+            samples.append((time.perf_counter() - start) * 1000)
+        latency[f"batch_{batch_size}"] = {
+            "p50Ms": round(float(np.percentile(samples, 50)), 3),
+            "p95Ms": round(float(np.percentile(samples, 95)), 3),
+        }
+    # ru_maxrss is in KiB on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"latency": latency, "peakRssMb": round(peak_rss_mb, 1), "sizeMb": round(_size(path) / 1e6, 2)}
+
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path)
+
+
+# --- Command line ---
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize the skin analysis model and report accuracy and latency")
+    parser.add_argument("--model", default=artifact_path("keras"), help="Source .keras model")
+    parser.add_argument("--calibration-dir", help="Images used to calibrate the int8 variant")
+    parser.add_argument("--eval-dir", help="Images the variants are scored on (default: the calibration images)")
+    parser.add_argument("--variants", nargs="+", choices=QUANTIZED_VARIANTS, default=list(QUANTIZED_VARIANTS))
+    parser.add_argument("--calibration-samples", type=int, default=200, help="Calibration images used for int8")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.01,
+                        help="Refuse variants that lose more than this much top-1 accuracy (0.01 = 1 point)")
+    parser.add_argument("--output-dir", default=".", help="Directory for the accepted variants")
+    parser.add_argument("--report", default="quantization_report.json", help="JSON report path")
+    parser.add_argument("--repeats", type=int, default=50, help="Timed calls per batch size")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--measure", nargs=2, metavar=("ENGINE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure_in_process(*args.measure, args.repeats, args.batch_sizes)))
+        return 0
+
+    if not args.calibration_dir:
+        parser.error("--calibration-dir is required")
+    if not os.path.exists(args.model):
+        print(f"❌ Model file not found: {args.model}")
+        return 1
+    with open(LABELS_PATH, "r") as f:
+        labels = json.load(f)["inv_class_indices"]
+
+    calibration_paths = collect_inputs([args.calibration_dir])
+    eval_paths = collect_inputs([args.eval_dir]) if args.eval_dir else calibration_paths
+    if not calibration_paths or not eval_paths:
+        print("❌ No images found")
+        return 1
+    if not args.eval_dir:
+        print("⚠️  Scoring on the calibration images; pass --eval-dir with held-out images for an unbiased report")
+    # Spread the calibration sample over the whole directory (and so over every class folder)
+    step = max(1, len(calibration_paths) // args.calibration_samples)
+    calibration, _ = load_images(calibration_paths[::step][:args.calibration_samples])
+    images, eval_paths = load_images(eval_paths)
+    truth = folder_labels(eval_paths, labels)
+    print(f"Calibrating on {len(calibration)} images, scoring on {len(images)} "
+          f"({'labelled by folder' if truth is not None else 'compared with the float model'})")
+
+    keras_engine = create_engine("keras", args.model).load()
+    reference = predict(keras_engine, images)
+    report = {
+        "model": args.model,
+        "evalImages": len(images),
+        "labelled": truth is not None,
+        "maxAccuracyDrop": args.max_accuracy_drop,
+        "variants": {"float32": measure("keras", args.model, args.repeats, args.batch_sizes)},
+    }
+    if truth is not None:
+        report["floatAccuracy"] = round(float((reference.argmax(axis=1) == truth).mean()), 4)
+
+    all_ok = True
+    for variant in args.variants:
+        output_path = os.path.join(args.output_dir, os.path.basename(artifact_path("tflite", variant)))
+        staging_path = output_path + ".tmp"
+        print(f"Quantizing {variant} -> {output_path}")
+        try:
+            with open(staging_path, "wb") as f:
+                f.write(convert(keras_engine.model, variant, calibration))
+            variant_engine = create_engine("tflite", staging_path).load()
+            result = agreement_report(reference, predict(variant_engine, images), truth, labels)
+            del variant_engine
+            result.update(measure("tflite", staging_path, args.repeats, args.batch_sizes))
+        except Exception as e:
+            reason = f"missing dependency ({e})" if isinstance(e, ImportError) else f"quantization failed ({e})"
+            print(f"❌ {variant}: {reason}")
+            report["variants"][variant] = {"accepted": False, "error": reason}
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+            all_ok = False
+            continue
+
+        result["accepted"] = result["accuracyDrop"] <= args.max_accuracy_drop
+        report["variants"][variant] = result
+        latency = result["latency"][f"batch_{args.batch_sizes[0]}"]["p50Ms"]
+        summary = (f"agreement {result['agreement']:.2%}, accuracy drop {result['accuracyDrop']:.2%}, "
+                   f"p50 {latency} ms at batch {args.batch_sizes[0]}, peak RSS {result['peakRssMb']} MB")
+        if result["accepted"]:
+            os.replace(staging_path, output_path)
+            print(f"✅ {variant}: {summary}")
+        else:
+            os.remove(staging_path)
+            all_ok = False
+            print(f"❌ {variant}: refused, {summary} (limit {args.max_accuracy_drop:.2%})")
+            worst = sorted((item["agreement"], name) for name, item in result["perClass"].items()
+                           if item["agreement"] is not None)[:3]
+            print("   least agreement: " + ", ".join(f"{name} {agreement:.2%}" for agreement, name in worst))
+
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Report written to {args.report}")
+    return 0 if all_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
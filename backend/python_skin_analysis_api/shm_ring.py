@@ -0,0 +1,60 @@
+"""
+Shared-memory ring of model inputs for the "shm" executor
+Decode worker processes write each preprocessed float32 (224, 224, 3) image straight into a slot of one
+shared memory block, and only the slot number and stage timings travel back through the pool's pipe:
+the pixels are never pickled. The serving process owns the slots: it hands a free one to each decode,
+reads the result in place, and takes the slot back once the micro-batcher has copied it into a batch
+"""
+
+import numpy as np
+from multiprocessing import shared_memory
+
+from preprocessing import INPUT_SHAPE
+
+SLOT_DTYPE = np.float32
+SLOT_BYTES = int(np.prod(INPUT_SHAPE)) * np.dtype(SLOT_DTYPE).itemsize
+
+# The ring this worker process writes into, attached by attach_worker()
+_worker_ring = None
+
+
+class SharedRing:
+    """slots model-input arrays in one shared memory block; created by the serving process, attached by workers"""
+
+    def __init__(self, slots, name=None):
+        self.slots = slots
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=slots * SLOT_BYTES)
+        else:
+            # Spawned workers share the serving process's resource tracker, so attaching registers the
+            # block a second time harmlessly, and only the creator's unlink() removes it
+            self._shm = shared_memory.SharedMemory(name=name)
+        self.name = self._shm.name
+        self.array = np.ndarray((slots,) + INPUT_SHAPE, dtype=SLOT_DTYPE, buffer=self._shm.buf)
+
+    def slot(self, index):
+        """Writable (224, 224, 3) view of one slot"""
+        return self.array[index]
+
+    def close(self, unlink=False):
+        # Views keep the buffer exported; drop ours before closing the mapping
+        self.array = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # A slot view is still referenced somewhere; the mapping goes away with the process
+            pass
+        if unlink:
+            self._shm.unlink()
+
+
+def attach_worker(name, slots):
+    """Pool initializer: map the serving process's ring into this worker"""
+    global _worker_ring
+    _worker_ring = SharedRing(slots, name=name)
+
+
+def decode_into_slot(prepare, slot, payload):
+    """Runs in a worker: prepare(payload, out=<slot>) writes the model input in place; returns its stage timings"""
+    _, timings = prepare(payload, out=_worker_ring.slot(slot))
+    return timings
@@ -2,11 +2,19 @@
 """
 Startup script for the Skin Vision Analysis API
 This script ensures all dependencies are installed and starts the API server
+
+Development (default): installs missing packages and runs a single auto-reloading server
+Production: python start_api.py --production --workers 4 --threads-per-worker 2 --pin-cpus
 """
 
+import argparse
+import mmap
+import signal
+import socket
 import subprocess
 import sys
 import os
+import time
 
 def check_and_install_dependencies():
     """Check if required packages are installed, install if missing"""
@@ -42,7 +50,189 @@ def check_model_files():
     print("✅ All model files found")
     return True
 
+def preload_weights(model_path):
+    """
+    Map the model artifact once in the master so its pages are in the page cache before workers start
+    Engines that memory-map their weights (tflite, onnx with external data) then share these pages
+    instead of each worker holding its own copy
+    """
+    if os.path.isdir(model_path):
+        return []
+    paths = [model_path]
+    # ONNX models exported with external data keep their weights next to the graph
+    if os.path.exists(model_path + ".data"):
+        paths.append(model_path + ".data")
+
+    mappings = []
+    for path in paths:
+        with open(path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mapping, "madvise"):
+            mapping.madvise(mmap.MADV_WILLNEED)
+        mappings.append(mapping)
+    return mappings
+
+def available_cpus():
+    """CPUs this process may run on; all of them where the OS has no affinity API (macOS)"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def pin_worker(index, threads_per_worker):
+    """Pin worker index to its own block of CPUs; None where the OS can't pin processes"""
+    if not hasattr(os, "sched_setaffinity"):
+        return None
+    cpus = available_cpus()
+    start = (index * threads_per_worker) % len(cpus)
+    block = {cpus[(start + offset) % len(cpus)] for offset in range(threads_per_worker)}
+    os.sched_setaffinity(0, block)
+    return sorted(block)
+
+def run_worker(index, sock, args):
+    """Body of a forked worker process: configure threads, then serve on the shared socket"""
+    import uvicorn
+
+    # Let uvicorn install its own graceful-shutdown handlers
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    # main/config are imported after this point, so the worker's thread budget comes from the environment
+    os.environ["SKIN_API_TF_INTRA_OP_THREADS"] = str(args.threads_per_worker)
+    os.environ["SKIN_API_TF_INTER_OP_THREADS"] = "1"
+    os.environ.setdefault("SKIN_API_EXECUTOR_WORKERS", str(max(1, args.threads_per_worker // 2)))
+
+    if args.pin_cpus:
+        cpus = pin_worker(index, args.threads_per_worker)
+        if cpus is None:
+            print(f"⚠️  Worker {index} (pid {os.getpid()}) not pinned: this OS has no CPU affinity API")
+        else:
+            print(f"Worker {index} (pid {os.getpid()}) pinned to CPUs {cpus}")
+
+    config = uvicorn.Config(
+        "main:app",
+        timeout_graceful_shutdown=args.graceful_timeout,
+        log_level="info",
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+def run_production(args):
+    """Pre-fork server: bind once, share model pages, fork N workers and supervise them"""
+    if not hasattr(os, "fork"):
+        print("❌ --production needs os.fork(); on Windows run `uvicorn main:app --workers N` instead")
+        return 1
+    if args.workers is None:
+        args.workers = max(1, len(available_cpus()) // args.threads_per_worker)
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.getcwd())
+    import config
+    from engines import artifact_path
+
+    model_path = config.SKIN_API_ENGINE_PATH or artifact_path(config.SKIN_API_ENGINE, config.SKIN_API_MODEL_VARIANT)
+    if config.SKIN_API_MODEL_REGISTRY:
+        from model_registry import ModelRegistry
+
+        registry = ModelRegistry(config.SKIN_API_MODEL_REGISTRY)
+        version = registry.current_version()
+        if version is None:
+            print(f"❌ No model versions found in {config.SKIN_API_MODEL_REGISTRY}")
+            return 1
+        model_path = registry.paths(version)[0]
+    if not os.path.exists(model_path):
+        print(f"❌ Model file not found: {model_path}")
+        return 1
+    if config.SKIN_API_ENGINE == "tflite" and "SKIN_API_SHARE_WEIGHTS" not in os.environ:
+        # Workers are forked with config already imported, so set the module attribute as well as the environment
+        os.environ["SKIN_API_SHARE_WEIGHTS"] = "1"
+        config.SKIN_API_SHARE_WEIGHTS = True
+        print("✅ Sharing tflite weights between workers (SKIN_API_SHARE_WEIGHTS=0 gives each its faster XNNPACK copy)")
+    if config.SKIN_API_ENGINE in ("keras", "savedmodel"):
+        print(
+            f"⚠️  The {config.SKIN_API_ENGINE} engine copies weights into every worker; "
+            "export to tflite or onnx (python export_model.py) to share them between workers"
+        )
+
+    start = time.perf_counter()
+    mappings = preload_weights(model_path)
+    print(f"✅ Preloaded {sum(len(m) for m in mappings) / 1e6:.1f} MB of weights in {time.perf_counter() - start:.2f}s")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    workers = {}  # pid -> worker index
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(index, sock, args)
+            finally:
+                os._exit(0)
+        workers[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        print(f"\n🛑 Draining {len(workers)} workers (up to {args.graceful_timeout}s)...")
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"\n🚀 Starting {args.workers} workers on http://{args.host}:{args.port}")
+    for index in range(args.workers):
+        spawn(index)
+
+    deadline = None
+    while workers:
+        if stopping and deadline is None:
+            deadline = time.monotonic() + args.graceful_timeout + 5
+        if deadline is not None and time.monotonic() > deadline:
+            for pid in workers:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        try:
+            # Never a blocking wait: a signal arriving during one would be retried (PEP 475) without
+            # coming back to the kill deadline above, so shutdown would hang on a worker ignoring SIGTERM
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.1)
+            continue
+        index = workers.pop(pid)
+        if not stopping:
+            print(f"⚠️  Worker {index} (pid {pid}) exited with status {status}, restarting")
+            spawn(index)
+
+    sock.close()
+    print("🛑 Server stopped")
+    return 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Start the Skin Vision Analysis API")
+    parser.add_argument("--production", action="store_true", help="Pre-fork multi-worker mode without reload or pip installs")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--threads-per-worker", type=int, default=2, help="CPU threads given to each worker's model runtime")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPUs / threads per worker)")
+    parser.add_argument("--pin-cpus", action="store_true", help="Pin each worker to its own block of CPUs")
+    parser.add_argument("--graceful-timeout", type=int, default=30, help="Seconds to drain in-flight requests on shutdown")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    if args.production:
+        return run_production(args)
+
     print("Starting Skin Vision Analysis API setup...")
     
     # Check model files
@@ -0,0 +1,19 @@
+"""
+Shared setup for the API's tests: run against the stub engine, with every optional on-disk store off
+config is read once at import, so the environment is set before any service module is imported
+"""
+
+import os
+import sys
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ["SKIN_API_ENGINE"] = "stub"
+for name in ("SKIN_API_JOBS_DB", "SKIN_API_EMBEDDING_INDEX_DIR", "SKIN_API_CACHE_DB", "SKIN_API_MODEL_REGISTRY",
+             "SKIN_API_SHADOW_VERSION", "SKIN_API_CASCADE_ENGINE"):
+    os.environ[name] = ""
+
+# Spawned pool workers inherit sys.path, so they can import the service modules and the tests' helper modules
+sys.path.insert(0, SERVICE_DIR)
+# Labels, knowledge base and test image paths are relative to the service directory, as when it is started
+os.chdir(SERVICE_DIR)
@@ -0,0 +1,29 @@
+"""
+Decode functions for the executor tests; they live in a module so spawned pool workers can import them
+"""
+
+import os
+import time
+
+from preprocessing import preprocess_bytes_timed
+
+TEST_IMAGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_image.jpeg")
+
+# Payloads that make prepare() misbehave instead of decoding
+CRASH = b"crash"
+SLOW = b"slow"
+
+
+def read_test_image():
+    with open(TEST_IMAGE, "rb") as f:
+        return f.read()
+
+
+def prepare(payload, out=None):
+    """preprocess_bytes_timed, except that CRASH kills the worker process and SLOW takes half a second"""
+    if payload == CRASH:
+        os._exit(1)
+    if payload == SLOW:
+        time.sleep(0.5)
+        payload = read_test_image()
+    return preprocess_bytes_timed(payload, out=out)
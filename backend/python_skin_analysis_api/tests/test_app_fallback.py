@@ -0,0 +1,32 @@
+"""
+The API still starts, and reports the model as unavailable, when the prediction modules can't be imported
+"""
+
+import os
+import subprocess
+import sys
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter, so blocking PIL doesn't affect the other tests
+SCRIPT = """
+import sys
+sys.modules["PIL"] = None
+from fastapi.testclient import TestClient
+import main
+assert not main.MODEL_AVAILABLE
+with TestClient(main.app) as client:
+    assert client.get("/healthz").status_code == 200
+    assert client.get("/readyz").status_code == 503
+    response = client.post("/predict-skin-lesion", files={"file": ("skin.jpeg", b"\\xff\\xd8\\xff" + bytes(64))})
+    assert response.status_code == 500
+    assert response.json()["detail"] == "ML Model not available"
+"""
+
+
+def test_app_starts_without_the_prediction_modules():
+    result = subprocess.run(
+        [sys.executable, "-c", SCRIPT], cwd=SERVICE_DIR, env={**os.environ, "SKIN_API_ENGINE": "stub"},
+        capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
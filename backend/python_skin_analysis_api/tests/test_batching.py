@@ -0,0 +1,144 @@
+import threading
+
+import numpy as np
+import pytest
+
+from batching import BatcherStoppedError, MicroBatcher
+
+SHAPE = (4, 4, 3)
+
+
+def image(value):
+    return np.full(SHAPE, value, dtype=np.float32)
+
+
+def row_means(batch):
+    """A stand-in model: one 'probability' per image, its mean pixel value"""
+    return batch.mean(axis=(1, 2, 3))[:, None]
+
+
+@pytest.fixture
+def batcher():
+    calls = []
+    batcher = MicroBatcher(row_means, max_batch_size=4, max_wait_ms=50, on_batch=lambda n, _: calls.append(n))
+    batcher.calls = calls
+    batcher.start()
+    yield batcher
+    batcher.stop(timeout=5)
+
+
+def test_concurrent_submits_share_one_model_call(batcher):
+    futures = [batcher.submit(image(i)) for i in range(4)]
+    assert [future.result(timeout=5)[0] for future in futures] == [0, 1, 2, 3]
+    assert batcher.calls == [4]
+    assert set(futures[0].timings) == {"queue", "inference"}
+
+
+def test_batches_are_capped_at_max_batch_size(batcher):
+    futures = [batcher.submit(image(i)) for i in range(6)]
+    assert [future.result(timeout=5)[0] for future in futures] == list(range(6))
+    assert batcher.calls == [4, 2]
+
+
+def test_tuple_outputs_are_split_per_image():
+    batcher = MicroBatcher(lambda batch: (row_means(batch), None), max_batch_size=2, max_wait_ms=20)
+    batcher.start()
+    try:
+        probabilities, embedding = batcher.submit(image(7)).result(timeout=5)
+    finally:
+        batcher.stop(timeout=5)
+    assert probabilities[0] == 7
+    assert embedding is None
+
+
+def test_model_errors_fail_every_image_of_the_batch():
+    def broken(batch):
+        raise RuntimeError("model exploded")
+
+    batcher = MicroBatcher(broken, max_batch_size=2, max_wait_ms=50)
+    batcher.start()
+    try:
+        futures = [batcher.submit(image(i)) for i in range(2)]
+        for future in futures:
+            with pytest.raises(RuntimeError, match="model exploded"):
+                future.result(timeout=5)
+    finally:
+        batcher.stop(timeout=5)
+
+
+def test_on_stacked_runs_before_the_model_call():
+    events = []
+    stacked = threading.Event()
+
+    def infer(batch):
+        events.append("infer")
+        return row_means(batch)
+
+    batcher = MicroBatcher(infer, max_batch_size=1, max_wait_ms=0)
+    batcher.start()
+    try:
+        future = batcher.submit(image(1), on_stacked=lambda: (events.append("stacked"), stacked.set()))
+        future.result(timeout=5)
+    finally:
+        batcher.stop(timeout=5)
+    assert stacked.is_set()
+    assert events == ["stacked", "infer"]
+
+
+def test_on_stacked_runs_for_cancelled_requests():
+    gate = threading.Event()
+    released = threading.Event()
+
+    def infer(batch):
+        gate.wait(5)
+        return row_means(batch)
+
+    batcher = MicroBatcher(infer, max_batch_size=1, max_wait_ms=0)
+    batcher.start()
+    try:
+        # Holds the batcher thread in the model call while the second request is cancelled in the queue
+        busy = batcher.submit(image(0))
+        cancelled = batcher.submit(image(1), on_stacked=released.set)
+        assert cancelled.cancel()
+        gate.set()
+        busy.result(timeout=5)
+        assert released.wait(5)
+    finally:
+        batcher.stop(timeout=5)
+
+
+def test_stop_finishes_queued_work_then_rejects_submits():
+    batcher = MicroBatcher(row_means, max_batch_size=2, max_wait_ms=50)
+    batcher.start()
+    futures = [batcher.submit(image(i)) for i in range(3)]
+    batcher.stop(timeout=5)
+    assert [future.result(timeout=0)[0] for future in futures] == [0, 1, 2]
+    with pytest.raises(BatcherStoppedError):
+        batcher.submit(image(3))
+
+
+def test_submit_before_start_is_scored_once_started():
+    batcher = MicroBatcher(row_means, max_batch_size=2, max_wait_ms=0)
+    future = batcher.submit(image(5))
+    batcher.start()
+    try:
+        assert future.result(timeout=5)[0] == 5
+    finally:
+        batcher.stop(timeout=5)
+
+
+def test_max_wait_bounds_how_long_a_lone_request_waits():
+    batcher = MicroBatcher(row_means, max_batch_size=8, max_wait_ms=20)
+    batcher.start()
+    try:
+        future = batcher.submit(image(1))
+        future.result(timeout=5)
+    finally:
+        batcher.stop(timeout=5)
+    # The batch never fills up, so the request leaves after max_wait (with scheduling slack)
+    assert future.timings["queue"] < 1.0
+
+
+def test_rejects_empty_batches():
+    with pytest.raises(ValueError):
+        MicroBatcher(row_means, max_batch_size=0)
@@ -0,0 +1,137 @@
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from bulk_score import ResultWriter, collect_inputs, inputs_digest, load_checkpoint, save_checkpoint
+from decode_helpers import TEST_IMAGE
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bulk_score.py")
+
+LABELS = ["a", "b"]
+
+
+def row(path):
+    return {"path": path, "condition": "a", "confidence": 90.0, "modelVersion": "v1", "error": None,
+            "probabilities": {"a": 0.9, "b": 0.1}}
+
+
+def test_collect_inputs_expands_and_deduplicates(tmp_path):
+    (tmp_path / "nested").mkdir()
+    for name in ("b.jpg", "a.png", "notes.txt", "nested/c.JPEG"):
+        (tmp_path / name).write_bytes(b"")
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_text("path,label\na.png,x\nnested/c.JPEG,y\n")
+
+    paths = collect_inputs([str(tmp_path), str(tmp_path / "*.jpg")], manifest=str(manifest))
+    assert paths == [str(tmp_path / "a.png"), str(tmp_path / "nested/c.JPEG"), str(tmp_path / "b.jpg")]
+    assert collect_inputs([str(tmp_path)]) == [str(tmp_path / name) for name in ("a.png", "b.jpg", "nested/c.JPEG")]
+
+
+def test_plain_manifest_skips_comments(tmp_path):
+    manifest = tmp_path / "files.txt"
+    manifest.write_text("# scan 1\none.jpg\n\ntwo.jpg\n")
+    assert collect_inputs([], manifest=str(manifest)) == [str(tmp_path / "one.jpg"), str(tmp_path / "two.jpg")]
+
+
+def test_inputs_digest_depends_on_the_order():
+    assert inputs_digest(["/a", "/b"]) == inputs_digest(["/a", "/b"])
+    assert inputs_digest(["/a", "/b"]) != inputs_digest(["/b", "/a"])
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / "out.jsonl.checkpoint.json")
+    assert load_checkpoint(path, "digest", "v1", restart=False) == (0, 0)
+    save_checkpoint(path, "digest", "v1", done=10, offset=1234)
+    assert load_checkpoint(path, "digest", "v1", restart=False) == (10, 1234)
+    assert load_checkpoint(path, "digest", "v1", restart=True) == (0, 0)
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_checkpoint_must_match_the_inputs_and_the_model(tmp_path):
+    path = str(tmp_path / "out.jsonl.checkpoint.json")
+    save_checkpoint(path, "digest", "v1", done=10, offset=1234)
+    with pytest.raises(SystemExit, match="different set of inputs"):
+        load_checkpoint(path, "other", "v1", restart=False)
+    with pytest.raises(SystemExit, match="model v1, not v2"):
+        load_checkpoint(path, "digest", "v2", restart=False)
+
+
+def test_jsonl_resume_drops_an_interrupted_chunk(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    writer = ResultWriter(path, "jsonl", LABELS)
+    writer.resume(0)
+    writer.write([row("/one"), row("/two")])
+    checkpointed = writer.offset()
+    writer.write([row("/three")])
+    # The process died here, after writing a chunk but before checkpointing it
+    resumed = ResultWriter(path, "jsonl", LABELS)
+    resumed.resume(checkpointed)
+    resumed.write([row("/three"), row("/four")])
+
+    with open(path) as f:
+        rows = [json.loads(line) for line in f]
+    assert [r["path"] for r in rows] == ["/one", "/two", "/three", "/four"]
+    assert "error" not in rows[0]
+    assert rows[0]["probabilities"] == {"a": 0.9, "b": 0.1}
+
+
+def test_csv_header_is_written_once(tmp_path):
+    path = str(tmp_path / "out.csv")
+    writer = ResultWriter(path, "csv", LABELS)
+    writer.resume(0)
+    writer.write([row("/one")])
+    resumed = ResultWriter(path, "csv", LABELS)
+    resumed.resume(writer.offset())
+    resumed.write([{**row("/two"), "condition": None, "error": "bad image", "probabilities": {}}])
+
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [r["path"] for r in rows] == ["/one", "/two"]
+    assert rows[0]["p_a"] == "0.9"
+    assert (rows[1]["error"], rows[1]["p_a"]) == ("bad image", "")
+
+
+def run_bulk_score(*args):
+    return subprocess.run(
+        [sys.executable, SCRIPT, *args, "--engine", "stub", "--workers", "1"],
+        env={**os.environ, "SKIN_API_ENGINE": "stub"}, capture_output=True, text=True, timeout=300,
+    )
+
+
+def test_an_interrupted_run_resumes_from_its_checkpoint(tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    for index in range(5):
+        shutil.copy(TEST_IMAGE, images / f"{index}.jpeg")
+    (images / "5.jpeg").write_bytes(b"not an image")
+    output = tmp_path / "scores.jsonl"
+    checkpoint = tmp_path / "scores.jsonl.checkpoint.json"
+
+    result = run_bulk_score(str(images), "--output", str(output), "--checkpoint-every", "2", "--batch-size", "2")
+    assert result.returncode == 0, result.stderr
+    complete = output.read_text()
+    rows = [json.loads(line) for line in complete.splitlines()]
+    assert [os.path.basename(r["path"]) for r in rows] == [f"{index}.jpeg" for index in range(6)]
+    assert all("condition" in r for r in rows[:5])
+    assert "error" in rows[5]
+
+    # Roll back to the checkpoint taken after the first chunk, with half of the next chunk on disk
+    state = json.loads(checkpoint.read_text())
+    first_chunk = "".join(complete.splitlines(keepends=True)[:2])
+    checkpoint.write_text(json.dumps({**state, "done": 2, "offset": len(first_chunk.encode())}))
+    output.write_text(first_chunk + complete.splitlines(keepends=True)[2][:20])
+
+    result = run_bulk_score(str(images), "--output", str(output), "--checkpoint-every", "2", "--batch-size", "2")
+    assert result.returncode == 0, result.stderr
+    assert "Resuming after 2 of 6 images" in result.stdout
+    resumed = [json.loads(line) for line in output.read_text().splitlines()]
+    # The decode error's text can differ between runs (it may include an object address)
+    assert [{**r, "error": None} for r in resumed] == [{**r, "error": None} for r in rows]
+
+    result = run_bulk_score(str(images), "--output", str(output))
+    assert "already scored" in result.stdout
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from cache import PredictionCache, cache_key
+
+
+def test_cache_key_depends_on_image_and_model_version():
+    assert cache_key(b"image", "v1") == cache_key(b"image", "v1")
+    assert cache_key(b"image", "v1") != cache_key(b"image", "v2")
+    assert cache_key(b"image", "v1") != cache_key(b"other", "v1")
+
+
+def test_identical_concurrent_requests_share_one_computation():
+    cache = PredictionCache(max_entries=8)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return b"result"
+
+    async def scenario():
+        return await asyncio.gather(*[cache.get_or_compute("key", compute) for _ in range(5)])
+
+    assert asyncio.run(scenario()) == [b"result"] * 5
+    assert len(calls) == 1
+    assert cache.stats["misses"] == 1
+    assert cache.stats["coalesced"] == 4
+    # Later requests are plain hits
+    assert asyncio.run(cache.get_or_compute("key", compute)) == b"result"
+    assert cache.stats["hits"] == 1
+
+
+def test_failures_reach_every_waiter_and_are_not_cached():
+    cache = PredictionCache(max_entries=8)
+
+    async def fail():
+        await asyncio.sleep(0.05)
+        raise ValueError("bad image")
+
+    async def succeed():
+        return b"result"
+
+    async def scenario():
+        return await asyncio.gather(*[cache.get_or_compute("key", fail) for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert asyncio.run(cache.get_or_compute("key", succeed)) == b"result"
+
+
+def test_cancelled_leader_does_not_cache_or_leave_the_key_in_flight():
+    cache = PredictionCache(max_entries=8)
+
+    async def slow():
+        await asyncio.sleep(10)
+        return b"never"
+
+    async def scenario():
+        leader = asyncio.create_task(cache.get_or_compute("key", slow))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await cache.get_or_compute("key", lambda: asyncio.sleep(0, result=b"fresh"))
+
+    assert asyncio.run(scenario()) == b"fresh"
+
+
+def test_lru_eviction_and_ttl():
+    cache = PredictionCache(max_entries=2, ttl_seconds=3600)
+    for key in ("a", "b", "c"):
+        cache.put(key, key.encode())
+    assert cache.get("a") is None
+    assert cache.get("c") == b"c"
+    assert cache.stats["evictions"] == 1
+
+    expired = PredictionCache(max_entries=2, ttl_seconds=-1)
+    expired.put("a", b"a")
+    assert expired.get("a") is None
+    assert expired.stats["expired"] == 1
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    first = PredictionCache(max_entries=2, db_path=db_path)
+    first.put("key", b"result")
+    first.close()
+
+    second = PredictionCache(max_entries=2, db_path=db_path)
+    try:
+        assert second.get("key") == b"result"
+        assert second.stats["disk_hits"] == 1
+    finally:
+        second.close()
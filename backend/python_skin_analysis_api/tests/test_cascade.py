@@ -0,0 +1,112 @@
+import json
+
+import numpy as np
+import pytest
+
+import predict_model
+from cascade import FIRST, SECOND, CascadeModel, escalate, evaluate
+from predict_model import ModelLoadError, load_version
+
+
+def stage(engine_name, version):
+    model, _ = load_version(predict_model.LABELS_PATH, predict_model.LABELS_PATH, predict_model.KNOWLEDGE_BASE_PATH,
+                            version=version, engine_name=engine_name)
+    return model
+
+
+@pytest.fixture(scope="module")
+def first():
+    return stage("stub-small", "small")
+
+
+@pytest.fixture(scope="module")
+def second():
+    return stage("stub", "v1")
+
+
+@pytest.fixture(scope="module")
+def batch():
+    rng = np.random.default_rng(0)
+    return rng.normal(0.0, 50.0, size=(6, 224, 224, 3)).astype(np.float32)
+
+
+def test_escalate_on_low_confidence():
+    probabilities = np.array([[0.95, 0.05, 0.0], [0.6, 0.3, 0.1], [0.1, 0.1, 0.8]])
+    assert escalate(probabilities, confidence=0.9).tolist() == [False, True, True]
+    assert escalate(probabilities, confidence=0.5).tolist() == [False, False, False]
+
+
+def test_escalate_on_a_small_margin():
+    probabilities = np.array([[0.5, 0.45, 0.05], [0.7, 0.2, 0.1]])
+    assert escalate(probabilities, confidence=0.0, margin=0.1).tolist() == [True, False]
+    # Either condition is enough
+    assert escalate(probabilities, confidence=0.6, margin=0.1).tolist() == [True, False]
+    assert escalate(probabilities, confidence=0.8, margin=0.1).tolist() == [True, True]
+
+
+def test_evaluate_against_labels():
+    first = np.array([[0.95, 0.05], [0.9, 0.1], [0.6, 0.4], [0.3, 0.7]])
+    second = np.array([[0.9, 0.1], [0.2, 0.8], [0.1, 0.9], [0.4, 0.6]])
+    truth = np.array([0, 1, 1, 0])
+    result = evaluate(first, second, truth, confidence=0.85, margin=0.0, first_seconds=0.01, second_seconds=0.04)
+    # The first stage answers the first two images and agrees with the second stage on one of them
+    assert result["firstStageShare"] == 0.5
+    assert result["escalatedShare"] == 0.5
+    assert result["firstStageAgreement"] == 0.5
+    assert result["cascadeAgreement"] == 0.75
+    assert result["relativeCompute"] == 0.75
+    assert result["computeSaving"] == 0.25
+    assert result["accuracy"] == 0.5
+    assert result["accuracyDrop"] == 0.25
+
+
+def test_evaluate_when_everything_is_escalated():
+    first = np.array([[0.6, 0.4], [0.5, 0.5]])
+    second = np.array([[0.9, 0.1], [0.2, 0.8]])
+    result = evaluate(first, second, None, confidence=0.99, margin=0.0, first_seconds=0.01, second_seconds=0.04)
+    assert result["firstStageAgreement"] is None
+    assert result["cascadeAgreement"] == 1.0
+    assert result["computeSaving"] == -0.25
+    assert "accuracy" not in result
+
+
+def test_cascade_uses_the_first_stage_when_it_is_sure(first, second, batch):
+    cascade = CascadeModel(first, second, confidence=0.0)
+    probabilities, embeddings, stages = cascade.predict_batch_stages(batch)
+    np.testing.assert_allclose(probabilities, first.predict_batch(batch), rtol=1e-6)
+    assert embeddings is None
+    assert stages == [FIRST] * len(batch)
+
+
+def test_cascade_escalates_what_the_first_stage_is_unsure_about(first, second, batch):
+    first_probabilities = np.asarray(first.predict_batch(batch))
+    # A threshold between the batch's lowest and highest first-stage confidence escalates some of it
+    confidence = float(np.median(first_probabilities.max(axis=1)))
+    cascade = CascadeModel(first, second, confidence=confidence)
+    probabilities, _, stages = cascade.predict_batch_stages(batch)
+
+    escalated = escalate(first_probabilities, confidence)
+    assert 0 < escalated.sum() < len(batch)
+    assert stages == [SECOND if row else FIRST for row in escalated]
+    np.testing.assert_allclose(probabilities[escalated], second.predict_batch(batch[escalated]), rtol=1e-6)
+    np.testing.assert_allclose(probabilities[~escalated], first_probabilities[~escalated], rtol=1e-6)
+
+
+def test_responses_record_the_stage_and_thresholds(first, second):
+    cascade = CascadeModel(first, second, confidence=0.9, margin=0.05)
+    assert cascade.version == "v1+small@0.9,0.05"
+    assert cascade.embedding_dim is None
+    probabilities = np.full(len(cascade.class_labels), 0.01, dtype=np.float32)
+    probabilities[2] = 0.9
+    for name in (FIRST, SECOND):
+        response = json.loads(cascade.build_response_bytes(probabilities, name))
+        assert response == cascade.build_response(probabilities, name)
+        assert response["cascadeStage"] == name
+        assert response["modelVersion"] == cascade.version
+
+
+def test_stages_must_share_class_labels(first, second):
+    relabelled = stage("stub-small", "small")
+    relabelled.class_labels = {**first.class_labels, "0": "Something else"}
+    with pytest.raises(ModelLoadError, match="different class labels"):
+        CascadeModel(relabelled, second, confidence=0.9)
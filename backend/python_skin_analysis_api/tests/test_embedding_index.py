@@ -0,0 +1,186 @@
+import os
+
+import numpy as np
+import pytest
+
+from embedding_index import EmbeddingIndex, _file_lock
+
+DIM = 16
+
+
+def vectors(count, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, DIM)).astype(np.float32)
+
+
+def filled(path, embeddings, **options):
+    """An index holding one case per embedding, keyed key<i>, with the writer flushed"""
+    index = EmbeddingIndex(str(path), dim=DIM, **options)
+    index.start()
+    for i, embedding in enumerate(embeddings):
+        index.add(f"key{i}", embedding, condition=f"condition{i % 3}", confidence=50.0 + i)
+    index.close()
+    return EmbeddingIndex(str(path), **options)
+
+
+def case_ids(results):
+    return [result["caseId"] for result in results]
+
+
+@pytest.mark.parametrize("dtype", ["int8", "float16"])
+def test_search_returns_the_closest_cases_first(tmp_path, dtype):
+    embeddings = vectors(50)
+    index = filled(tmp_path, embeddings, dtype=dtype)
+    try:
+        results = index.search(embeddings[7], k=3)
+        assert case_ids(results)[0] == 7
+        assert results[0]["score"] == pytest.approx(1.0, abs=0.01)
+        assert results[0]["condition"] == "condition1"
+        assert results[0]["confidence"] == 57.0
+        assert [r["score"] for r in results] == sorted((r["score"] for r in results), reverse=True)
+        # Scores are cosine similarities, so a scaled query finds the same case
+        assert case_ids(index.search(embeddings[7] * 10, k=1)) == [7]
+    finally:
+        index.close()
+
+
+def test_exclude_key_leaves_the_query_case_out(tmp_path):
+    embeddings = vectors(20)
+    index = filled(tmp_path, embeddings)
+    try:
+        results = index.search(embeddings[4], k=3, exclude_key="key4")
+        assert len(results) == 3
+        assert 4 not in case_ids(results)
+    finally:
+        index.close()
+
+
+def test_known_keys_are_not_added_twice(tmp_path):
+    index = EmbeddingIndex(str(tmp_path), dim=DIM)
+    index.start()
+    embedding = vectors(1)[0]
+    for _ in range(3):
+        index.add("same", embedding)
+    index.close()
+    index = EmbeddingIndex(str(tmp_path))
+    try:
+        assert index.count == 1
+    finally:
+        index.close()
+
+
+def test_empty_index_has_no_results(tmp_path):
+    index = EmbeddingIndex(str(tmp_path), dim=DIM)
+    try:
+        assert index.search(vectors(1)[0], k=5) == []
+    finally:
+        index.close()
+
+
+def test_index_persists_across_reopen(tmp_path):
+    embeddings = vectors(30)
+    index = filled(tmp_path, embeddings[:20], dtype="int8")
+    before = index.search(embeddings[3], k=5)
+    index.close()
+
+    # Reopened without dim or dtype: both come from the header
+    index = EmbeddingIndex(str(tmp_path))
+    index.start()
+    try:
+        assert (index.dim, index.dtype, index.count) == (DIM, "int8", 20)
+        assert index.search(embeddings[3], k=5) == before
+        for i in range(20, 30):
+            index.add(f"key{i}", embeddings[i])
+    finally:
+        index.close()
+
+    index = EmbeddingIndex(str(tmp_path))
+    try:
+        assert index.count == 30
+        assert case_ids(index.search(embeddings[25], k=1)) == [25]
+    finally:
+        index.close()
+
+
+def test_a_torn_row_is_dropped_before_the_next_append(tmp_path):
+    embeddings = vectors(6)
+    filled(tmp_path, embeddings[:5], dtype="float16").close()
+    # A writer that crashed halfway through a row
+    with open(os.path.join(tmp_path, "vectors.float16"), "ab") as f:
+        f.write(b"\x00" * 7)
+    index = EmbeddingIndex(str(tmp_path))
+    index.start()
+    index.add("key5", embeddings[5])
+    index.close()
+    index = EmbeddingIndex(str(tmp_path))
+    try:
+        assert index.count == 6
+        assert case_ids(index.search(embeddings[5], k=1)) == [5]
+    finally:
+        index.close()
+
+
+def test_opening_checks_the_header(tmp_path):
+    with pytest.raises(ValueError, match="No embedding index"):
+        EmbeddingIndex(str(tmp_path / "missing"))
+    with pytest.raises(ValueError, match="Unknown embedding dtype"):
+        EmbeddingIndex(str(tmp_path / "bad"), dim=DIM, dtype="float64")
+    EmbeddingIndex(str(tmp_path / "index"), dim=DIM).close()
+    with pytest.raises(ValueError, match="8-d"):
+        EmbeddingIndex(str(tmp_path / "index"), dim=8)
+
+
+def test_resident_rows_give_the_same_results(tmp_path):
+    embeddings = vectors(200)
+    filled(tmp_path, embeddings).close()
+    plain = EmbeddingIndex(str(tmp_path))
+    resident = EmbeddingIndex(str(tmp_path), resident_rows=64)
+    try:
+        for query in vectors(5, seed=1):
+            assert plain.search(query, k=10) == resident.search(query, k=10)
+    finally:
+        plain.close()
+        resident.close()
+
+
+@pytest.mark.parametrize("pq_subspaces", [0, 4])
+def test_ivf_finds_the_exhaustive_nearest_neighbours(tmp_path, pq_subspaces):
+    embeddings = vectors(600)
+    index = filled(tmp_path, embeddings[:500])
+    try:
+        exhaustive = [case_ids(index.search(query, k=1)) for query in embeddings[:20]]
+        index.build_ivf(nlist=8, pq_subspaces=pq_subspaces)
+        # Probing every list scans every row, so the partitioned search must agree
+        index.nprobe = 8
+        assert [case_ids(index.search(query, k=1)) for query in embeddings[:20]] == exhaustive
+        index.start()
+        for i in range(500, 600):
+            index.add(f"key{i}", embeddings[i])
+    finally:
+        index.close()
+
+    index = EmbeddingIndex(str(tmp_path), nprobe=8)
+    try:
+        # Rows added after the build are in the scanned tail
+        assert case_ids(index.search(embeddings[550], k=1)) == [550]
+        assert case_ids(index.search(embeddings[3], k=1)) == [3]
+    finally:
+        index.close()
+
+
+def test_build_ivf_needs_enough_vectors(tmp_path):
+    index = filled(tmp_path, vectors(5))
+    try:
+        with pytest.raises(ValueError, match="at least 8"):
+            index.build_ivf(nlist=8)
+    finally:
+        index.close()
+
+
+def test_file_lock_is_exclusive(tmp_path):
+    path = str(tmp_path / "test.lock")
+    with _file_lock(path) as held:
+        assert held
+        with _file_lock(path, blocking=False) as second:
+            assert not second
+    with _file_lock(path, blocking=False) as after:
+        assert after
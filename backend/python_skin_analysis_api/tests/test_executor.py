@@ -0,0 +1,164 @@
+import asyncio
+import os
+import signal
+
+import pytest
+from concurrent.futures.process import BrokenProcessPool
+
+import decode_helpers
+from decode_helpers import CRASH, SLOW, prepare
+from executor import InferenceExecutor, QueueFullError
+
+PROCESS_KINDS = ["process", "shm"]
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout=60))
+
+
+async def decode_ok(executor, payload):
+    """Decode one payload and release its slot; 'ok' or the exception's type name"""
+    try:
+        img_array, timings, release = await executor.decode(prepare, payload)
+    except Exception as e:
+        return type(e).__name__
+    assert img_array.shape == (224, 224, 3)
+    release()
+    # release() is idempotent
+    release()
+    return "ok"
+
+
+async def settle(executor, slots):
+    """Wait for background slot releases to land"""
+    for _ in range(100):
+        if executor.free_slots in (None, slots):
+            return
+        await asyncio.sleep(0.05)
+
+
+@pytest.fixture(scope="module")
+def image_bytes():
+    return decode_helpers.read_test_image()
+
+
+@pytest.mark.parametrize("kind", ["thread"] + PROCESS_KINDS)
+def test_decode_runs_in_the_pool(kind, image_bytes):
+    async def scenario():
+        executor = InferenceExecutor(kind=kind, max_workers=2)
+        try:
+            return await asyncio.gather(*[decode_ok(executor, image_bytes) for _ in range(4)])
+        finally:
+            executor.shutdown()
+
+    assert run(scenario()) == ["ok"] * 4
+
+
+@pytest.mark.parametrize("kind", PROCESS_KINDS)
+def test_recovers_after_an_idle_worker_is_killed(kind, image_bytes):
+    async def scenario():
+        executor = InferenceExecutor(kind=kind, max_workers=2, ring_slots=3)
+        try:
+            assert await decode_ok(executor, image_bytes) == "ok"
+            os.kill(next(iter(executor._pool._processes)), signal.SIGKILL)
+            await asyncio.sleep(0.5)
+            # Nothing of these requests ran when the pool broke, so they go to a fresh pool instead of failing
+            results = [await decode_ok(executor, image_bytes) for _ in range(3)]
+            await settle(executor, 3)
+            return results, executor.free_slots
+        finally:
+            executor.shutdown()
+
+    results, free_slots = run(scenario())
+    assert results == ["ok"] * 3
+    assert free_slots in (None, 3)
+
+
+@pytest.mark.parametrize("kind", PROCESS_KINDS)
+def test_a_crashing_decode_fails_and_the_pool_is_replaced(kind, image_bytes):
+    async def scenario():
+        executor = InferenceExecutor(kind=kind, max_workers=2, ring_slots=3)
+        try:
+            crashed = await decode_ok(executor, CRASH)
+            after = await asyncio.gather(*[decode_ok(executor, image_bytes) for _ in range(4)])
+            await settle(executor, 3)
+            return crashed, after, executor.free_slots
+        finally:
+            executor.shutdown()
+
+    crashed, after, free_slots = run(scenario())
+    assert crashed == BrokenProcessPool.__name__
+    assert after == ["ok"] * 4
+    assert free_slots in (None, 3)
+
+
+def test_crash_among_concurrent_decodes_frees_every_slot(image_bytes):
+    async def scenario():
+        executor = InferenceExecutor(kind="shm", max_workers=2, ring_slots=3)
+        try:
+            payloads = [image_bytes, image_bytes, CRASH, image_bytes, image_bytes, CRASH, image_bytes]
+            results = await asyncio.gather(*[decode_ok(executor, payload) for payload in payloads])
+            await settle(executor, 3)
+            return results, executor.free_slots
+        finally:
+            executor.shutdown()
+
+    results, free_slots = run(scenario())
+    assert set(results) <= {"ok", BrokenProcessPool.__name__}
+    assert free_slots == 3
+
+
+def test_cancelled_decode_keeps_its_slot_until_the_worker_is_done():
+    async def scenario():
+        executor = InferenceExecutor(kind="shm", max_workers=1, ring_slots=2)
+        try:
+            task = asyncio.create_task(decode_ok(executor, SLOW))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            await asyncio.sleep(0.05)
+            # The worker is still writing into the slot, so it is not handed out yet
+            during = executor.free_slots
+            await settle(executor, 2)
+            return during, executor.free_slots
+        finally:
+            executor.shutdown()
+
+    during, after = run(scenario())
+    assert during == 1
+    assert after == 2
+
+
+def test_ring_slots_bound_decodes_in_flight(image_bytes):
+    async def scenario():
+        executor = InferenceExecutor(kind="shm", max_workers=2, ring_slots=1)
+        try:
+            img_array, _, release = await executor.decode(prepare, image_bytes)
+            waiting = asyncio.create_task(executor.decode(prepare, image_bytes))
+            await asyncio.sleep(0.2)
+            blocked = not waiting.done()
+            release()
+            _, timings, release_second = await waiting
+            release_second()
+            return blocked, timings
+        finally:
+            executor.shutdown()
+
+    blocked, timings = run(scenario())
+    assert blocked
+    assert timings["slot"] > 0
+
+
+def test_admission_sheds_past_the_queue_depth():
+    async def scenario():
+        executor = InferenceExecutor(kind="thread", max_workers=1, max_queue_depth=1)
+        try:
+            async with executor.admit():
+                with pytest.raises(QueueFullError) as depth:
+                    executor.check_admission()
+            # The slot is given back once the request is done
+            executor.check_admission()
+            return depth.value
+        finally:
+            executor.shutdown()
+
+    assert run(scenario()).reason == "queue_depth"
@@ -0,0 +1,101 @@
+import json
+import time
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import predict_model
+from decode_helpers import read_test_image
+from frames import CONTENT_TYPE, HEADER, FrameError, encode_frame, parse_frame
+from preprocessing import INPUT_SHAPE, decode_image
+
+
+def pixels(count, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, size=(count,) + INPUT_SHAPE, dtype=np.uint8)
+
+
+def header(magic=b"SKNF", version=1, dtype=1, count=1, height=224, width=224, channels=3):
+    return HEADER.pack(magic, version, dtype, count, height, width, channels)
+
+
+def test_parse_frame_views_the_body_without_copying():
+    images = pixels(3)
+    body = encode_frame(images)
+    parsed = parse_frame(body, max_images=3)
+    np.testing.assert_array_equal(parsed, images)
+    assert parsed.base is not None
+    assert not parsed.flags.writeable
+
+
+def test_encode_frame_accepts_a_single_image():
+    image = pixels(1)[0]
+    body = encode_frame(image)
+    assert len(body) == HEADER.size + image.size
+    np.testing.assert_array_equal(parse_frame(body, max_images=1)[0], image)
+
+
+@pytest.mark.parametrize("body, message", [
+    (b"SKNF", "shorter than its 16-byte header"),
+    (header(magic=b"JPEG") + bytes(224 * 224 * 3), "must start with"),
+    (header(version=2) + bytes(224 * 224 * 3), "Unsupported frame version 2"),
+    (header(dtype=2) + bytes(224 * 224 * 3), "Unsupported frame dtype 2"),
+    (header(height=100, width=100) + bytes(100 * 100 * 3), "100x100x3, expected 224x224x3"),
+    (header(count=0), "1 to 4 images, not 0"),
+    (header(count=5) + bytes(5 * 224 * 224 * 3), "1 to 4 images, not 5"),
+    (header(count=2) + bytes(224 * 224 * 3), "must be 301072 bytes"),
+    (header() + bytes(224 * 224 * 3 + 1), "must be 150544 bytes"),
+])
+def test_malformed_frames_are_rejected(body, message):
+    with pytest.raises(FrameError, match=message):
+        parse_frame(body, max_images=4)
+    assert FrameError.status_code == 400
+
+
+@pytest.fixture(scope="module")
+def client():
+    with pytest.MonkeyPatch.context() as patch:
+        # The app keeps its model state after shutdown, so /readyz would see the model another module started
+        patch.setattr(main, "deployment", None)
+        patch.setitem(main.model_state, "ready", False)
+        patch.setattr(predict_model, "current", None)
+        with TestClient(main.app) as client:
+            for _ in range(200):
+                if client.get("/readyz").status_code == 200:
+                    break
+                time.sleep(0.05)
+            else:
+                pytest.fail("The model never became ready")
+            yield client
+
+
+def post_frame(client, body, content_type=CONTENT_TYPE):
+    return client.post("/predict-skin-lesion/tensor", content=body, headers={"content-type": content_type})
+
+
+def test_single_image_frame_matches_the_upload_endpoint(client):
+    image = read_test_image()
+    frame = post_frame(client, encode_frame(np.asarray(decode_image(image))))
+    upload = client.post("/predict-skin-lesion", files={"file": ("skin.jpeg", image, "image/jpeg")})
+    assert frame.status_code == 200
+    assert frame.json() == upload.json()
+
+
+def test_multi_image_frame_streams_one_line_per_image(client):
+    response = post_frame(client, encode_frame(pixels(3)))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(line["index"] for line in lines) == [0, 1, 2]
+    assert all(line["success"] for line in lines)
+
+
+def test_frame_endpoint_rejects_other_content_types(client):
+    assert post_frame(client, encode_frame(pixels(1)), content_type="image/jpeg").status_code == 415
+
+
+def test_frame_endpoint_rejects_malformed_frames(client):
+    response = post_frame(client, header(count=2) + bytes(10))
+    assert response.status_code == 400
+    assert "must be" in response.json()["detail"]
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue
+
+
+@pytest.fixture
+def job_queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), max_attempts=2, retry_backoff_seconds=0.0, lease_seconds=0.2)
+    yield queue
+    queue.close()
+
+
+def test_claim_leases_a_job_to_one_worker(job_queue):
+    job_id = job_queue.enqueue(b"image")
+    assert job_queue.claim(10) == [(job_id, b"image", 1)]
+    # Leased, so another worker (or this one) doesn't claim it again
+    assert job_queue.claim(10) == []
+    assert job_queue.get(job_id)["status"] == RUNNING
+
+
+def test_expired_lease_is_claimed_again_until_attempts_run_out(job_queue):
+    job_id = job_queue.enqueue(b"image")
+    job_queue.claim(10)
+    # The worker holding the lease died; the job comes back once the lease expires
+    time.sleep(0.25)
+    assert job_queue.claim(10) == [(job_id, b"image", 2)]
+    time.sleep(0.25)
+    assert job_queue.claim(10) == []
+    job = job_queue.get(job_id)
+    assert job["status"] == FAILED
+    assert job["error"] == "Worker lost while scoring this job"
+
+
+def test_complete_stores_the_result(job_queue):
+    job_id = job_queue.enqueue(b"image")
+    job_queue.claim(10)
+    job_queue.complete(job_id, b'{"success": true}')
+    job = job_queue.get(job_id)
+    assert job["status"] == DONE
+    assert job["result"] == b'{"success": true}'
+    # Finished jobs are not claimed again, even after the lease would have expired
+    time.sleep(0.25)
+    assert job_queue.claim(10) == []
+
+
+def test_failed_attempts_are_retried_then_marked_failed(job_queue):
+    job_id = job_queue.enqueue(b"image")
+    (_, _, attempt), = job_queue.claim(10)
+    assert job_queue.fail(job_id, attempt, "boom") == QUEUED
+    (_, _, attempt), = job_queue.claim(10)
+    assert attempt == 2
+    assert job_queue.fail(job_id, attempt, "boom") == FAILED
+    assert job_queue.get(job_id)["status"] == FAILED
+    assert job_queue.counts() == {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 1}
+
+
+def test_claim_respects_the_limit_and_pending_counts_leased_jobs(job_queue):
+    ids = {job_queue.enqueue(b"image") for _ in range(3)}
+    claimed = job_queue.claim(2)
+    assert len(claimed) == 2
+    assert {job_id for job_id, _, _ in claimed} < ids
+    assert job_queue.pending() == 3
+
+
+def test_expired_results_are_purged(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), result_ttl_seconds=-1)
+    try:
+        job_id = queue.enqueue(b"image")
+        queue.claim(1)
+        queue.complete(job_id, b"{}")
+        assert queue.get(job_id) is None
+        assert queue.purge_expired() == 1
+    finally:
+        queue.close()
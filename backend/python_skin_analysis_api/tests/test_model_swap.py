@@ -0,0 +1,118 @@
+"""
+Hot-swapping the model while requests are in flight, end to end through the app on the stub engine
+"""
+
+import asyncio
+import os
+import shutil
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import config
+import main
+import predict_model
+from decode_helpers import read_test_image
+from model_registry import LABELS_FILE
+
+VERSIONS = ("v1", "v2")
+ADMIN_TOKEN = "test-token"
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    registry = tmp_path_factory.mktemp("models")
+    for version in VERSIONS:
+        os.makedirs(registry / version)
+        # The stub engine's artifact is its labels file
+        shutil.copyfile(predict_model.LABELS_PATH, registry / version / LABELS_FILE)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(config, "SKIN_API_MODEL_REGISTRY", str(registry))
+        patch.setattr(config, "SKIN_API_EMBEDDING_INDEX_DIR", str(tmp_path_factory.mktemp("embeddings")))
+        patch.setattr(config, "SKIN_API_MODEL_WATCH_SECONDS", 0.0)
+        patch.setattr(config, "SKIN_API_ADMIN_TOKEN", ADMIN_TOKEN)
+        # Every request reaches the model, so each one really is in flight during the swap
+        patch.setattr(config, "SKIN_API_CACHE_SIZE", 0)
+        patch.setattr(predict_model, "current", None)
+        with TestClient(main.app) as client:
+            for _ in range(200):
+                if client.get("/readyz").status_code == 200:
+                    break
+                time.sleep(0.05)
+            else:
+                pytest.fail("The model never became ready")
+            yield client
+
+
+def other_version():
+    return VERSIONS[1] if main.deployment.version == VERSIONS[0] else VERSIONS[0]
+
+
+def post_within(client, seconds, url):
+    """POST the test image, failing instead of hanging if no response comes back in time"""
+    result = {}
+
+    def send():
+        result["response"] = client.post(url, files={"file": ("skin.jpeg", read_test_image(), "image/jpeg")})
+
+    thread = threading.Thread(target=send, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    if thread.is_alive():
+        pytest.fail(f"POST {url} hung")
+    return result["response"]
+
+
+async def wait_until_retired(previous):
+    while previous.batcher._thread is not None:
+        await asyncio.sleep(0.01)
+
+
+def test_similar_uses_the_model_swapped_in_while_its_upload_was_read(client, monkeypatch):
+    read_upload = main.read_upload
+    swapped = {}
+
+    async def read_then_swap(*args):
+        image_bytes = await read_upload(*args)
+        previous = main.deployment
+        swapped["from"], _ = await main.swap_model(other_version())
+        # The version that was active when the request came in is shut down before the request goes on
+        await wait_until_retired(previous)
+        return image_bytes
+
+    monkeypatch.setattr(main, "read_upload", read_then_swap)
+    response = post_within(client, 30, "/similar")
+    assert response.status_code == 200, response.text
+    assert response.json()["modelVersion"] == main.deployment.version != swapped["from"]
+
+
+def test_prediction_in_flight_finishes_on_the_version_it_started_with(client, monkeypatch):
+    executor = main.executor
+    decode = executor.decode
+    swapped = {}
+
+    async def swap_then_decode(prepare, payload):
+        swapped["previous"] = main.deployment
+        await main.swap_model(other_version())
+        return await decode(prepare, payload)
+
+    monkeypatch.setattr(executor, "decode", swap_then_decode)
+    response = post_within(client, 30, "/predict-skin-lesion")
+    assert response.status_code == 200, response.text
+    previous = swapped["previous"]
+    assert response.json()["modelVersion"] == previous.version != main.deployment.version
+    # Retired only once the request was done with it
+    assert previous.retired
+
+
+def test_requests_after_a_swap_use_the_new_version(client):
+    version = other_version()
+    response = client.post(
+        "/admin/models/activate", params={"version": version}, headers={"Authorization": f"Bearer {ADMIN_TOKEN}"}
+    )
+    assert response.status_code == 200, response.text
+    response = post_within(client, 30, "/predict-skin-lesion")
+    assert response.status_code == 200, response.text
+    assert response.json()["modelVersion"] == version
@@ -0,0 +1,93 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from decode_helpers import read_test_image
+from preprocessing import (
+    INPUT_SHAPE, decode_image_sized, legacy_preprocess_bytes, preprocess_array, preprocess_batch, preprocess_bytes,
+    resnet_preprocess,
+)
+
+
+def keras_preprocess_input(pixels):
+    """keras.applications.resnet.preprocess_input ('caffe' mode), written out"""
+    bgr = np.asarray(pixels, dtype=np.float32)[..., ::-1]
+    return bgr - np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+
+def encode(img, image_format, **params):
+    buffer = io.BytesIO()
+    img.save(buffer, format=image_format, **params)
+    return buffer.getvalue()
+
+
+def gradient(width, height):
+    """A smooth RGB test pattern, which survives JPEG and downscaling without aliasing"""
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    return Image.fromarray(pixels.astype(np.uint8))
+
+
+def test_resnet_preprocess_matches_keras_preprocess_input():
+    pixels = np.random.default_rng(0).integers(0, 256, size=INPUT_SHAPE, dtype=np.uint8)
+    np.testing.assert_allclose(resnet_preprocess(pixels), keras_preprocess_input(pixels), atol=1e-4)
+
+
+def test_resnet_preprocess_writes_into_out():
+    pixels = np.full(INPUT_SHAPE, 200, dtype=np.uint8)
+    out = np.empty(INPUT_SHAPE, dtype=np.float32)
+    assert resnet_preprocess(pixels, out=out) is out
+    np.testing.assert_allclose(out[0, 0], [200 - 103.939, 200 - 116.779, 200 - 123.68], atol=1e-4)
+
+
+@pytest.mark.parametrize("image_format", ["PNG", "JPEG"])
+def test_images_draft_cannot_shrink_are_identical_to_the_legacy_path(image_format):
+    # At most twice the target size, so libjpeg has no smaller scale to decode at
+    buffer = encode(gradient(300, 260), image_format)
+    np.testing.assert_array_equal(preprocess_bytes(buffer), legacy_preprocess_bytes(buffer))
+    legacy = Image.open(io.BytesIO(buffer)).convert("RGB").resize((224, 224), Image.NEAREST)
+    np.testing.assert_allclose(preprocess_bytes(buffer), keras_preprocess_input(legacy), atol=1e-4)
+
+
+def test_large_jpeg_decoded_at_reduced_scale_stays_close_to_the_legacy_path():
+    buffer = encode(gradient(3000, 2000), "JPEG", quality=95)
+    img, original_size = decode_image_sized(buffer)
+    assert original_size == (3000, 2000)
+    assert img.size == (224, 224)
+    difference = np.abs(preprocess_bytes(buffer) - legacy_preprocess_bytes(buffer))
+    # The same bound `python preprocessing.py` enforces, in pixel levels
+    assert difference.mean() <= 4.0
+
+
+def test_test_image_stays_close_to_the_legacy_path():
+    buffer = read_test_image()
+    assert np.abs(preprocess_bytes(buffer) - legacy_preprocess_bytes(buffer)).mean() <= 4.0
+
+
+def test_exif_orientation_is_applied():
+    img = gradient(224, 224)
+    exif = Image.Exif()
+    # 6: the camera was rotated, so the image must be turned 90 degrees clockwise
+    exif[0x0112] = 6
+    rotated = preprocess_bytes(encode(img, "PNG", exif=exif.tobytes()))
+    upright = keras_preprocess_input(img.transpose(Image.Transpose.ROTATE_270))
+    np.testing.assert_allclose(rotated, upright, atol=1e-4)
+
+
+def test_preprocess_array_resizes_other_sizes():
+    img = gradient(448, 448)
+    result = preprocess_array(np.asarray(img))
+    assert result.shape == INPUT_SHAPE
+    np.testing.assert_allclose(result, keras_preprocess_input(img.resize((224, 224), Image.NEAREST)), atol=1e-4)
+
+
+def test_preprocess_batch_reuses_the_buffer():
+    buffers = [encode(gradient(224, 224), "PNG"), read_test_image()]
+    out = np.empty((4,) + INPUT_SHAPE, dtype=np.float32)
+    batch = preprocess_batch(buffers, out=out)
+    assert batch.shape == (2,) + INPUT_SHAPE
+    assert np.shares_memory(batch, out)
+    np.testing.assert_array_equal(batch[1], preprocess_bytes(buffers[1]))
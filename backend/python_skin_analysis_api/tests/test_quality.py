@@ -0,0 +1,132 @@
+import io
+import json
+import pickle
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import config
+import main
+from decode_helpers import read_test_image
+from preprocessing import INPUT_SHAPE, preprocess_bytes, preprocess_bytes_timed, preprocess_pixels_timed
+from quality import QualityError, check_quality, measure, preprocess_bytes_checked, preprocess_pixels_checked
+
+
+@pytest.fixture(autouse=True)
+def thresholds(monkeypatch):
+    monkeypatch.setattr(config, "SKIN_API_QUALITY_MIN_SIDE", 128)
+    monkeypatch.setattr(config, "SKIN_API_QUALITY_MAX_CLIPPED", 0.5)
+    monkeypatch.setattr(config, "SKIN_API_QUALITY_MIN_SHARPNESS", 10.0)
+
+
+def textured(level=128, seed=0):
+    """A sharp, well-exposed stand-in photo: noise around a mid-grey level"""
+    noise = np.random.default_rng(seed).integers(-40, 41, size=INPUT_SHAPE)
+    return np.clip(level + noise, 0, 255).astype(np.uint8)
+
+
+def encode(pixels, size=None):
+    img = Image.fromarray(pixels)
+    if size is not None:
+        img = img.resize(size)
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def failed_check(pixels, original_size=None):
+    with pytest.raises(QualityError) as error:
+        check_quality(pixels, original_size)
+    return error.value
+
+
+def test_the_gate_is_off_by_default():
+    # Turning it on changes the answer for small images from a prediction to a 422
+    assert not config.SKIN_API_QUALITY_GATE
+    assert main.prepare_bytes is preprocess_bytes_timed
+    assert main.prepare_pixels is preprocess_pixels_timed
+
+
+def test_a_good_photo_passes():
+    measurements = check_quality(textured(), original_size=(640, 480))
+    assert measurements["resolution"] == 480
+    assert measurements["sharpness"] > 10.0
+    assert measurements["underexposed"] == measurements["overexposed"] == 0
+
+
+def test_small_images_are_rejected():
+    error = failed_check(textured(), original_size=(200, 100))
+    assert (error.check, error.value, error.threshold) == ("resolution", 100, 128)
+    assert "128 pixels" in str(error)
+
+
+def test_dark_and_bright_images_are_rejected():
+    assert failed_check(np.full(INPUT_SHAPE, 3, dtype=np.uint8)).check == "underexposed"
+    assert failed_check(np.full(INPUT_SHAPE, 252, dtype=np.uint8)).check == "overexposed"
+    # Clipped on less than the allowed share of the image
+    pixels = textured()
+    pixels[:100] = 0
+    assert check_quality(pixels)["underexposed"] == pytest.approx(100 / 224)
+
+
+def test_flat_images_are_rejected_as_blurry():
+    error = failed_check(np.full(INPUT_SHAPE, 128, dtype=np.uint8))
+    assert error.check == "blur"
+    assert error.value == 0.0
+
+
+def test_exposure_is_checked_before_blur():
+    # A black image is flat as well as dark; "too dark" is the more useful answer
+    assert failed_check(np.zeros(INPUT_SHAPE, dtype=np.uint8)).check == "underexposed"
+
+
+def test_a_zero_threshold_disables_its_check(monkeypatch):
+    monkeypatch.setattr(config, "SKIN_API_QUALITY_MIN_SIDE", 0)
+    monkeypatch.setattr(config, "SKIN_API_QUALITY_MAX_CLIPPED", 0)
+    monkeypatch.setattr(config, "SKIN_API_QUALITY_MIN_SHARPNESS", 0)
+    check_quality(np.zeros(INPUT_SHAPE, dtype=np.uint8), original_size=(10, 10))
+
+
+def test_sharpness_is_the_laplacian_variance():
+    # A vertical edge: the Laplacian is +-255 on the two columns beside it and 0 elsewhere
+    pixels = np.zeros(INPUT_SHAPE, dtype=np.uint8)
+    pixels[:, 112:] = 255
+    laplacian = np.zeros((222, 222))
+    laplacian[:, 110] = 255
+    laplacian[:, 111] = -255
+    assert measure(pixels)["sharpness"] == pytest.approx(laplacian.var(), rel=1e-3)
+
+
+def test_checked_preprocessing_matches_the_unchecked_path():
+    buffer = read_test_image()
+    img_ready, timings = preprocess_bytes_checked(buffer)
+    np.testing.assert_array_equal(img_ready, preprocess_bytes(buffer))
+    assert set(timings) == {"decode", "quality", "preprocess"}
+
+
+def test_checked_preprocessing_uses_the_uploaded_size():
+    with pytest.raises(QualityError, match="too small"):
+        preprocess_bytes_checked(encode(textured(), size=(100, 300)))
+
+
+def test_frames_skip_the_resolution_check():
+    img_ready, timings = preprocess_pixels_checked(textured())
+    assert img_ready.shape == INPUT_SHAPE
+    assert set(timings) == {"quality", "preprocess"}
+    with pytest.raises(QualityError, match="too dark"):
+        preprocess_pixels_checked(np.zeros(INPUT_SHAPE, dtype=np.uint8))
+
+
+def test_quality_error_survives_a_process_pool():
+    error = pickle.loads(pickle.dumps(QualityError("blur", 3.25, 10.0)))
+    assert (error.check, error.value, error.threshold) == ("blur", 3.25, 10.0)
+    assert error.status_code == 422
+
+
+def test_rejection_json():
+    body = json.loads(QualityError("underexposed", 0.91234567, 0.5).to_json(index=2))
+    assert list(body) == ["index", "success", "error", "quality"]
+    assert body["success"] is False
+    assert body["error"].startswith("Image is too dark")
+    assert body["quality"] == {"check": "underexposed", "value": 0.9123, "threshold": 0.5}
@@ -0,0 +1,99 @@
+import json
+
+import numpy as np
+import pytest
+
+import predict_model
+from predict_model import ModelLoadError, build_response_table, load_knowledge_base, load_version
+
+
+@pytest.fixture(scope="module")
+def labels():
+    with open(predict_model.LABELS_PATH, "r") as f:
+        return json.load(f)["inv_class_indices"]
+
+
+@pytest.fixture(scope="module")
+def knowledge_base():
+    return load_knowledge_base(predict_model.KNOWLEDGE_BASE_PATH)
+
+
+@pytest.fixture(scope="module")
+def model():
+    model, _ = load_version(predict_model.LABELS_PATH, predict_model.LABELS_PATH, predict_model.KNOWLEDGE_BASE_PATH,
+                            version="v1", engine_name="stub")
+    return model
+
+
+def one_hot(index, size, confidence=0.9):
+    probabilities = np.full(size, (1 - confidence) / (size - 1), dtype=np.float32)
+    probabilities[index] = confidence
+    return probabilities
+
+
+def test_every_class_has_a_precompiled_response(labels, knowledge_base):
+    table = build_response_table(labels, knowledge_base, "v1")
+    assert len(table) == len(labels)
+    for index, entry in enumerate(table):
+        data = knowledge_base[labels[str(index)]]
+        assert entry["condition"] == data.get("condition", labels[str(index)])
+        assert entry["static"]["severity"] == data["severity"]
+
+
+def test_serialized_response_matches_the_dict_response(model):
+    size = len(model.response_table)
+    for index in range(size):
+        probabilities = one_hot(index, size)
+        assert json.loads(model.build_response_bytes(probabilities)) == model.build_response(probabilities)
+
+
+def test_response_fields(model, labels, knowledge_base):
+    response = json.loads(model.build_response_bytes(one_hot(3, len(labels), confidence=0.4567)))
+    assert response["success"] is True
+    assert response["modelVersion"] == "v1"
+    assert "cascadeStage" not in response
+    analysis = response["analysis"]
+    assert analysis["confidence"] == 45.67
+    data = knowledge_base[labels["3"]]
+    assert analysis["condition"] == data.get("condition", labels["3"])
+    assert analysis["recommendations"] == data["recommendations"]
+    assert analysis["possibleCauses"] == data["possibleCauses"]
+
+
+def test_knowledge_base_can_rename_a_condition(labels, knowledge_base):
+    renamed = {**knowledge_base, labels["0"]: {**knowledge_base[labels["0"]], "condition": "Renamed"}}
+    table = build_response_table(labels, renamed, "v1")
+    assert table[0]["condition"] == "Renamed"
+    assert b'"condition":"Renamed"' in table[0]["prefix"]
+
+
+def test_stage_is_recorded_in_every_response(labels, knowledge_base):
+    table = build_response_table(labels, knowledge_base, "v1", stage="first")
+    assert all(b'"cascadeStage":"first"' in entry["prefix"] for entry in table)
+
+
+def test_classes_missing_from_the_knowledge_base_are_rejected(labels, knowledge_base):
+    incomplete = {name: data for name, data in knowledge_base.items() if name != labels["2"]}
+    with pytest.raises(ModelLoadError, match=labels["2"]):
+        build_response_table(labels, incomplete, "v1")
+
+
+def test_class_indices_must_be_contiguous(labels, knowledge_base):
+    gap = {str(int(index) + (1 if int(index) > 0 else 0)): name for index, name in labels.items()}
+    with pytest.raises(ModelLoadError, match="Class indices"):
+        build_response_table(gap, knowledge_base, "v1")
+
+
+def test_unreadable_knowledge_base_is_a_load_error(tmp_path):
+    path = tmp_path / "knowledge_base.json"
+    path.write_text("{not json")
+    with pytest.raises(ModelLoadError, match="knowledge base"):
+        load_knowledge_base(str(path))
+
+
+def test_warm_up_rejects_a_model_whose_outputs_do_not_match_the_labels():
+    model, _ = load_version(predict_model.LABELS_PATH, predict_model.LABELS_PATH, predict_model.KNOWLEDGE_BASE_PATH,
+                            version="v1", engine_name="stub")
+    model.response_table = model.response_table[:-1]
+    with pytest.raises(ModelLoadError, match="classes"):
+        model.warm_up([1])
@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from executor import InferenceExecutor, QueueFullError
+from uploads import (
+    RequestSizeLimitMiddleware, UnsupportedImageError, UploadTooLargeError, read_upload, sniff_image_format,
+)
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
+
+class FakeUpload:
+    """The part of UploadFile that read_upload uses"""
+
+    def __init__(self, data, size=None):
+        self.data = data
+        self.size = size
+        self.reads = 0
+
+    async def read(self, size):
+        self.reads += 1
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+
+@pytest.mark.parametrize("header, image_format", [
+    (b"\xff\xd8\xff\xe0", "jpeg"),
+    (PNG_HEADER, "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM\x00\x00", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"RIFF\x00\x00\x00\x00WEBPVP8 ", "webp"),
+])
+def test_sniffs_supported_formats(header, image_format):
+    assert sniff_image_format(header) == image_format
+
+
+@pytest.mark.parametrize("header", [b"", b"%PDF-1.7", b"<html>", b"RIFF\x00\x00\x00\x00WAVEfmt ", b"\x89PNX"])
+def test_rejects_other_content(header):
+    assert sniff_image_format(header) is None
+
+
+def test_reads_an_upload_in_chunks():
+    data = PNG_HEADER + bytes(100)
+    upload = FakeUpload(data)
+    assert asyncio.run(read_upload(upload, max_bytes=1000, chunk_size=16)) == data
+    assert upload.reads == 8
+
+
+def test_non_images_are_rejected_after_the_first_chunk():
+    upload = FakeUpload(b"%PDF-1.7" + bytes(1000))
+    with pytest.raises(UnsupportedImageError):
+        asyncio.run(read_upload(upload, max_bytes=10_000, chunk_size=16))
+    assert upload.reads == 1
+    assert UnsupportedImageError.status_code == 400
+
+
+def test_empty_uploads_are_rejected():
+    with pytest.raises(UnsupportedImageError):
+        asyncio.run(read_upload(FakeUpload(b""), max_bytes=1000))
+
+
+def test_declared_size_over_the_limit_is_rejected_before_reading():
+    upload = FakeUpload(PNG_HEADER, size=2000)
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(read_upload(upload, max_bytes=1000))
+    assert upload.reads == 0
+    assert UploadTooLargeError.status_code == 413
+
+
+def test_undeclared_size_is_counted_while_reading():
+    upload = FakeUpload(PNG_HEADER + bytes(5000))
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(read_upload(upload, max_bytes=1000, chunk_size=256))
+    # Stops at the chunk that crosses the limit instead of reading the rest
+    assert upload.reads == 4
+
+
+@pytest.fixture(scope="module")
+def limited_client():
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        return {"received": len(await request.body())}
+
+    @app.post("/other")
+    async def other(request: Request):
+        return {"received": len(await request.body())}
+
+    app.add_middleware(RequestSizeLimitMiddleware, max_body_bytes=1000, paths=["/upload"])
+    return TestClient(app)
+
+
+def test_middleware_passes_bodies_within_the_limit(limited_client):
+    response = limited_client.post("/upload", content=bytes(1000))
+    assert response.status_code == 200
+    assert response.json() == {"received": 1000}
+
+
+def test_middleware_rejects_a_content_length_over_the_limit(limited_client):
+    response = limited_client.post("/upload", content=bytes(1001))
+    assert response.status_code == 413
+
+
+def test_middleware_counts_chunked_bodies(limited_client):
+    def chunks():
+        for _ in range(5):
+            yield bytes(300)
+
+    response = limited_client.post("/upload", content=chunks())
+    assert response.status_code == 413
+
+
+def test_middleware_only_guards_its_paths(limited_client):
+    assert limited_client.post("/other", content=bytes(5000)).status_code == 200
+
+
+def test_admission_sheds_past_the_latency_budget():
+    async def scenario():
+        executor = InferenceExecutor(kind="thread", max_workers=1, max_queue_depth=64, latency_budget_ms=100)
+        try:
+            # 60 ms per image: a request fits the budget alone, but not behind another one
+            executor.observe_batch(1, 0.06)
+            executor.check_admission()
+            async with executor.admit():
+                with pytest.raises(QueueFullError) as budget:
+                    executor.check_admission()
+            return budget.value
+        finally:
+            executor.shutdown()
+
+    budget = asyncio.run(scenario())
+    assert budget.reason == "latency_budget"
+    assert budget.retry_after == 1
@@ -0,0 +1,120 @@
+"""
+Bounded reading and validation of uploaded images
+Uploads are read in chunks with a size limit, and the format is checked against the file's magic bytes
+from the first chunk instead of trusting the client-supplied content type
+"""
+
+import json
+
+from starlette.exceptions import HTTPException
+
+# Leading bytes of the image formats Pillow can decode for the model
+MAGIC_BYTES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+
+
+class UploadError(Exception):
+    """An upload that was rejected before decoding; status_code is the HTTP status to answer with"""
+    status_code = 400
+
+
+class UnsupportedImageError(UploadError):
+    """The upload does not start with the magic bytes of a supported image format"""
+
+
+class UploadTooLargeError(UploadError):
+    """The upload (or the whole request body) is larger than the configured limit"""
+    status_code = 413
+
+
+def sniff_image_format(header):
+    """Return the image format for the first bytes of a file, or None if it isn't a supported image"""
+    for magic, image_format in MAGIC_BYTES:
+        if header.startswith(magic):
+            return image_format
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+async def read_upload(file, max_bytes, chunk_size=64 * 1024):
+    """
+    Read an UploadFile in chunks and return its bytes
+    Raises UnsupportedImageError as soon as the first chunk is not an image,
+    and UploadTooLargeError once more than max_bytes have been read
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise UploadTooLargeError(f"Image is larger than {max_bytes} bytes")
+
+    chunks = []
+    total = 0
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        if not chunks and sniff_image_format(chunk[:16]) is None:
+            raise UnsupportedImageError("File must be an image")
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLargeError(f"Image is larger than {max_bytes} bytes")
+        chunks.append(chunk)
+
+    if not chunks:
+        raise UnsupportedImageError("File must be an image")
+    return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+
+class RequestSizeLimitMiddleware:
+    """
+    ASGI middleware that answers 413 for request bodies over max_body_bytes
+    Checks Content-Length up front, and counts bytes as they arrive for chunked uploads,
+    so an oversized body is refused before the multipart parser spools all of it
+    """
+
+    def __init__(self, app, max_body_bytes, paths=None):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+        self.paths = tuple(paths) if paths else None
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": f"Request body is larger than {self.max_body_bytes} bytes"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or self.max_body_bytes <= 0
+                or (self.paths is not None and not scope["path"].startswith(self.paths))):
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > self.max_body_bytes:
+                await self._reject(send)
+                return
+
+        received = 0
+
+        async def limited_receive():
+            # Raised as an HTTPException so FastAPI's body parsing passes it through as a 413
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    raise HTTPException(
+                        status_code=413, detail=f"Request body is larger than {self.max_body_bytes} bytes"
+                    )
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -78,8 +78,9 @@ def test_model_loading():
         print(f"Labels path: {LABELS_PATH}")
         
         # Try to load the model
-        from predict_model import model
-        print("✅ Model loaded successfully")
+        from predict_model import load_model
+        timings = load_model()
+        print(f"✅ Model loaded successfully ({', '.join(f'{k} {v:.2f}s' for k, v in timings.items())})")
         return True
     except Exception as e:
         print(f"❌ Error loading model: {e}")
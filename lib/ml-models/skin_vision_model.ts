@@ -1,40 +1,149 @@
-import { spawn } from 'child_process';
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
+import { existsSync } from 'fs';
+import { createInterface } from 'readline';
 import path from 'path';
 
-export async function predict(imagePath: string): Promise<{
+type SkinVisionPrediction = {
   prediction: string;
   confidence: number;
   class: string;
-}> {
-  return new Promise((resolve, reject) => {
-    const pythonProcess = spawn('python', [
-      path.join(process.cwd(), 'scripts', 'skin_vision_inference.py'),
-      imagePath
-    ]);
+};
+
+type PendingRequest = {
+  worker: ChildProcessWithoutNullStreams;
+  timer: ReturnType<typeof setTimeout>;
+  resolve: (prediction: SkinVisionPrediction) => void;
+  reject: (error: Error) => void;
+};
+
+// A single long-running Python worker saves a Python start-up per request;
+// responses are matched to requests by id.
+let worker: ChildProcessWithoutNullStreams | null = null;
+let nextRequestId = 0;
+const pending = new Map<string, PendingRequest>();
+
+// Only the end of the worker's stderr is kept for the exit error; a chatty
+// worker would otherwise grow this string for as long as it lives.
+const MAX_STDERR_CHARS = 8192;
+
+// Interpreter that runs the worker, e.g. a virtualenv's python or python3.
+const PYTHON = process.env.SKIN_VISION_PYTHON || 'python';
+
+// A request that gets no answer in this time fails, and its worker is
+// replaced: a worker that stopped answering one request is not trusted
+// with the next.
+const TIMEOUT_MS = Number(process.env.SKIN_VISION_TIMEOUT_MS) || 30000;
+
+// The script lives in scripts/ at the project root, two levels above this
+// module. When the module has been bundled (e.g. into .next/server) that
+// path no longer exists, so fall back to the project root the server
+// runs from.
+function scriptPath(): string {
+  const besideModule = path.resolve(__dirname, '..', '..', 'scripts', 'skin_vision_inference.py');
+  if (existsSync(besideModule)) {
+    return besideModule;
+  }
+  return path.join(process.cwd(), 'scripts', 'skin_vision_inference.py');
+}
+
+function settle(id: string): PendingRequest | undefined {
+  const request = pending.get(id);
+  if (request) {
+    pending.delete(id);
+    clearTimeout(request.timer);
+  }
+  return request;
+}
+
+function rejectPending(child: ChildProcessWithoutNullStreams, error: Error) {
+  pending.forEach((request, id) => {
+    if (request.worker === child) {
+      settle(id);
+      request.reject(error);
+    }
+  });
+}
+
+// Stop handing requests to a worker, fail the ones it still holds and kill it.
+// A replacement worker may already be running by the time an old one reports
+// its exit, so only touch the slot and requests this child holds.
+function retire(child: ChildProcessWithoutNullStreams, error: Error) {
+  if (worker === child) {
+    worker = null;
+  }
+  rejectPending(child, error);
+}
 
-    let result = '';
-    let error = '';
+function getWorker(): ChildProcessWithoutNullStreams {
+  if (worker) {
+    return worker;
+  }
 
-    pythonProcess.stdout.on('data', (data) => {
-      result += data.toString();
-    });
+  const child = spawn(PYTHON, [scriptPath(), '--serve']);
 
-    pythonProcess.stderr.on('data', (data) => {
-      error += data.toString();
-    });
+  let error = '';
+  child.stderr.on('data', (data) => {
+    error = (error + data.toString()).slice(-MAX_STDERR_CHARS);
+  });
+
+  createInterface({ input: child.stdout }).on('line', (line) => {
+    let message: any;
+    try {
+      message = JSON.parse(line);
+    } catch (e) {
+      console.error(`Failed to parse prediction result: ${e}`);
+      return;
+    }
+
+    if (message.ready) {
+      return;
+    }
+
+    // A request that timed out is already settled; its late answer is dropped.
+    const request = settle(message.id);
+    if (!request) {
+      return;
+    }
+
+    if (message.error) {
+      request.reject(new Error(message.error));
+    } else {
+      const { id, ...prediction } = message;
+      request.resolve(prediction);
+    }
+  });
+
+  child.on('close', (code) => {
+    retire(child, new Error(`Python process exited with code ${code}: ${error}`));
+  });
 
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        reject(new Error(`Python process exited with code ${code}: ${error}`));
+  child.on('error', (e) => retire(child, e));
+
+  // Writing to a worker that has died fails with EPIPE on stdin; unhandled,
+  // that error would crash the Node process.
+  child.stdin.on('error', (e) => {
+    retire(child, e);
+    child.kill();
+  });
+
+  worker = child;
+  return child;
+}
+
+export async function predict(imagePath: string): Promise<SkinVisionPrediction> {
+  return new Promise((resolve, reject) => {
+    const id = String(nextRequestId++);
+    const child = getWorker();
+    const timer = setTimeout(() => {
+      if (!settle(id)) {
         return;
       }
+      reject(new Error(`Prediction timed out after ${TIMEOUT_MS} ms`));
+      retire(child, new Error('Python worker was restarted after another request timed out'));
+      child.kill();
+    }, TIMEOUT_MS);
+    pending.set(id, { worker: child, timer, resolve, reject });
 
-      try {
-        const prediction = JSON.parse(result);
-        resolve(prediction);
-      } catch (e) {
-        reject(new Error(`Failed to parse prediction result: ${e}`));
-      }
-    });
+    child.stdin.write(JSON.stringify({ id, image_path: imagePath }) + '\n');
   });
 }
@@ -1,9 +1,15 @@
 import sys
 import json
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import numpy as np
 from PIL import Image
-import tensorflow as tf
+
+# Number of requests a server-mode worker scores concurrently
+MAX_IN_FLIGHT = int(os.environ.get('SKIN_VISION_MAX_IN_FLIGHT', '4'))
 
 def load_and_preprocess_image(image_path):
     img = Image.open(image_path)
@@ -12,35 +18,108 @@ def load_and_preprocess_image(image_path):
     img_array = img_array / 255.0  # Normalize
     return np.expand_dims(img_array, axis=0)
 
+def run_prediction(image_path):
+    """Score one image and return the prediction dict; raises on failure"""
+    if not Path(image_path).exists():
+        raise FileNotFoundError(f'Image not found: {image_path}')
+
+    # Load and preprocess the image
+    processed_image = load_and_preprocess_image(image_path)
+
+    # For demo purposes, return a mock prediction
+    # In production, you would load your trained model here
+    classes = ['benign', 'malignant']
+    return {
+        'prediction': 'benign',
+        'confidence': 0.92,
+        'class': 'benign_nevus'
+    }
+
 def predict_image(image_path):
     try:
-        # Load and preprocess the image
-        processed_image = load_and_preprocess_image(image_path)
-        
-        # For demo purposes, return a mock prediction
-        # In production, you would load your trained model here
-        classes = ['benign', 'malignant']
-        mock_prediction = {
-            'prediction': 'benign',
-            'confidence': 0.92,
-            'class': 'benign_nevus'
-        }
-        
-        print(json.dumps(mock_prediction))
+        print(json.dumps(run_prediction(image_path)))
         sys.stdout.flush()
         return 0
     except Exception as e:
         print(json.dumps({'error': str(e)}), file=sys.stderr)
         return 1
 
+def handle_request(line):
+    """Handle one JSON-lines request: {"id": ..., "image_path": ...} -> {"id": ..., ...result}"""
+    request_id = None
+    try:
+        request = json.loads(line)
+        request_id = request.get('id')
+        result = run_prediction(request['image_path'])
+        return {'id': request_id, **result}
+    except Exception as e:
+        return {'id': request_id, 'error': str(e)}
+
+def serve_stream(reader, writer):
+    """Read JSON-lines requests until EOF, answering each as soon as it is scored
+
+    Responses can come back out of order, so callers match them by "id".
+    """
+    write_lock = threading.Lock()
+
+    def respond(line):
+        response = json.dumps(handle_request(line))
+        with write_lock:
+            writer.write(response + '\n')
+            writer.flush()
+
+    with ThreadPoolExecutor(max_workers=MAX_IN_FLIGHT) as pool:
+        for line in reader:
+            if line.strip():
+                pool.submit(respond, line)
+
+def serve_socket(socket_path):
+    """Serve the JSON-lines protocol on a Unix domain socket, one thread per connection"""
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+    print(json.dumps({'ready': True, 'socket': socket_path}), file=sys.stderr)
+    sys.stderr.flush()
+
+    def handle_connection(conn):
+        with conn, conn.makefile('r') as reader, conn.makefile('w') as writer:
+            serve_stream(reader, writer)
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=handle_connection, args=(conn,), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(socket_path)
+
+def serve_stdio():
+    """Serve the JSON-lines protocol on stdin/stdout until stdin is closed"""
+    # Tell the parent process the worker is warm and ready for requests
+    print(json.dumps({'ready': True}))
+    sys.stdout.flush()
+    serve_stream(sys.stdin, sys.stdout)
+
 if __name__ == '__main__':
+    # Server mode: start once, then handle requests in a loop
+    if len(sys.argv) >= 2 and sys.argv[1] == '--serve':
+        if len(sys.argv) == 4 and sys.argv[2] == '--socket':
+            serve_socket(sys.argv[3])
+        else:
+            serve_stdio()
+        sys.exit(0)
+
     if len(sys.argv) != 2:
         print(json.dumps({'error': 'Image path not provided'}), file=sys.stderr)
         sys.exit(1)
-        
+
     image_path = sys.argv[1]
     if not Path(image_path).exists():
         print(json.dumps({'error': f'Image not found: {image_path}'}), file=sys.stderr)
         sys.exit(1)
-        
+
     sys.exit(predict_image(image_path))